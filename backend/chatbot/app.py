@@ -1,29 +1,41 @@
-from flask import Flask, request, jsonify
-import requests
+from flask import Flask, Response, request, jsonify, stream_with_context
 import logging
 import time
-import re
 import json
 import os
-from llama_cpp import Llama
+import threading
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 from flask_cors import CORS
+from batch_chat import batch_symbols, parse_queries, read_jsonl, run_batch
+from cache import TTLCache
+from comparison import MAX_QUERY_SYMBOLS, detect_symbols, fetch_quotes, load_quote, normalize_symbols, \
+    parse_batch_quotes
+from data_gathering import gather
+from esg_store import ESG_PREWARM_SYMBOLS, get_esg_store
+from inference import ModelUnavailableError, QueueFullError, get_inference_scheduler
+from logging_config import configure_logging, current_request_id, new_request_id
+from market_data import market_data_client
+from market_refresher import MARKET_REFRESH_ENABLED, MARKET_REFRESH_RESERVE, MarketRefresher, Watchlist
+from metrics import CHAT_REQUESTS, CHAT_STAGE_SECONDS, TICKER_PAGES_FETCHED, Gauge, render
+from prompt_budget import classify_query, get_token_counter, plan_prompt
+from prompts import extract_ticker_data, screened_summary, summarize_market_data
+from response_cache import response_cache, response_key
+from screener import MarketScreener, parse_screen
+from ticker_directory import TickerDirectory
+from ticker_snapshot import TICKER_SNAPSHOT_PATH
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)
 
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("finance_api.log"),
-        logging.StreamHandler()
-    ]
-)
+# Setup logging (records are written by a background thread, see logging_config.py)
+configure_logging()
 logger = logging.getLogger(__name__)
 
-# API Configuration
-YAHOO_TICKERS_URL = "https://yahoo-finance15.p.rapidapi.com/api/v2/markets/tickers"
+# API Configuration (the base URLs can point at bench/mock_rapidapi.py for offline runs)
+YAHOO_FINANCE_BASE_URL = os.environ.get("YAHOO_FINANCE_BASE_URL", "https://yahoo-finance15.p.rapidapi.com")
+ESG_API_BASE_URL = os.environ.get("ESG_API_BASE_URL", "https://yahoo-finance127.p.rapidapi.com")
+
+YAHOO_TICKERS_URL = f"{YAHOO_FINANCE_BASE_URL}/api/v2/markets/tickers"
 YAHOO_TICKERS_HEADERS = {
     "x-rapidapi-host": "yahoo-finance15.p.rapidapi.com",
     "x-rapidapi-key": "e5dfb69ac4msh7dcab92ff8a5633p1e73d2jsncf8f43e4a966",
@@ -32,10 +44,11 @@ YAHOO_TICKERS_HEADERS = {
     "Accept-Encoding": "identity"
 }
 
-REALTIME_QUOTE_URL = "https://yahoo-finance15.p.rapidapi.com/api/v1/markets/quote"
+REALTIME_QUOTE_URL = f"{YAHOO_FINANCE_BASE_URL}/api/v1/markets/quote"
 REALTIME_QUOTE_HEADERS = YAHOO_TICKERS_HEADERS
+BATCH_QUOTE_URL = f"{YAHOO_FINANCE_BASE_URL}/api/v1/markets/stock/quotes"
 
-ESG_API_URL_TEMPLATE = "https://yahoo-finance127.p.rapidapi.com/esg-scores/{symbol}"
+ESG_API_URL_TEMPLATE = ESG_API_BASE_URL + "/esg-scores/{symbol}"
 ESG_API_HEADERS = {
     "x-rapidapi-host": "yahoo-finance127.p.rapidapi.com",
     "x-rapidapi-key": "e5dfb69ac4msh7dcab92ff8a5633p1e73d2jsncf8f43e4a966",
@@ -44,346 +57,485 @@ ESG_API_HEADERS = {
     "Accept-Encoding": "identity"
 }
 
+# Overall time budget for the quote, ticker and ESG lookups of one chat request
+DATA_GATHER_TIMEOUT = float(os.environ.get("DATA_GATHER_TIMEOUT", "12"))  # seconds
+
+# Ticker directory configuration
+TICKER_DIRECTORY_MAX_PAGES = int(os.environ.get("TICKER_DIRECTORY_MAX_PAGES", "200"))
+TICKER_REFRESH_INTERVAL = int(os.environ.get("TICKER_REFRESH_INTERVAL", "3600"))  # seconds
+
+# Generation configuration
+GENERATION_PARAMS = {
+    "max_tokens": 800,
+    "temperature": 0.7,
+    "top_p": 0.95,
+}
+GENERATION_TIMEOUT = float(os.environ.get("GENERATION_TIMEOUT", "300"))  # seconds a request waits for its completion
+MODEL_UNAVAILABLE_MESSAGE = "I'm sorry, but I'm unable to process your request at the moment due to a technical issue with the language model."
+GENERATION_ERROR_MESSAGE = "I apologize, but I encountered an error while processing your request. Please try again with a different query."
+
+# Quote cache configuration
+QUOTE_CACHE_TTL = float(os.environ.get("QUOTE_CACHE_TTL", "5"))  # seconds
+QUOTE_CACHE_SIZE = int(os.environ.get("QUOTE_CACHE_SIZE", "512"))
+QUOTE_STALE_TTL = float(os.environ.get("QUOTE_STALE_TTL", "300"))  # seconds a quote is served when the API is unavailable
+
 # Model configuration
-MODEL_FILENAME = "finance-chat.Q8_0.gguf"
+MODEL_FILENAME = os.environ.get("MODEL_PATH", "finance-chat.Q8_0.gguf")
+MODEL_LOAD_MODE = os.environ.get("MODEL_LOAD_MODE", "background")  # "background" serves while loading, "blocking" loads first
 
-# Initialize Llama model
-llama_model = None
+quote_cache = TTLCache(maxsize=QUOTE_CACHE_SIZE, ttl=QUOTE_CACHE_TTL, name="quote", stale_ttl=QUOTE_STALE_TTL)
 
 def get_all_ticker_pages(max_pages=20, symbol_to_find=None):
     """Fetch ticker data from multiple pages."""
     all_tickers = []
-    found_symbol = False
     
     for page in range(1, max_pages + 1):
-        logger.info(f"Fetching ticker page {page}/{max_pages}")
-        try:
-            params = {"page": page, "type": "STOCKS"}
-            max_retries = 3
-            retry_delay = 2  # seconds
-            
-            for attempt in range(max_retries):
-                try:
-                    response = requests.get(
-                        YAHOO_TICKERS_URL, 
-                        headers=YAHOO_TICKERS_HEADERS, 
-                        params=params,
-                        timeout=10
-                    )
-                    
-                    if response.status_code == 200:
-                        data = response.json()
-                        if "body" in data and isinstance(data["body"], list):
-                            page_tickers = data["body"]
-                            all_tickers.extend(page_tickers)
-                            
-                            if symbol_to_find:
-                                for ticker in page_tickers:
-                                    if ticker.get("symbol") == symbol_to_find:
-                                        found_symbol = True
-                                        break
-                        break
-                    elif response.status_code == 429:  # Rate limit exceeded
-                        retry_after = int(response.headers.get('Retry-After', retry_delay * (attempt + 1)))
-                        time.sleep(retry_after)
-                    else:
-                        logger.error(f"Error fetching page {page}: Status {response.status_code}")
-                        break
-                except requests.exceptions.RequestException as e:
-                    logger.error(f"Request exception on page {page}, attempt {attempt+1}: {str(e)}")
-                    if attempt < max_retries - 1:
-                        time.sleep(retry_delay * (attempt + 1))
-                    else:
-                        logger.error(f"Max retries reached for page {page}")
-            
-            if found_symbol:
-                break
-        except Exception as e:
-            logger.exception(f"Unexpected error fetching page {page}: {str(e)}")
+        logger.info("Fetching ticker page %s/%s", page, max_pages)
+        data = market_data_client.get_json(
+            YAHOO_TICKERS_URL,
+            headers=YAHOO_TICKERS_HEADERS,
+            params={"page": page, "type": "STOCKS"},
+            description=f"ticker page {page}"
+        )
+        if not isinstance(data, dict) or not isinstance(data.get("body"), list):
+            # A listing with a gap would replace a complete directory, keep the previous one instead
+            logger.warning("Ticker page %s failed, abandoning the listing", page)
+            return []
+        
+        page_tickers = data["body"]
+        TICKER_PAGES_FETCHED.inc()
+        if not page_tickers:
+            break
+        all_tickers.extend(page_tickers)
+        
+        if symbol_to_find and any(ticker.get("symbol") == symbol_to_find for ticker in page_tickers):
+            break
     
-    logger.info(f"Total tickers collected: {len(all_tickers)}")
+    logger.info("Total tickers collected: %s", len(all_tickers))
     return all_tickers
 
 def get_realtime_quote(symbol):
+    """Return real-time quote data for a ticker symbol, served from the quote cache when fresh."""
+    return load_quote(symbol, fetch_realtime_quote, quote_cache)
+
+def get_realtime_quotes(symbols, deadline):
+    """Return ``{symbol: quote data}`` for several symbols, batching upstream requests for cache misses."""
+    return fetch_quotes(symbols, fetch_realtime_quotes, fetch_realtime_quote, deadline, cache=quote_cache)
+
+def fetch_realtime_quotes(symbols):
+    """Fetch real-time quotes for several ticker symbols in one request."""
+    logger.info("Fetching real-time quotes for %s symbols", len(symbols))
+    data = market_data_client.get_json(
+        BATCH_QUOTE_URL,
+        headers=REALTIME_QUOTE_HEADERS,
+        params={"ticker": ",".join(symbols)},
+        description=f"real-time quotes for {len(symbols)} symbols"
+    )
+    return parse_batch_quotes(data)
+
+def fetch_realtime_quote(symbol):
     """Fetch real-time quote data for a specific ticker symbol."""
-    logger.info(f"Fetching real-time quote for: {symbol}")
-    try:
-        params = {"ticker": symbol, "type": "STOCKS"}
-        max_retries = 3
-        retry_delay = 2  # seconds
-        
-        for attempt in range(max_retries):
-            try:
-                response = requests.get(
-                    REALTIME_QUOTE_URL, 
-                    headers=REALTIME_QUOTE_HEADERS,
-                    params=params,
-                    timeout=10
-                )
-                
-                if response.status_code == 200:
-                    return response.json()
-                elif response.status_code == 429:  # Rate limit exceeded
-                    retry_after = int(response.headers.get('Retry-After', retry_delay * (attempt + 1)))
-                    time.sleep(retry_after)
-                else:
-                    logger.error(f"Real-time quote API error for {symbol}: Status {response.status_code}")
-                    return {}
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Request exception on real-time quote for {symbol}, attempt {attempt+1}: {str(e)}")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay * (attempt + 1))
-                else:
-                    logger.error(f"Max retries reached for real-time quote on {symbol}")
-                    return {}
-    except Exception as e:
-        logger.exception(f"Unexpected error fetching real-time quote for {symbol}: {str(e)}")
-        return {}
+    logger.info("Fetching real-time quote for: %s", symbol)
+    data = market_data_client.get_json(
+        REALTIME_QUOTE_URL,
+        headers=REALTIME_QUOTE_HEADERS,
+        params={"ticker": symbol, "type": "STOCKS"},
+        description=f"real-time quote for {symbol}"
+    )
+    return data or {}
+
+ticker_directory = TickerDirectory(
+    get_all_ticker_pages,
+    refresh_interval=TICKER_REFRESH_INTERVAL,
+    max_pages=TICKER_DIRECTORY_MAX_PAGES,
+    snapshot_path=TICKER_SNAPSHOT_PATH
+)
+
+# Screens run over the listing plus every quote and ESG score this process has cached
+market_screener = MarketScreener(ticker_directory, esg_store=get_esg_store)
+quote_cache.subscribe(market_screener.update_quote)
 
-def search_ticker_by_symbol(symbol, tickers=None, max_pages=3):
-    """Search for a specific ticker symbol."""
-    logger.info(f"Searching for ticker symbol: {symbol}")
+def search_ticker_by_symbol(symbol, tickers=None):
+    """Search for a specific ticker symbol in the ticker directory or a given ticker list."""
+    logger.info("Searching for ticker symbol: %s", symbol)
     if tickers is None:
-        tickers = get_all_ticker_pages(max_pages=max_pages, symbol_to_find=symbol)
+        ticker_directory.start()
+        if not ticker_directory.loaded:
+            logger.warning("Ticker directory still loading, skipping lookup for %s", symbol)
+            return None
+        ticker = ticker_directory.get(symbol)
+        if ticker:
+            logger.info("Found ticker data for %s", symbol)
+        else:
+            logger.warning("Ticker %s not found in directory of %s symbols", symbol, len(ticker_directory))
+        return ticker
     
     for ticker in tickers:
         if ticker.get("symbol") == symbol:
-            logger.info(f"Found ticker data for {symbol}")
+            logger.info("Found ticker data for %s", symbol)
             return ticker
     
-    logger.warning(f"Ticker {symbol} not found in {len(tickers)} results")
+    logger.warning("Ticker %s not found in %s results", symbol, len(tickers))
     return None
 
 def get_esg_data(symbol):
+    """Return ESG score data for a symbol from the persistent ESG store, fetching it on a miss."""
+    return get_esg_store().get_or_fetch(symbol, fetch_esg_data)
+
+def fetch_esg_data(symbol):
     """Fetch ESG score data for a given symbol."""
-    logger.info(f"Fetching ESG data for symbol: {symbol}")
-    try:
-        url = ESG_API_URL_TEMPLATE.format(symbol=symbol)
-        max_retries = 3
-        retry_delay = 2  # seconds
-        
-        for attempt in range(max_retries):
-            try:
-                response = requests.get(url, headers=ESG_API_HEADERS, timeout=10)
-                
-                if response.status_code == 200:
-                    return response.json()
-                elif response.status_code == 429:  # Rate limit exceeded
-                    retry_after = int(response.headers.get('Retry-After', retry_delay * (attempt + 1)))
-                    time.sleep(retry_after)
-                else:
-                    logger.error(f"ESG API error for {symbol}: Status {response.status_code}")
-                    return {}
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Request exception on ESG for {symbol}, attempt {attempt+1}: {str(e)}")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay * (attempt + 1))
-                else:
-                    logger.error(f"Max retries reached for ESG data on {symbol}")
-                    return {}
-    except Exception as e:
-        logger.exception(f"Unexpected error fetching ESG data for {symbol}: {str(e)}")
-        return {}
-
-def extract_ticker_data(ticker_data, realtime_data):
-    """Extract and combine ticker data from both APIs."""
-    result = {}
-    
-    if ticker_data:
-        result["symbol"] = ticker_data.get("symbol", "N/A")
-        result["price"] = ticker_data.get("lastsale", "N/A")
-        result["change_pct"] = ticker_data.get("pctchange", "N/A")
-        result["name"] = ticker_data.get("name", "N/A")
-    
-    if realtime_data:
-        quote_data = None
-        if isinstance(realtime_data, dict):
-            if "data" in realtime_data and isinstance(realtime_data["data"], dict):
-                quote_data = realtime_data["data"]
-            elif "body" in realtime_data and isinstance(realtime_data["body"], dict):
-                quote_data = realtime_data["body"]
-        
-        if quote_data:
-            if "symbol" in quote_data:
-                result["symbol"] = quote_data.get("symbol", result.get("symbol", "N/A"))
-            if "regularMarketPrice" in quote_data:
-                result["price"] = quote_data.get("regularMarketPrice", result.get("price", "N/A"))
-            if "regularMarketChangePercent" in quote_data:
-                change_pct = quote_data.get("regularMarketChangePercent")
-                result["change_pct"] = f"{change_pct:.2f}%" if isinstance(change_pct, (int, float)) else str(change_pct)
-            result["open"] = quote_data.get("regularMarketOpen", "N/A")
-            result["high"] = quote_data.get("regularMarketDayHigh", "N/A")
-            result["low"] = quote_data.get("regularMarketDayLow", "N/A")
-            result["volume"] = quote_data.get("regularMarketVolume", "N/A")
-            result["market_cap"] = quote_data.get("marketCap", "N/A")
-            result["52w_high"] = quote_data.get("fiftyTwoWeekHigh", "N/A")
-            result["52w_low"] = quote_data.get("fiftyTwoWeekLow", "N/A")
-            if "longName" in quote_data:
-                result["name"] = quote_data.get("longName", result.get("name", "N/A"))
-            result["sector"] = quote_data.get("sector", "N/A")
-            result["industry"] = quote_data.get("industry", "N/A")
-    
-    return result
-
-def initialize_llama(model_path):
-    """Initialize the Llama model with GPU support and fallback to CPU."""
-    logger.info("Initializing Llama model with GPU support...")
-    if not os.path.exists(model_path):
-        logger.error(f"Model file not found at {model_path}")
-        return None
+    logger.info("Fetching ESG data for symbol: %s", symbol)
+    data = market_data_client.get_json(
+        ESG_API_URL_TEMPLATE.format(symbol=symbol),
+        headers=ESG_API_HEADERS,
+        description=f"ESG data for {symbol}"
+    )
+    return data or {}
+
+def refresh_headroom(kind):
+    """Let the background refresher send a request only while live traffic keeps MARKET_REFRESH_RESERVE slots."""
+    url = BATCH_QUOTE_URL if kind == "quote" else ESG_API_BASE_URL
+    return market_data_client.headroom(url) > MARKET_REFRESH_RESERVE
+
+# Quotes and ESG scores of the most asked-about symbols are kept warm off the request path
+market_refresher = MarketRefresher(
+    Watchlist(),
+    fetch_quotes=fetch_realtime_quotes,
+    quote_cache=quote_cache,
+    fetch_esg=fetch_esg_data,
+    esg_store=get_esg_store,
+    headroom=refresh_headroom
+)
+
+def record_query_symbols(symbols):
+    """Count the symbols a user asked about towards the refresher's watchlist."""
+    if MARKET_REFRESH_ENABLED and symbols:
+        market_refresher.watchlist.record(symbols)
+        market_refresher.start()
+
+def resolve_symbols(user_message, limit=MAX_QUERY_SYMBOLS):
+    """
+    Return the listed symbols a user's query mentions by ticker or company name.
     
-    try:
-        model = Llama(
-            model_path=model_path,
-            n_ctx=4096,
-            n_threads=4,
-            n_gpu_layers=-1  # Use all layers on GPU
-        )
-        logger.info("Llama model initialized successfully with GPU support")
-        return model
-    except Exception as e:
-        logger.exception(f"Error initializing Llama model with GPU: {str(e)}")
-        logger.info("Falling back to CPU initialization...")
-        try:
-            model = Llama(
-                model_path=model_path,
-                n_ctx=4096,
-                n_threads=4
-            )
-            logger.info("Llama model initialized successfully on CPU")
-            return model
-        except Exception as e2:
-            logger.exception(f"Error initializing Llama model on CPU: {str(e2)}")
-            return None
+    Falls back to the ticker-shaped words of the query while the ticker directory is still loading.
+    """
+    ticker_directory.start()
+    if not ticker_directory.loaded:
+        return detect_symbols(user_message, limit)
+    return ticker_directory.resolve(user_message, limit)
 
-def chat_response(user_message, model_path=MODEL_FILENAME):
-    """Generate a response to a user's financial query."""
-    logger.info(f"Processing user query: {user_message}")
+def detect_symbol(user_message):
+    """Return the first ticker symbol mentioned in a user's query, or None."""
+    symbols = resolve_symbols(user_message, limit=1)
+    return symbols[0] if symbols else None
+
+def compare_symbols(symbols, quotes=None):
+    """
+    Fetch quotes, listings and ESG scores for several symbols at once as ``{symbol: (combined_data, esg_data) or None}``.
+    
+    Quotes already in ``quotes`` are used as they are, only the others are fetched.
+    """
+    quotes = dict(quotes or {})
+    deadline = time.monotonic() + DATA_GATHER_TIMEOUT
+    tasks = {}
+    missing = [symbol for symbol in symbols if symbol not in quotes]
+    if missing:
+        tasks["quotes"] = (CHAT_STAGE_SECONDS.timed(get_realtime_quotes, stage="quote_fetch"), missing, deadline)
+    tasks.update((f"esg:{s}", (CHAT_STAGE_SECONDS.timed(get_esg_data, stage="esg_fetch"), s)) for s in symbols)
+    results = gather(tasks, deadline)
+    quotes.update(results.get("quotes") or {})
     
-    # Check if query is specifically looking for a symbol
-    symbol_match = re.search(r'\b([A-Z]{1,5})\b', user_message)
-    target_symbol = symbol_match.group(1) if symbol_match else None
+    market_data = {}
+    with CHAT_STAGE_SECONDS.time(stage="ticker_search"):
+        for symbol in symbols:
+            combined_data = extract_ticker_data(search_ticker_by_symbol(symbol), quotes.get(symbol))
+            if combined_data:
+                combined_data.setdefault("symbol", symbol)
+                market_data[symbol] = (combined_data, results[f"esg:{symbol}"])
+            else:
+                market_data[symbol] = None
+    return market_data
+
+def screen_market(user_message):
+    """
+    Run the stock screen a query asks for ("which stocks are up most", "best ESG names in tech") over local data.
     
-    # Prepare data collection
-    ticker_summary = ""
-    ticker_details = []
+    Returns ``(heading, {symbol: (combined_data, esg_data)})``, or None if the
+    query does not ask for a screen or nothing matched.
+    """
+    screen = parse_screen(user_message)
+    if screen is None:
+        return None
+    ticker_directory.start()
+    heading, market_data = market_screener.market_data(screen)
+    if not market_data:
+        logger.info("No stocks with local data matched the screen")
+        return None
+    logger.info("Screen selected %s", list(market_data))
+    return heading, market_data
+
+def build_prompt(user_message, symbols=None, model_path=MODEL_FILENAME, quotes=None):
+    """
+    Gather market data for the symbols in a user's query and build the model prompt.
     
-    if target_symbol:
-        logger.info(f"Getting detailed data for target symbol: {target_symbol}")
-        realtime_data = get_realtime_quote(target_symbol)
-        ticker_data = search_ticker_by_symbol(target_symbol, max_pages=5)
-        combined_data = extract_ticker_data(ticker_data, realtime_data)
+    ``symbols`` overrides the symbols detected in the message and ``quotes``
+    holds quotes already fetched for this request (a batch prefetch), which
+    are used instead of the short-lived quote cache. A single symbol
+    gets a detailed summary, several get a comparison table, and a query
+    without symbols that asks for a screen gets the screened stocks, trimmed
+    until the prompt and its completion budget fit the model's context. Returns a
+    PromptPlan and a ``{symbol: (combined_data, esg_data) or None}``
+    dictionary of the data it was built from, which the response cache
+    fingerprints.
+    """
+    logger.info("Processing user query: %s", user_message)
+    
+    # Check if query is specifically looking for symbols
+    with CHAT_STAGE_SECONDS.time(stage="symbol_extraction"):
+        symbols = symbols or resolve_symbols(user_message)
+    record_query_symbols(symbols)
+    target_symbol = symbols[0] if len(symbols) == 1 else None
+    market_data = {}
+    heading = ""
+    
+    if not symbols:
+        # Questions about the market at large are answered from a screen of the locally held data
+        with CHAT_STAGE_SECONDS.time(stage="screen"):
+            screened = screen_market(user_message)
+        if screened:
+            heading, market_data = screened
+            symbols = list(market_data)
+    elif len(symbols) > 1:
+        logger.info("Comparing %s symbols: %s", len(symbols), symbols)
+        market_data = compare_symbols(symbols, quotes)
+    elif target_symbol:
+        logger.info("Getting detailed data for target symbol: %s", target_symbol)
+        # The ESG lookup starts with the queried symbol and is only repeated
+        # if the quote resolves it to a different one
+        deadline = time.monotonic() + DATA_GATHER_TIMEOUT
+        quote_task = (CHAT_STAGE_SECONDS.timed(get_realtime_quote, stage="quote_fetch"), target_symbol)
+        if quotes and target_symbol in quotes:
+            quote_task = (quotes.get, target_symbol)
+        results = gather({
+            "realtime": quote_task,
+            "ticker": (CHAT_STAGE_SECONDS.timed(search_ticker_by_symbol, stage="ticker_search"), target_symbol),
+            "esg": (CHAT_STAGE_SECONDS.timed(get_esg_data, stage="esg_fetch"), target_symbol),
+        }, deadline)
+        combined_data = extract_ticker_data(results["ticker"], results["realtime"])
         
         if combined_data:
-            symbol = combined_data.get("symbol", target_symbol)
-            ticker_details.append(combined_data)
-            
-            esg_data = get_esg_data(symbol)
-            esg_text = ""
-            if esg_data and "totalEsg" in esg_data:
-                esg_score = esg_data["totalEsg"].get("fmt", "N/A")
-                env_score = esg_data.get("environmentScore", {}).get("fmt", "N/A")
-                social_score = esg_data.get("socialScore", {}).get("fmt", "N/A")
-                gov_score = esg_data.get("governanceScore", {}).get("fmt", "N/A")
-                esg_text = f"ESG Score: {esg_score}, Environmental: {env_score}, Social: {social_score}, Governance: {gov_score}"
-            else:
-                esg_text = "No ESG data available"
-            
-            price = combined_data.get("price", "N/A")
-            change_pct = combined_data.get("change_pct", "N/A")
-            name = combined_data.get("name", symbol)
-            detail_text = f"{symbol} ({name}): Price ${price} ({change_pct})"
-            
-            if "open" in combined_data and combined_data["open"] != "N/A":
-                detail_text += f"; Open: ${combined_data['open']}"
-            if "high" in combined_data and combined_data["high"] != "N/A":
-                detail_text += f"; High: ${combined_data['high']}"
-            if "low" in combined_data and combined_data["low"] != "N/A":
-                detail_text += f"; Low: ${combined_data['low']}"
-            if "volume" in combined_data and combined_data["volume"] != "N/A":
-                detail_text += f"; Volume: {combined_data['volume']}"
-            if "market_cap" in combined_data and combined_data["market_cap"] != "N/A":
-                detail_text += f"; Market Cap: ${combined_data['market_cap']}"
-            if "52w_high" in combined_data and combined_data["52w_high"] != "N/A":
-                detail_text += f"; 52w High: ${combined_data['52w_high']}"
-            if "52w_low" in combined_data and combined_data["52w_low"] != "N/A":
-                detail_text += f"; 52w Low: ${combined_data['52w_low']}"
-            if "sector" in combined_data and combined_data["sector"] != "N/A":
-                detail_text += f"; Sector: {combined_data['sector']}"
-            if "industry" in combined_data and combined_data["industry"] != "N/A":
-                detail_text += f"; Industry: {combined_data['industry']}"
-            
-            detail_text += f"; {esg_text}"
-            ticker_summary += detail_text + " "
+            symbol = combined_data.setdefault("symbol", target_symbol)
+            esg_data = results["esg"]
+            if symbol != target_symbol:
+                esg_data = gather({"esg": (CHAT_STAGE_SECONDS.timed(get_esg_data, stage="esg_fetch"), symbol)},
+                                  deadline)["esg"]
+            market_data[target_symbol] = (combined_data, esg_data)
         else:
-            logger.warning(f"No data found for target symbol: {target_symbol}")
-            ticker_summary += f"No detailed data available for {target_symbol}. "
+            logger.warning("No data found for target symbol: %s", target_symbol)
+            market_data[target_symbol] = None
     
-    if not ticker_summary:
-        if target_symbol:
-            ticker_summary = f"No information available for {target_symbol}."
-        else:
-            ticker_summary = "No specific ticker symbol detected in your query. Please include a stock symbol (e.g., AAPL for Apple) if you want stock information."
-        logger.warning("No ticker data could be retrieved")
-    
-    logger.info(f"Final ticker summary: {ticker_summary}")
-    
-    global llama_model
-    if llama_model is None:
-        llama_model = initialize_llama(model_path)
-        if not llama_model:
-            return "I'm sorry, but I'm unable to process your request at the moment due to a technical issue with the language model."
-    
-    # Customize prompt based on query type
-    is_investment_query = any(term in user_message.lower() for term in [
-        "invest", "buy", "sell", "worth", "stock", "good investment", 
-        "should i", "portfolio", "holding", "position"
-    ])
-    
-    prompt_instructions = (
-        "The user is asking about investment advice. Analyze the current market data provided below, "
-        "and give a balanced assessment that considers both financial performance and ESG factors. "
-        "Include pros and cons, potential risks, and suggest sustainable alternatives if appropriate. "
-        "Focus on educational information rather than direct financial advice."
-    ) if is_investment_query else (
-        "Answer the following financial query by providing a detailed analysis based on the real-time "
-        "market data below. Include relevant ESG (Environmental, Social, Governance) considerations "
-        "and focus on clear, actionable information."
-    )
+    # Static instructions come first so their KV state can be reused across requests
+    with CHAT_STAGE_SECONDS.time(stage="prompt_build"):
+        plan = plan_prompt(
+            user_message,
+            lambda level: screened_summary(heading, summarize_market_data(market_data, level)),
+            classify_query(user_message, symbols),
+            get_token_counter(model_path),
+            get_inference_scheduler(model_path).context_tokens
+        )
+    logger.debug("Full prompt: %s", plan.text)
+    return plan, market_data
+
+def completion_text(output):
+    """Extract the generated text from a model completion."""
+    if isinstance(output, dict):
+        reply = output.get("choices", [{}])[0].get("text", "")
+    elif isinstance(output, str):
+        reply = output
+    else:
+        reply = str(output)
+    return reply.strip()
+
+def chat_response(user_message, model_path=MODEL_FILENAME, symbols=None, use_cache=True):
+    """
+    Generate a response to a user's financial query.
     
-    # Construct the enriched prompt
-    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-    enriched_prompt = (
-        f"{prompt_instructions}\n\n"
-        f"User Query: {user_message}\n\n"
-        f"Current Market Data (as of {timestamp}):\n{ticker_summary}\n\n"
-        "Answer:"
-    )
+    An identical query over market data within the cache's price tolerance is
+    answered from the response cache. ``use_cache=False`` skips the lookup but
+    still stores the fresh response.
+    """
+    plan, market_data = build_prompt(user_message, symbols, model_path)
+    cache_key = response_key(user_message, market_data)
+    if use_cache and cache_key is not None:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            logger.info("Serving response from the response cache")
+            return cached
     
     logger.info("Sending prompt to Llama model")
-    logger.debug(f"Full prompt: {enriched_prompt}")
     
     try:
-        output = llama_model(
-            prompt=enriched_prompt,
-            max_tokens=800,
-            temperature=0.7,
-            top_p=0.95,
-        )
-        
-        if isinstance(output, dict):
-            reply = output.get("choices", [{}])[0].get("text", "")
-        elif isinstance(output, str):
-            reply = output
-        else:
-            reply = str(output)
-        
+        future = get_inference_scheduler(model_path).submit(plan.text, **plan.generation_params(GENERATION_PARAMS))
+        reply = completion_text(future.result(timeout=GENERATION_TIMEOUT))
         logger.info("Successfully generated response")
-        logger.debug(f"Model response: {reply}")
-        return reply.strip()
+        logger.debug("Model response: %s", reply)
+        if cache_key is not None and reply:
+            response_cache.set(cache_key, reply)
+        return reply
+    except QueueFullError:
+        # The model is saturated, the endpoint turns this into a 503
+        raise
+    except ModelUnavailableError:
+        return MODEL_UNAVAILABLE_MESSAGE
+    except FuturesTimeoutError:
+        logger.error("No completion within %ss, giving up on the request", GENERATION_TIMEOUT)
+        return GENERATION_ERROR_MESSAGE
     except Exception as e:
-        logger.exception(f"Error generating response with Llama: {str(e)}")
-        return "I apologize, but I encountered an error while processing your request. Please try again with a different query."
+        logger.exception("Error generating response with Llama: %s", e)
+        return GENERATION_ERROR_MESSAGE
+
+def stream_chat_response(user_message, model_path=MODEL_FILENAME, symbols=None, use_cache=True):
+    """
+    Generate a response to a user's financial query token by token.
+    
+    Yields ``{"type": "token", "text": ...}`` frames as the model produces them,
+    then one ``{"type": "done", ...}`` frame with timings and token counts.
+    A response cache hit is sent as a single token frame followed by a done
+    frame with ``"cached": true``.
+    """
+    started = time.monotonic()
+    plan, market_data = build_prompt(user_message, symbols, model_path)
+    prompt_ready = time.monotonic()
+    cache_key = response_key(user_message, market_data)
+    if use_cache and cache_key is not None:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            logger.info("Serving streamed response from the response cache")
+            yield {"type": "token", "text": cached}
+            yield {"type": "done", "cached": True, "finish_reason": "stop", "budget": plan.stats(),
+                   "timings": {"data_seconds": prompt_ready - started, "total_seconds": time.monotonic() - started}}
+            return
+    
+    logger.info("Streaming prompt to Llama model")
+    
+    try:
+        handle = get_inference_scheduler(model_path).submit_stream(plan.text, **plan.generation_params(GENERATION_PARAMS))
+    except ModelUnavailableError:
+        yield {"type": "error", "error": MODEL_UNAVAILABLE_MESSAGE}
+        return
+    completion_tokens = 0
+    first_token_at = None
+    finish_reason = None
+    parts = []
+    try:
+        for chunk in handle:
+            choice = chunk.get("choices", [{}])[0]
+            text = choice.get("text", "")
+            finish_reason = choice.get("finish_reason") or finish_reason
+            if not text:
+                continue
+            if first_token_at is None:
+                first_token_at = time.monotonic()
+            completion_tokens += 1
+            parts.append(text)
+            yield {"type": "token", "text": text}
+    except ModelUnavailableError:
+        yield {"type": "error", "error": MODEL_UNAVAILABLE_MESSAGE}
+        return
+    except Exception as e:
+        logger.exception("Error streaming response with Llama: %s", e)
+        yield {"type": "error", "error": GENERATION_ERROR_MESSAGE}
+        return
+    
+    finished = time.monotonic()
+    generation_seconds = finished - prompt_ready
+    logger.info("Streamed %s tokens in %.2fs", completion_tokens, generation_seconds)
+    reply = "".join(parts).strip()
+    if cache_key is not None and reply:
+        response_cache.set(cache_key, reply)
+    yield {
+        "type": "done",
+        "cached": False,
+        "finish_reason": finish_reason,
+        "budget": plan.stats(),
+        "timings": {
+            "data_seconds": prompt_ready - started,
+            "queue_wait_seconds": handle.wait_seconds,
+            "time_to_first_token_seconds": first_token_at - started if first_token_at else None,
+            "generation_seconds": generation_seconds,
+            "total_seconds": finished - started,
+        },
+        "tokens": {
+            "prompt": handle.prompt_tokens,
+            "completion": completion_tokens,
+            "per_second": completion_tokens / generation_seconds if generation_seconds > 0 else None,
+        },
+    }
+
+def batch_chat_responses(queries, model_path=MODEL_FILENAME):
+    """
+    Answer many queries in one pass.
+    
+    Quotes and ESG scores for every symbol in the batch are fetched once up
+    front. The quotes are kept for the whole batch, since prompts built later
+    would otherwise find them expired in the quote cache, and ESG scores are
+    read from the store. The prompts are then
+    kept queued on the inference scheduler, letting a batching engine decode
+    them together. Response cache hits are answered without the model and
+    queries sharing a cache key are generated once. Yields ``{"id", "response"}``
+    or ``{"id", "error"}`` per query in completion order.
+    """
+    symbols = batch_symbols(queries, resolve_symbols)
+    logger.info("Prefetching data for %s symbols across %s queries", len(symbols), len(queries))
+    with CHAT_STAGE_SECONDS.time(stage="batch_prefetch"):
+        deadline = time.monotonic() + DATA_GATHER_TIMEOUT
+        prefetched = gather({
+            "quotes": (get_realtime_quotes, symbols, deadline),
+            "esg": (get_esg_store().prewarm, symbols, fetch_esg_data),
+        }, deadline)
+    quotes = prefetched["quotes"] or {}
+    
+    prompts = []
+    sharing = {}  # cache key -> queries answered by the same generation
+    for query in queries:
+        try:
+            plan, market_data = build_prompt(query["message"], query["symbols"], model_path, quotes=quotes)
+        except Exception as e:
+            logger.error("Error building prompt for batch query %s: %s", query["id"], e)
+            prompts.append((query, None))
+            continue
+        cache_key = response_key(query["message"], market_data)
+        if cache_key is not None:
+            cached = response_cache.get(cache_key) if query["cache"] else None
+            if cached is not None:
+                yield {"id": query["id"], "response": cached}
+                continue
+            if cache_key in sharing:
+                sharing[cache_key].append(query)
+                continue
+            sharing[cache_key] = [query]
+        prompts.append((dict(query, cache_key=cache_key), plan))
+    
+    scheduler = get_inference_scheduler(model_path)
+    
+    def submit(plan):
+        return scheduler.submit(plan.text, **plan.generation_params(GENERATION_PARAMS))
+    
+    for query, output, error in run_batch(prompts, submit):
+        cache_key = query.get("cache_key")
+        if error is None:
+            reply = completion_text(output)
+            if cache_key is not None and reply:
+                response_cache.set(cache_key, reply)
+            result = {"response": reply}
+        else:
+            result = {"error": error}
+        for answered in sharing[cache_key] if cache_key is not None else [query]:
+            yield {"id": answered["id"], **result}
+
+def cache_requested(data):
+    """A request opts out of the response cache with ``"cache": false`` or a ``Cache-Control: no-cache`` header."""
+    return data.get('cache', True) is not False and "no-cache" not in request.headers.get("Cache-Control", "")
 
 @app.route('/chat', methods=['POST'])
 def chat():
@@ -394,23 +546,157 @@ def chat():
             return jsonify({"error": "Invalid request. 'message' field is required."}), 400
         
         user_message = data['message']
-        logger.info(f"Received chat request: {user_message}")
+        logger.info("Received chat request: %s", user_message)
+        try:
+            symbols = normalize_symbols(data['symbols']) if data.get('symbols') else None
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        response = chat_response(user_message)
+        response = chat_response(user_message, symbols=symbols, use_cache=cache_requested(data))
         return jsonify({"response": response}), 200
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
     except Exception as e:
-        logger.error(f"Error processing chat request: {str(e)}")
+        logger.error("Error processing chat request: %s", e)
         return jsonify({"error": "An error occurred while processing your request."}), 500
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Endpoint streaming a chat response as newline-delimited JSON frames."""
+    data = request.get_json(silent=True)
+    if not data or 'message' not in data:
+        return jsonify({"error": "Invalid request. 'message' field is required."}), 400
+    
+    user_message = data['message']
+    logger.info("Received streaming chat request: %s", user_message)
+    try:
+        symbols = normalize_symbols(data['symbols']) if data.get('symbols') else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    # Start the generator here so a full queue becomes a 503 before any frame is sent
+    frames = stream_chat_response(user_message, symbols=symbols, use_cache=cache_requested(data))
+    try:
+        first_frame = next(frames)
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+    
+    def generate():
+        try:
+            yield json.dumps(first_frame) + "\n"
+            for frame in frames:
+                yield json.dumps(frame) + "\n"
+        except Exception as e:
+            logger.error("Error processing streaming chat request: %s", e)
+            yield json.dumps({"type": "error", "error": "An error occurred while processing your request."}) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/chat/batch', methods=['POST'])
+def chat_batch():
+    """
+    Endpoint answering a batch of queries, streaming one JSON line per result.
+    
+    Accepts a JSONL body (one query per line) or a JSON list, or ``{"queries": [...]}``.
+    A query is a message string or a ``{"id", "message", "symbols"}`` object.
+    """
+    try:
+        if request.mimetype in ("application/x-ndjson", "application/jsonl", "application/x-jsonlines"):
+            items = read_jsonl(request.get_data(as_text=True))
+        else:
+            items = request.get_json(silent=True)
+            if isinstance(items, dict):
+                items = items.get("queries")
+        queries = parse_queries(items)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    logger.info("Received batch chat request with %s queries", len(queries))
+    
+    def generate():
+        try:
+            for result in batch_chat_responses(queries):
+                yield json.dumps(result) + "\n"
+        except Exception as e:
+            logger.error("Error processing batch chat request: %s", e)
+            yield json.dumps({"error": "An error occurred while processing your request."}) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.before_request
+def assign_request_id():
+    new_request_id(request.headers.get("X-Request-ID"))
+
+@app.after_request
+def add_request_id(response):
+    response.headers["X-Request-ID"] = current_request_id()
+    return response
+
+@app.after_request
+def count_chat_request(response):
+    if request.endpoint in ("chat", "chat_stream", "chat_batch"):
+        CHAT_REQUESTS.inc(endpoint=request.path, status=response.status_code)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint."""
+    return Response(render(), mimetype="text/plain; version=0.0.4")
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint to verify the server is running."""
-    return jsonify({"status": "healthy"}), 200
+    return jsonify(health_status()), 200
+
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """Readiness endpoint: 200 once the model can serve requests, 503 with load progress until then."""
+    status = get_inference_scheduler(MODEL_FILENAME).load_status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+def health_status():
+    """Server health plus model, scheduler and cache statistics."""
+    return {
+        "status": "healthy",
+        "inference": get_inference_scheduler(MODEL_FILENAME).stats(),
+        "caches": {"quote": quote_cache.stats(), "esg": get_esg_store().stats(), "response": response_cache.stats()},
+        "upstream": market_data_client.stats(),
+        "refresher": market_refresher.stats()
+    }
+
+Gauge("cache_hit_rate", "Hit rate of the in-process caches", lambda: {
+    ("quote",): quote_cache.stats()["hit_rate"],
+    ("esg",): get_esg_store().stats()["hit_rate"],
+    ("response",): response_cache.stats()["hit_rate"],
+}, ["cache"])
+Gauge("upstream_circuit_open", "1 while requests to a market data host are failed fast", lambda: {
+    (host,): int(state["circuit"] != "closed") for host, state in market_data_client.stats().items()
+}, ["host"])
+Gauge("inference_queue_depth", "Jobs waiting for the model",
+      lambda: get_inference_scheduler(MODEL_FILENAME).stats()["queue_depth"])
 
 if __name__ == "__main__":
-    # Initialize the Llama model when the server starts
-    llama_model = initialize_llama(MODEL_FILENAME)
-    if llama_model:
+    # Load the ticker directory and prewarm ESG scores in the background while the model initializes
+    ticker_directory.start()
+    if ESG_PREWARM_SYMBOLS:
+        threading.Thread(
+            target=get_esg_store().prewarm,
+            args=(ESG_PREWARM_SYMBOLS, fetch_esg_data),
+            name="esg-prewarm",
+            daemon=True
+        ).start()
+    if MARKET_REFRESH_ENABLED:
+        market_refresher.start()
+    
+    # Load the model in the background so /health answers immediately and /ready reports progress
+    threading.Thread(target=get_token_counter, args=(MODEL_FILENAME,), name="tokenizer-load", daemon=True).start()
+    scheduler = get_inference_scheduler(MODEL_FILENAME)
+    if MODEL_LOAD_MODE != "blocking":
+        threading.Thread(target=scheduler.warmup, name="model-load", daemon=True).start()
+        app.run(host='0.0.0.0', port=2000, debug=False)
+    elif scheduler.warmup():
         app.run(host='0.0.0.0', port=2000, debug=False)
     else:
-        logger.error("Failed to initialize Llama model. Exiting.")
\ No newline at end of file
+        logger.error("Failed to initialize Llama model. Exiting.")
@@ -0,0 +1,332 @@
+"""
+Asyncio server exposing the same /chat, /health and /ready contract as app.py.
+
+Market data is fetched with non-blocking HTTP and inference is handed to
+the shared scheduler through futures, so a waiting request costs a
+coroutine instead of an OS thread.
+
+Run with: uvicorn asgi_app:asgi_app --host 0.0.0.0 --port 2000
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+import app as flask_app
+from comparison import QUOTE_BATCH_ENABLED, QUOTE_BATCH_SIZE, QUOTE_MISSING_TTL, has_quote, normalize_symbols, \
+    parse_batch_quotes
+from esg_store import ESG_PREWARM_SYMBOLS, get_esg_store
+from inference import ModelUnavailableError, QueueFullError, get_inference_scheduler
+from logging_config import new_request_id
+from market_data import AsyncMarketDataClient
+from market_refresher import MARKET_REFRESH_ENABLED
+from metrics import CHAT_REQUESTS, render
+from prompt_budget import classify_query, get_token_counter, plan_prompt
+from prompts import extract_ticker_data, screened_summary, summarize_market_data
+from response_cache import response_cache, response_key
+
+logger = logging.getLogger(__name__)
+
+market_data_client = None
+_in_flight = {}
+
+
+async def _coalesce(key, fetch):
+    """Share one in-flight upstream fetch between every coroutine asking for ``key``."""
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fetch())
+        _in_flight[key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(key, None))
+    # Shield so a caller that gives up does not cancel the fetch for the others
+    return await asyncio.shield(task)
+
+
+async def fetch_realtime_quote(symbol):
+    """Fetch real-time quote data for a specific ticker symbol."""
+    logger.info("Fetching real-time quote for: %s", symbol)
+    data = await market_data_client.get_json(
+        flask_app.REALTIME_QUOTE_URL,
+        headers=flask_app.REALTIME_QUOTE_HEADERS,
+        params={"ticker": symbol, "type": "STOCKS"},
+        description=f"real-time quote for {symbol}"
+    )
+    return data or {}
+
+
+async def get_realtime_quote(symbol):
+    """Return real-time quote data, served from the shared quote cache when fresh."""
+    cached = flask_app.quote_cache.get(symbol)
+    if cached is not None:
+        return cached
+    return await load_realtime_quote(symbol)
+
+
+async def load_realtime_quote(symbol):
+    """Fetch a quote after a counted cache miss and store it, see comparison.load_quote."""
+    data = await _coalesce(("quote", symbol), lambda: fetch_realtime_quote(symbol))
+    if has_quote(data):
+        flask_app.quote_cache.set(symbol, data)
+        return data
+    if data:
+        # The API does not know the symbol, remember that briefly
+        flask_app.quote_cache.set(symbol, data, ttl=QUOTE_MISSING_TTL)
+        return data
+    # Upstream failed or was shed by the rate governor, fall back to the last known quote
+    return flask_app.quote_cache.get(symbol, stale=True) or data
+
+
+async def fetch_realtime_quotes(symbols):
+    """Fetch real-time quotes for several ticker symbols in one request."""
+    logger.info("Fetching real-time quotes for %s symbols", len(symbols))
+    data = await market_data_client.get_json(
+        flask_app.BATCH_QUOTE_URL,
+        headers=flask_app.REALTIME_QUOTE_HEADERS,
+        params={"ticker": ",".join(symbols)},
+        description=f"real-time quotes for {len(symbols)} symbols"
+    )
+    return parse_batch_quotes(data)
+
+
+async def get_realtime_quotes(symbols):
+    """Return ``{symbol: quote data}`` for several symbols, batching upstream requests for cache misses."""
+    quotes = {}
+    missing = []
+    for symbol in symbols:
+        cached = flask_app.quote_cache.get(symbol)
+        if cached is None:
+            missing.append(symbol)
+        elif has_quote(cached):
+            quotes[symbol] = cached
+
+    if missing and QUOTE_BATCH_ENABLED:
+        batches = [missing[i:i + QUOTE_BATCH_SIZE] for i in range(0, len(missing), QUOTE_BATCH_SIZE)]
+        for batch in await asyncio.gather(*(fetch_realtime_quotes(b) for b in batches)):
+            for symbol, quote in batch.items():
+                flask_app.quote_cache.set(symbol, quote)
+                quotes[symbol] = quote
+
+    remaining = [s for s in missing if s not in quotes]
+    for symbol, quote in zip(remaining, await asyncio.gather(*(load_realtime_quote(s) for s in remaining))):
+        if has_quote(quote):
+            quotes[symbol] = quote
+    return quotes
+
+
+async def fetch_esg_data(symbol):
+    """Fetch ESG score data for a given symbol."""
+    logger.info("Fetching ESG data for symbol: %s", symbol)
+    data = await market_data_client.get_json(
+        flask_app.ESG_API_URL_TEMPLATE.format(symbol=symbol),
+        headers=flask_app.ESG_API_HEADERS,
+        description=f"ESG data for {symbol}"
+    )
+    return data or {}
+
+
+async def get_esg_data(symbol):
+    """Return ESG score data from the persistent ESG store, fetching it on a miss."""
+    store = get_esg_store()
+    cached = store.get(symbol)
+    if cached is not None:
+        return cached
+    data = await _coalesce(("esg", symbol), lambda: fetch_esg_data(symbol))
+    # put writes to SQLite, keep it off the event loop
+    if await asyncio.to_thread(store.put, symbol, data):
+        return data
+    return store.get(symbol, stale=True) or {}
+
+
+def _result_or_none(task, name):
+    if not task.done():
+        logger.warning("Data source '%s' missed the deadline, continuing without it", name)
+        return None
+    if task.exception() is not None:
+        logger.error("Data source '%s' failed: %s", name, task.exception())
+        return None
+    return task.result()
+
+
+async def compare_symbols(symbols):
+    """Fetch quotes, listings and ESG scores for several symbols at once as ``{symbol: (combined_data, esg_data) or None}``."""
+    quotes_task = asyncio.ensure_future(get_realtime_quotes(symbols))
+    esg_tasks = {symbol: asyncio.ensure_future(get_esg_data(symbol)) for symbol in symbols}
+    await asyncio.wait({quotes_task, *esg_tasks.values()}, timeout=flask_app.DATA_GATHER_TIMEOUT)
+    quotes = _result_or_none(quotes_task, "quotes") or {}
+
+    market_data = {}
+    for symbol in symbols:
+        combined_data = extract_ticker_data(flask_app.search_ticker_by_symbol(symbol), quotes.get(symbol))
+        if combined_data:
+            combined_data.setdefault("symbol", symbol)
+            market_data[symbol] = (combined_data, _result_or_none(esg_tasks[symbol], f"esg:{symbol}"))
+        else:
+            market_data[symbol] = None
+    return market_data
+
+
+async def build_prompt(user_message, symbols=None, model_path=flask_app.MODEL_FILENAME):
+    """Gather market data for the symbols in a user's query and build the model prompt, see app.build_prompt."""
+    logger.info("Processing user query: %s", user_message)
+
+    symbols = symbols or flask_app.resolve_symbols(user_message)
+    flask_app.record_query_symbols(symbols)
+    target_symbol = symbols[0] if len(symbols) == 1 else None
+    market_data = {}
+    heading = ""
+
+    if not symbols:
+        # Screens only read local columns, no need to leave the event loop
+        screened = flask_app.screen_market(user_message)
+        if screened:
+            heading, market_data = screened
+            symbols = list(market_data)
+    elif len(symbols) > 1:
+        logger.info("Comparing %s symbols: %s", len(symbols), symbols)
+        market_data = await compare_symbols(symbols)
+    elif target_symbol:
+        logger.info("Getting detailed data for target symbol: %s", target_symbol)
+        deadline = time.monotonic() + flask_app.DATA_GATHER_TIMEOUT
+        realtime_task = asyncio.ensure_future(get_realtime_quote(target_symbol))
+        esg_task = asyncio.ensure_future(get_esg_data(target_symbol))
+        # The ticker directory is a local lookup, no need to leave the event loop
+        ticker_data = flask_app.search_ticker_by_symbol(target_symbol)
+
+        await asyncio.wait({realtime_task, esg_task}, timeout=flask_app.DATA_GATHER_TIMEOUT)
+        combined_data = extract_ticker_data(ticker_data, _result_or_none(realtime_task, "realtime"))
+
+        if combined_data:
+            symbol = combined_data.setdefault("symbol", target_symbol)
+            esg_data = _result_or_none(esg_task, "esg")
+            if symbol != target_symbol:
+                esg_task = asyncio.ensure_future(get_esg_data(symbol))
+                await asyncio.wait({esg_task}, timeout=max(0.0, deadline - time.monotonic()))
+                esg_data = _result_or_none(esg_task, "esg")
+            market_data[target_symbol] = (combined_data, esg_data)
+        else:
+            logger.warning("No data found for target symbol: %s", target_symbol)
+            market_data[target_symbol] = None
+
+    # Tokenizing is fast and the tokenizer is loaded at startup, so this stays on the event loop
+    plan = plan_prompt(
+        user_message,
+        lambda level: screened_summary(heading, summarize_market_data(market_data, level)),
+        classify_query(user_message, symbols),
+        get_token_counter(model_path),
+        get_inference_scheduler(model_path).context_tokens
+    )
+    return plan, market_data
+
+
+async def chat_response(user_message, model_path=flask_app.MODEL_FILENAME, symbols=None, use_cache=True):
+    """Generate a response to a user's financial query without blocking the event loop."""
+    plan, market_data = await build_prompt(user_message, symbols, model_path)
+    cache_key = response_key(user_message, market_data)
+    if use_cache and cache_key is not None:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            logger.info("Serving response from the response cache")
+            return cached
+
+    logger.info("Sending prompt to Llama model")
+    try:
+        future = get_inference_scheduler(model_path).submit(plan.text, **plan.generation_params(flask_app.GENERATION_PARAMS))
+        reply = flask_app.completion_text(
+            await asyncio.wait_for(asyncio.wrap_future(future), flask_app.GENERATION_TIMEOUT))
+        logger.info("Successfully generated response")
+        if cache_key is not None and reply:
+            response_cache.set(cache_key, reply)
+        return reply
+    except QueueFullError:
+        # The model is saturated, the endpoint turns this into a 503
+        raise
+    except ModelUnavailableError:
+        return flask_app.MODEL_UNAVAILABLE_MESSAGE
+    except asyncio.TimeoutError:
+        logger.error("No completion within %ss, giving up on the request", flask_app.GENERATION_TIMEOUT)
+        return flask_app.GENERATION_ERROR_MESSAGE
+    except Exception as e:
+        logger.exception("Error generating response with Llama: %s", e)
+        return flask_app.GENERATION_ERROR_MESSAGE
+
+
+@asynccontextmanager
+async def lifespan(_):
+    global market_data_client
+    market_data_client = AsyncMarketDataClient()
+    flask_app.ticker_directory.start()
+    loop = asyncio.get_running_loop()
+    if ESG_PREWARM_SYMBOLS:
+        loop.run_in_executor(None, get_esg_store().prewarm, ESG_PREWARM_SYMBOLS, flask_app.fetch_esg_data)
+    # Load the tokenizer and the model off the event loop so /health answers while they load
+    loop.run_in_executor(None, get_token_counter, flask_app.MODEL_FILENAME)
+    loop.run_in_executor(None, get_inference_scheduler(flask_app.MODEL_FILENAME).warmup)
+    if MARKET_REFRESH_ENABLED:
+        # The refresher's blocking client runs on its own thread, off the event loop
+        flask_app.market_refresher.start()
+    yield
+    flask_app.market_refresher.stop()
+    await market_data_client.close()
+
+
+asgi_app = FastAPI(lifespan=lifespan)
+asgi_app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+
+
+@asgi_app.middleware("http")
+async def assign_request_id(request: Request, call_next):
+    request_id = new_request_id(request.headers.get("X-Request-ID"))
+    response = await call_next(request)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
+@asgi_app.post("/chat")
+async def chat(request: Request):
+    """Endpoint for handling chat requests."""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or "message" not in data:
+        return JSONResponse({"error": "Invalid request. 'message' field is required."}, status_code=400)
+
+    user_message = data["message"]
+    logger.info("Received chat request: %s", user_message)
+    try:
+        symbols = normalize_symbols(data["symbols"]) if data.get("symbols") else None
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    try:
+        use_cache = data.get("cache", True) is not False and "no-cache" not in request.headers.get("Cache-Control", "")
+        response = JSONResponse({"response": await chat_response(user_message, symbols=symbols, use_cache=use_cache)})
+    except QueueFullError as e:
+        response = JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": "5"})
+    except Exception as e:
+        logger.error("Error processing chat request: %s", e)
+        response = JSONResponse({"error": "An error occurred while processing your request."}, status_code=500)
+    CHAT_REQUESTS.inc(endpoint="/chat", status=response.status_code)
+    return response
+
+
+@asgi_app.get("/health")
+async def health_check():
+    """Health check endpoint to verify the server is running."""
+    return JSONResponse(flask_app.health_status())
+
+
+@asgi_app.get("/ready")
+async def readiness_check():
+    """Readiness endpoint: 200 once the model can serve requests, 503 with load progress until then."""
+    status = get_inference_scheduler(flask_app.MODEL_FILENAME).load_status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
+@asgi_app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint."""
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,127 @@
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from comparison import detect_symbols, normalize_symbols
+from inference import INFERENCE_QUEUE_SIZE, ModelUnavailableError, QueueFullError
+
+logger = logging.getLogger(__name__)
+
+# Batch configuration
+BATCH_MAX_QUERIES = int(os.environ.get("BATCH_MAX_QUERIES", "1000"))
+BATCH_IN_FLIGHT = int(os.environ.get("BATCH_IN_FLIGHT", "0"))  # jobs handed to the model at once, 0 = inference queue size
+BATCH_RETRY_DELAY = 0.5  # seconds to wait when the inference queue is full and nothing of ours is running
+
+
+def read_jsonl(text):
+    """Parse one JSON value per non-empty line, raising ValueError with the line number on bad input."""
+    items = []
+    for number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            items.append(json.loads(line))
+        except ValueError as e:
+            raise ValueError(f"Line {number} is not valid JSON: {e}")
+    return items
+
+
+def parse_queries(items, limit=BATCH_MAX_QUERIES):
+    """
+    Normalize batch input into query dictionaries
+
+    Args:
+        items: List of message strings or ``{"id", "message", "symbols", "cache"}`` dictionaries
+        limit: Maximum number of queries accepted
+
+    Returns:
+        List of ``{"id": ..., "message": ..., "symbols": [...] or None, "cache": bool}``
+
+    Raises:
+        ValueError: If the input is malformed or too long
+    """
+    if not isinstance(items, list) or not items:
+        raise ValueError("A non-empty list of queries is required.")
+    if len(items) > limit:
+        raise ValueError(f"At most {limit} queries can be sent in one batch.")
+    queries = []
+    for index, item in enumerate(items):
+        if isinstance(item, str):
+            item = {"message": item}
+        if not isinstance(item, dict) or not isinstance(item.get("message"), str):
+            raise ValueError(f"Query {index} needs a 'message' string.")
+        symbols = normalize_symbols(item["symbols"]) if item.get("symbols") else None
+        queries.append({"id": item.get("id", index), "message": item["message"], "symbols": symbols,
+                        "cache": item.get("cache", True) is not False})
+    return queries
+
+
+def batch_symbols(queries, detect=detect_symbols):
+    """Return every symbol the batch needs, each once, in order of first mention."""
+    symbols = []
+    seen = set()
+    for query in queries:
+        for symbol in query["symbols"] or detect(query["message"]):
+            if symbol not in seen:
+                seen.add(symbol)
+                symbols.append(symbol)
+    return symbols
+
+
+def run_batch(prompts, submit, in_flight=None):
+    """
+    Push prompts through the inference scheduler and yield results as they finish
+
+    Keeps up to ``in_flight`` jobs queued at once, so a batching engine always
+    has work to group, without overflowing the scheduler queue that live
+    traffic shares. Jobs rejected with QueueFullError are retried once one of
+    ours completes, and ModelUnavailableError fails only the job it was
+    raised for.
+
+    Args:
+        prompts: List of ``(query, prompt)`` tuples, where a prompt is anything ``submit``
+            accepts; a None prompt is reported as an error
+        submit: Callable taking a prompt and returning a Future of the model output
+        in_flight: Maximum outstanding jobs (defaults to BATCH_IN_FLIGHT or the queue size)
+
+    Yields:
+        ``(query, output, error)`` tuples in completion order
+    """
+    in_flight = in_flight or BATCH_IN_FLIGHT or INFERENCE_QUEUE_SIZE
+    waiting = deque(prompts)
+    pending = {}
+
+    while waiting or pending:
+        while waiting and len(pending) < in_flight:
+            query, prompt = waiting[0]
+            if prompt is None:
+                waiting.popleft()
+                yield query, None, "Market data for this query could not be prepared."
+                continue
+            try:
+                pending[submit(prompt)] = query
+            except QueueFullError:
+                break
+            except ModelUnavailableError as e:
+                waiting.popleft()
+                logger.error("Batch query %s failed: %s", query["id"], e)
+                yield query, None, str(e)
+                continue
+            waiting.popleft()
+
+        if not pending:
+            # The queue is full of other requests, give them a moment
+            time.sleep(BATCH_RETRY_DELAY)
+            continue
+
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            query = pending.pop(future)
+            try:
+                yield query, future.result(), None
+            except Exception as e:
+                logger.error("Batch query %s failed: %s", query["id"], e)
+                yield query, None, str(e)
@@ -0,0 +1,454 @@
+import codecs
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from inference import INFERENCE_QUEUE_SIZE, ModelUnavailableError, QueueFullError, StreamHandle, _Job, _STREAM_END
+from metrics import record_generation
+from prompt_cache import common_prefix_length
+from prompts import STATIC_PREFIXES
+
+logger = logging.getLogger(__name__)
+
+# Batching configuration
+BATCH_MAX_SEQUENCES = int(os.environ.get("BATCH_MAX_SEQUENCES", "4"))
+BATCH_SIZE = int(os.environ.get("BATCH_SIZE", "512"))  # tokens per decode step
+BATCH_CTX_PER_SEQUENCE = int(os.environ.get("BATCH_CTX_PER_SEQUENCE", "2048"))
+BATCH_RETRY_DELAY = 1.0  # seconds before rebuilding a context that failed, doubled after each failure
+BATCH_RETRY_MAX_DELAY = 60.0
+
+
+def _low_level():
+    import llama_cpp
+    return llama_cpp
+
+
+def _kv_seq_rm(ctx, seq_id):
+    """Drop every cached position of ``seq_id`` (the function name differs across llama-cpp-python versions)."""
+    llama_cpp = _low_level()
+    if hasattr(llama_cpp, "llama_memory_seq_rm"):
+        llama_cpp.llama_memory_seq_rm(llama_cpp.llama_get_memory(ctx), seq_id, -1, -1)
+    elif hasattr(llama_cpp, "llama_kv_self_seq_rm"):
+        llama_cpp.llama_kv_self_seq_rm(ctx, seq_id, -1, -1)
+    else:
+        llama_cpp.llama_kv_cache_seq_rm(ctx, seq_id, -1, -1)
+
+
+def _kv_seq_cp(ctx, src, dst, p0, p1):
+    """Share cached positions [p0, p1) of sequence ``src`` with sequence ``dst``."""
+    llama_cpp = _low_level()
+    if hasattr(llama_cpp, "llama_memory_seq_cp"):
+        llama_cpp.llama_memory_seq_cp(llama_cpp.llama_get_memory(ctx), src, dst, p0, p1)
+    elif hasattr(llama_cpp, "llama_kv_self_seq_cp"):
+        llama_cpp.llama_kv_self_seq_cp(ctx, src, dst, p0, p1)
+    else:
+        llama_cpp.llama_kv_cache_seq_cp(ctx, src, dst, p0, p1)
+
+
+def sample_token(logits, temperature, top_p, rng):
+    """
+    Sample the next token with temperature and nucleus (top-p) sampling
+
+    Args:
+        logits: 1-D array of vocabulary logits
+        temperature: Softmax temperature, 0 selects the most likely token
+        top_p: Cumulative probability mass to sample from
+        rng: numpy random Generator
+
+    Returns:
+        Token id
+    """
+    if temperature <= 0:
+        return int(np.argmax(logits))
+    scaled = logits / temperature
+    scaled = scaled - scaled.max()
+    probs = np.exp(scaled)
+    probs /= probs.sum()
+    if top_p >= 1.0:
+        return int(rng.choice(len(probs), p=probs))
+    order = np.argsort(-probs)
+    sorted_probs = probs[order]
+    cutoff = int(np.searchsorted(np.cumsum(sorted_probs), top_p)) + 1
+    kept = sorted_probs[:cutoff]
+    return int(rng.choice(order[:cutoff], p=kept / kept.sum()))
+
+
+class _Sequence:
+    def __init__(self, job, seq_id, tokens, max_tokens, temperature, top_p):
+        self.job = job
+        self.seq_id = seq_id
+        self.tokens = list(tokens)  # Prompt plus generated tokens
+        self.prompt_length = len(tokens)
+        self.pending = list(tokens)  # Tokens not yet evaluated
+        self.n_past = 0
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.generated = 0
+        self.text = []
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.logits_index = None
+        self.finish_reason = None
+        self.started_at = time.monotonic()
+        self.first_token_at = None
+
+
+class BatchEngine:
+    """
+    Continuous batching over one llama.cpp context with several sequences.
+
+    A worker thread runs a single decode loop. Every step evaluates one new
+    token for each generating sequence plus prompt chunks of newly admitted
+    ones, so new requests join between steps and finished sequences leave
+    without stalling the others. The static instruction preambles are
+    evaluated once into reserved sequences and shared with every new
+    sequence that starts with them. If the context cannot be built or the
+    loop fails, queued jobs are failed and the context is rebuilt with
+    backoff.
+
+    Exposes the same submit/submit_stream interface as InferenceScheduler.
+    """
+
+    def __init__(self, model_manager, max_sequences=BATCH_MAX_SEQUENCES, batch_size=BATCH_SIZE,
+                 ctx_per_sequence=BATCH_CTX_PER_SEQUENCE, max_queue=INFERENCE_QUEUE_SIZE):
+        self.model_manager = model_manager
+        self.max_sequences = max_sequences
+        self.batch_size = batch_size
+        self.ctx_per_sequence = ctx_per_sequence
+        self.max_queue = max_queue
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._start_lock = threading.Lock()
+        self._worker = None
+        self._active = []
+        self._rng = np.random.default_rng()
+        self.ctx = None
+        self.batch = None
+        self.restarts = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.decode_steps = 0
+        self.batched_tokens = 0
+        self.generated_tokens = 0
+        self.decode_seconds = 0.0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def start(self):
+        """Start the decode loop thread if it is not already running."""
+        with self._start_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="batch-engine", daemon=True)
+                self._worker.start()
+
+    def warmup(self):
+        """Load the model and start the decode loop. Returns True if the model is ready."""
+        ready = self.model_manager.get() is not None
+        if ready:
+            self.start()
+        return ready
+
+    def load_status(self):
+        """Return the model load phase and progress, see ModelManager.load_status."""
+        return self.model_manager.load_status()
+
+    @property
+    def context_tokens(self):
+        """Context window available to one generation."""
+        return self.ctx_per_sequence
+
+    def _enqueue(self, job):
+        self.start()
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self.rejected += 1
+            logger.warning("Batch engine queue full (%s jobs), rejecting request", self.max_queue)
+            raise QueueFullError("The model is busy, please retry shortly.")
+
+    def submit(self, prompt, **params):
+        """Queue a completion job. Returns a Future of the model output dictionary."""
+        job = _Job(prompt, params, stream=False)
+        self._enqueue(job)
+        return job.future
+
+    def submit_stream(self, prompt, **params):
+        """Queue a streaming completion job. Returns a StreamHandle."""
+        job = _Job(prompt, params, stream=True)
+        self._enqueue(job)
+        return StreamHandle(job)
+
+    def _setup(self):
+        llama_cpp = _low_level()
+        self.llama = self.model_manager.get()
+        if self.llama is None:
+            raise ModelUnavailableError("The language model could not be loaded.")
+
+        self._prefix_tokens = [self.llama.tokenize(p.encode("utf-8")) for p in STATIC_PREFIXES]
+        n_seq = self.max_sequences + len(self._prefix_tokens)
+
+        params = llama_cpp.llama_context_default_params()
+        params.n_ctx = self.ctx_per_sequence * n_seq
+        params.n_batch = self.batch_size
+        params.n_seq_max = n_seq
+        params.n_threads = self.model_manager.n_threads
+        params.n_threads_batch = self.model_manager.n_threads
+        new_context = getattr(llama_cpp, "llama_init_from_model", None) or llama_cpp.llama_new_context_with_model
+        self.ctx = new_context(self.llama.model, params)
+        if not self.ctx:
+            self.ctx = None
+            raise ModelUnavailableError("Could not create a batched llama.cpp context.")
+        self.batch = llama_cpp.llama_batch_init(self.batch_size, 0, n_seq)
+        self.n_vocab = self.llama.n_vocab()
+        self.eos_token = self.llama.token_eos()
+        self._free_seq_ids = list(range(len(self._prefix_tokens), n_seq))
+
+        # Evaluate each preamble once into its own reserved sequence
+        for seq_id, tokens in enumerate(self._prefix_tokens):
+            for start in range(0, len(tokens), self.batch_size):
+                chunk = tokens[start:start + self.batch_size]
+                self.batch.n_tokens = 0
+                for offset, token in enumerate(chunk):
+                    self._add_token(token, start + offset, seq_id, False)
+                if llama_cpp.llama_decode(self.ctx, self.batch) != 0:
+                    raise RuntimeError("llama_decode failed while caching a prompt prefix")
+        logger.info("Batch engine ready: %s sequences of %s tokens, %s cached prefixes",
+                    self.max_sequences, self.ctx_per_sequence, len(self._prefix_tokens))
+
+    def _teardown(self):
+        """Free the batch and the context so _setup can build new ones."""
+        if self.batch is None and self.ctx is None:
+            return
+        llama_cpp = _low_level()
+        if self.batch is not None:
+            llama_cpp.llama_batch_free(self.batch)
+            self.batch = None
+        if self.ctx is not None:
+            llama_cpp.llama_free(self.ctx)
+            self.ctx = None
+
+    def _add_token(self, token, pos, seq_id, logits):
+        i = self.batch.n_tokens
+        self.batch.token[i] = token
+        self.batch.pos[i] = pos
+        self.batch.n_seq_id[i] = 1
+        self.batch.seq_id[i][0] = seq_id
+        self.batch.logits[i] = logits
+        self.batch.n_tokens = i + 1
+        return i
+
+    def _run(self):
+        delay = BATCH_RETRY_DELAY
+        while True:
+            try:
+                self._setup()
+            except Exception as e:
+                logger.exception("Batch engine failed to start, retrying in %.0fs: %s", delay, e)
+                self._teardown()
+                self._fail_queued(e, delay)
+                delay = min(delay * 2, BATCH_RETRY_MAX_DELAY)
+                self.restarts += 1
+                continue
+            delay = BATCH_RETRY_DELAY
+
+            try:
+                while True:
+                    self._admit(block=not self._active)
+                    if self._active:
+                        self._step()
+            except Exception as e:
+                logger.exception("Batch engine decode loop failed, rebuilding the context: %s", e)
+                for seq in self._active:
+                    self.failed += 1
+                    self._finish_job(seq.job, None, error=e)
+                self._active = []
+                self._teardown()
+                self.restarts += 1
+
+    def _fail_queued(self, error, seconds):
+        """Fail every job queued in the next ``seconds``, since no context can run them."""
+        deadline = time.monotonic() + seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                job = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                return
+            self.failed += 1
+            self._finish_job(job, None, error=error)
+
+    def _admit(self, block):
+        while len(self._active) < self.max_sequences:
+            try:
+                job = self._queue.get() if block else self._queue.get_nowait()
+            except queue.Empty:
+                return
+            block = False
+            job.wait_seconds = time.monotonic() - job.enqueued_at
+            self.total_wait_seconds += job.wait_seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, job.wait_seconds)
+            if job.cancelled:
+                self._finish_job(job, None)
+                continue
+            try:
+                self._active.append(self._start_sequence(job))
+            except Exception as e:
+                self.failed += 1
+                self._finish_job(job, None, error=e)
+
+    def _start_sequence(self, job):
+        tokens = self.llama.tokenize(job.prompt.encode("utf-8"))
+        if len(tokens) >= self.ctx_per_sequence:
+            raise ValueError(f"Prompt of {len(tokens)} tokens does not fit the {self.ctx_per_sequence}-token context")
+        job.prompt_tokens = len(tokens)
+
+        params = job.params
+        max_tokens = min(params.get("max_tokens", 800), self.ctx_per_sequence - len(tokens))
+        seq_id = self._free_seq_ids.pop()
+        started = False
+        try:
+            seq = _Sequence(job, seq_id, tokens, max_tokens, params.get("temperature", 0.8), params.get("top_p", 0.95))
+
+            # Share the KV cells of the longest matching preamble, keeping at least one token to evaluate
+            best_seq, best_length = None, 0
+            for prefix_seq, prefix in enumerate(self._prefix_tokens):
+                length = min(common_prefix_length(prefix, tokens), len(tokens) - 1)
+                if length > best_length:
+                    best_seq, best_length = prefix_seq, length
+            if best_seq is not None:
+                _kv_seq_cp(self.ctx, best_seq, seq_id, 0, best_length)
+                seq.n_past = best_length
+                seq.pending = tokens[best_length:]
+            started = True
+            return seq
+        finally:
+            if not started:
+                # Hand the id back, without cells a partial copy may have left behind
+                _kv_seq_rm(self.ctx, seq_id)
+                self._free_seq_ids.append(seq_id)
+
+    def _step(self):
+        llama_cpp = _low_level()
+        self.batch.n_tokens = 0
+        # Sequences that are generating go first so they advance every step
+        for seq in sorted(self._active, key=lambda s: len(s.pending) > 1):
+            seq.logits_index = None
+            budget = self.batch_size - self.batch.n_tokens
+            if budget <= 0:
+                break
+            chunk = seq.pending[:budget]
+            for offset, token in enumerate(chunk):
+                last = offset == len(chunk) - 1 and len(chunk) == len(seq.pending)
+                index = self._add_token(token, seq.n_past + offset, seq.seq_id, last)
+                if last:
+                    seq.logits_index = index
+            seq.n_past += len(chunk)
+            seq.pending = seq.pending[len(chunk):]
+
+        started = time.monotonic()
+        status = llama_cpp.llama_decode(self.ctx, self.batch)
+        self.decode_seconds += time.monotonic() - started
+        self.decode_steps += 1
+        self.batched_tokens += self.batch.n_tokens
+        if status != 0:
+            logger.error("llama_decode failed with status %s, failing %s sequences", status, len(self._active))
+            for seq in list(self._active):
+                self._finish(seq, error=RuntimeError(f"llama_decode failed with status {status}"))
+            return
+
+        for seq in list(self._active):
+            if seq.job.cancelled:
+                self._finish(seq, "cancelled")
+                continue
+            if seq.logits_index is None:
+                continue
+            logits = np.ctypeslib.as_array(llama_cpp.llama_get_logits_ith(self.ctx, seq.logits_index),
+                                           shape=(self.n_vocab,))
+            token = sample_token(logits, seq.temperature, seq.top_p, self._rng)
+            if token == self.eos_token:
+                self._finish(seq, "stop")
+                continue
+
+            if seq.first_token_at is None:
+                seq.first_token_at = time.monotonic()
+            text = seq.decoder.decode(self._token_bytes(token, seq.tokens))
+            seq.tokens.append(token)
+            seq.pending = [token]
+            seq.generated += 1
+            self.generated_tokens += 1
+            if text:
+                seq.text.append(text)
+                if seq.job.stream:
+                    seq.job.chunks.put({"choices": [{"text": text, "finish_reason": None}]})
+            if seq.generated >= seq.max_tokens:
+                self._finish(seq, "length")
+
+    def _token_bytes(self, token, prev_tokens):
+        try:
+            return self.llama.detokenize([token], prev_tokens=prev_tokens)
+        except TypeError:
+            # Older llama-cpp-python versions have no prev_tokens argument
+            return self.llama.detokenize([token])
+
+    def _finish(self, seq, finish_reason=None, error=None):
+        self._active.remove(seq)
+        _kv_seq_rm(self.ctx, seq.seq_id)
+        self._free_seq_ids.append(seq.seq_id)
+        if error is not None:
+            self.failed += 1
+            self._finish_job(seq.job, None, error=error)
+            return
+
+        self.completed += 1
+        finished = time.monotonic()
+        first_token_at = seq.first_token_at or finished
+        record_generation(seq.prompt_length, {
+            "prompt_eval_seconds": first_token_at - seq.started_at,
+            "generation_seconds": finished - first_token_at,
+            "completion_tokens": seq.generated,
+        })
+        text = "".join(seq.text) + seq.decoder.decode(b"", final=True)
+        self._finish_job(seq.job, {
+            "choices": [{"text": text, "finish_reason": finish_reason}],
+            "usage": {
+                "prompt_tokens": seq.prompt_length,
+                "completion_tokens": seq.generated,
+                "total_tokens": seq.prompt_length + seq.generated,
+            },
+        })
+
+    def _finish_job(self, job, result, error=None):
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(None if job.stream else result)
+        if job.stream:
+            job.chunks.put(_STREAM_END)
+
+    def stats(self):
+        """Return queue, batch occupancy and throughput statistics."""
+        started = self.completed + self.failed + len(self._active)
+        return {
+            "mode": "batch",
+            "queue_depth": self._queue.qsize(),
+            "max_queue": self.max_queue,
+            "active_sequences": len(self._active),
+            "max_sequences": self.max_sequences,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "decode_steps": self.decode_steps,
+            "avg_batch_tokens": self.batched_tokens / self.decode_steps if self.decode_steps else None,
+            "generated_tokens": self.generated_tokens,
+            "tokens_per_second": self.generated_tokens / self.decode_seconds if self.decode_seconds else None,
+            "avg_wait_seconds": self.total_wait_seconds / started if started else None,
+            "max_wait_seconds": self.max_wait_seconds,
+            "restarts": self.restarts,
+            "model": self.model_manager.stats(),
+        }
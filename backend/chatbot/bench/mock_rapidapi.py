@@ -0,0 +1,229 @@
+"""
+Local stand-in for the RapidAPI market data endpoints used by the chatbot.
+
+Serves the yahoo-finance15 ``tickers``, ``quote`` and ``stock/quotes`` endpoints and the
+yahoo-finance127 ``esg-scores`` endpoint from the recorded payloads in
+bench/fixtures, with configurable latency, 429 injection and pagination.
+
+Run with: python -m bench.mock_rapidapi --port 8900 --latency-ms 150 --rate-limit 0.05
+then point the backend at it:
+    YAHOO_FINANCE_BASE_URL=http://127.0.0.1:8900 ESG_API_BASE_URL=http://127.0.0.1:8900 python app.py
+
+Refresh the fixtures from the live API with: python -m bench.mock_rapidapi --record AAPL MSFT ...
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def load_fixtures(fixtures_dir=FIXTURES_DIR):
+    """Load the recorded tickers, quote and ESG payloads."""
+    fixtures = {}
+    for name in ("tickers", "quotes", "esg"):
+        with open(os.path.join(fixtures_dir, f"{name}.json")) as f:
+            fixtures[name] = json.load(f)
+    return fixtures
+
+
+class MockRapidAPI:
+    """
+    Replays recorded market data payloads over HTTP.
+
+    Args:
+        fixtures: Dictionary with "tickers" (list), "quotes" and "esg" (symbol -> payload)
+        latency_ms: Mean latency added to every response
+        jitter_ms: Uniform jitter around the mean latency
+        rate_limit: Fraction of requests answered with a 429
+        retry_after: Retry-After header value sent with injected 429s
+        page_size: Tickers per listing page
+        synthetic_tickers: Generated listing entries appended after the recorded ones,
+            to give the ticker directory a realistic number of pages
+    """
+
+    def __init__(self, fixtures=None, latency_ms=0.0, jitter_ms=0.0, rate_limit=0.0, retry_after=1,
+                 page_size=100, synthetic_tickers=0, seed=None):
+        fixtures = fixtures or load_fixtures()
+        self.tickers = list(fixtures["tickers"]) + [
+            {"symbol": f"ZZ{i:04d}", "name": f"Synthetic Holdings {i} Common Stock",
+             "lastsale": f"${10 + i % 90}.00", "netchange": "0.00", "pctchange": "0.000%", "marketCap": ""}
+            for i in range(synthetic_tickers)
+        ]
+        self.quotes = fixtures["quotes"]
+        self.esg = fixtures["esg"]
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.page_size = page_size
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = {}  # endpoint -> count
+        self.rate_limited = 0
+        self._server = None
+        self._thread = None
+
+    def _should_rate_limit(self):
+        with self._lock:
+            limited = self._random.random() < self.rate_limit
+            if limited:
+                self.rate_limited += 1
+            return limited
+
+    def _delay(self):
+        with self._lock:
+            jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms)
+        delay = max(0.0, self.latency_ms + jitter) / 1000
+        if delay:
+            time.sleep(delay)
+
+    def _count(self, endpoint):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def respond(self, path, query):
+        """Return (status, payload) for a request path and parsed query string."""
+        if path.endswith("/api/v2/markets/tickers"):
+            self._count("tickers")
+            page = int(query.get("page", ["1"])[0])
+            start = (page - 1) * self.page_size
+            body = self.tickers[start:start + self.page_size]
+            return 200, {"meta": {"page": page, "totalrecords": len(self.tickers)}, "body": body}
+
+        if path.endswith("/api/v1/markets/stock/quotes"):
+            self._count("quotes")
+            symbols = [s.strip().upper() for s in query.get("ticker", [""])[0].split(",") if s.strip()]
+            return 200, {"meta": {"symbols": ",".join(symbols)},
+                         "body": [self.quotes[s] for s in symbols if s in self.quotes]}
+
+        if path.endswith("/api/v1/markets/quote"):
+            self._count("quote")
+            symbol = query.get("ticker", [""])[0].upper()
+            quote = self.quotes.get(symbol)
+            if quote is None:
+                return 200, {"meta": {"symbol": symbol}, "body": {}}
+            return 200, {"meta": {"symbol": symbol}, "body": quote}
+
+        if "/esg-scores/" in path:
+            self._count("esg")
+            symbol = path.rsplit("/", 1)[-1].upper()
+            scores = self.esg.get(symbol)
+            if scores is None:
+                return 404, {"message": f"No ESG scores for {symbol}"}
+            return 200, scores
+
+        return 404, {"message": "Endpoint does not exist"}
+
+    def handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                mock._delay()
+                if mock._should_rate_limit():
+                    status, payload, headers = 429, {"message": "Too many requests"}, {"Retry-After": str(mock.retry_after)}
+                else:
+                    url = urlsplit(self.path)
+                    status, payload = mock.respond(url.path, parse_qs(url.query))
+                    headers = {}
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        return Handler
+
+    def start(self, host="127.0.0.1", port=0):
+        """Serve in a daemon thread. Returns the base URL."""
+        self._server = ThreadingHTTPServer((host, port), self.handler_class())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-rapidapi", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def record_fixtures(symbols, fixtures_dir=FIXTURES_DIR, ticker_pages=1):
+    """Replace the fixtures with live responses from the RapidAPI endpoints."""
+    import app
+
+    tickers = app.get_all_ticker_pages(max_pages=ticker_pages)
+    quotes, esg = {}, {}
+    for symbol in symbols:
+        quote = app.fetch_realtime_quote(symbol)
+        if isinstance(quote, dict) and isinstance(quote.get("body"), dict) and quote["body"]:
+            quotes[symbol] = quote["body"]
+        scores = app.fetch_esg_data(symbol)
+        if scores:
+            esg[symbol] = scores
+    # Keep the recorded symbols in the listing even if they are not on the first pages
+    listed = {t.get("symbol") for t in tickers}
+    tickers.extend({"symbol": s, "name": q.get("longName", s), "lastsale": f"${q.get('regularMarketPrice', '')}",
+                    "netchange": "", "pctchange": "", "marketCap": ""}
+                   for s, q in quotes.items() if s not in listed)
+
+    for name, payload in (("tickers", tickers), ("quotes", quotes), ("esg", esg)):
+        with open(os.path.join(fixtures_dir, f"{name}.json"), "w") as f:
+            json.dump(payload, f, indent=2)
+    logger.info("Recorded %s tickers, %s quotes and %s ESG scores", len(tickers), len(quotes), len(esg))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="fraction of requests answered with a 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--synthetic-tickers", type=int, default=0)
+    parser.add_argument("--record", nargs="+", metavar="SYMBOL", help="record fixtures for SYMBOLs from the live API")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.record:
+        record_fixtures(args.record)
+        return
+
+    mock = MockRapidAPI(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, rate_limit=args.rate_limit,
+                        retry_after=args.retry_after, page_size=args.page_size,
+                        synthetic_tickers=args.synthetic_tickers)
+    logger.info("Mock RapidAPI serving on %s", mock.start(args.host, args.port))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+Offline load benchmark for the chatbot backend.
+
+Starts the local RapidAPI stand-in (bench/mock_rapidapi.py), points the
+backend at it and at a model file, then drives load scenarios against the
+Flask /chat endpoint and esg.chat_response, reporting throughput and
+p50/p95/p99 latency. No API quota is used.
+
+Scenarios:
+    single      the same single-symbol question over and over
+    comparison  two-symbol comparison questions
+    skew        single-symbol questions with Zipf-distributed (hot) symbols
+    cold        fresh process: import, model load and first answer
+
+Run with (from backend/chatbot):
+    python -m bench.run_bench --fetch-tiny-model --scenarios single skew cold --requests 40 --concurrency 4
+    python -m bench.run_bench --model finance-chat.Q8_0.gguf --targets chat --json bench_results.json
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.mock_rapidapi import MockRapidAPI, load_fixtures
+
+logger = logging.getLogger(__name__)
+
+# Small GGUF checkpoint used to exercise the llama.cpp code paths quickly
+TINY_MODEL_REPO = os.environ.get("BENCH_TINY_MODEL_REPO", "ggml-org/models")
+TINY_MODEL_FILE = os.environ.get("BENCH_TINY_MODEL_FILE", "tinyllamas/stories260K.gguf")
+
+DIRECTORY_LOAD_TIMEOUT = 60.0  # seconds to wait for the ticker listing before measuring anyway
+
+SCENARIOS = ("single", "comparison", "skew", "cold")
+TARGETS = ("chat", "esg")
+
+
+def fetch_tiny_model(local_dir="."):
+    """Download the tiny benchmark model if needed and return its path."""
+    from huggingface_hub import hf_hub_download
+
+    return hf_hub_download(repo_id=TINY_MODEL_REPO, filename=TINY_MODEL_FILE, local_dir=local_dir)
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, errors, wall_seconds):
+    ordered = sorted(latencies)
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput_rps": len(latencies) / wall_seconds if wall_seconds else None,
+        "mean_seconds": sum(ordered) / len(ordered) if ordered else None,
+        "p50_seconds": percentile(ordered, 50),
+        "p95_seconds": percentile(ordered, 95),
+        "p99_seconds": percentile(ordered, 99),
+    }
+
+
+def scenario_messages(scenario, symbols, count, rng):
+    """Return the user messages sent by a load scenario."""
+    if scenario == "single":
+        return [f"What is the current price of {symbols[0]}?"] * count
+    if scenario == "comparison":
+        return [f"Compare {a} and {b} as a long-term investment"
+                for a, b in (rng.sample(symbols, 2) for _ in range(count))]
+    if scenario == "skew":
+        # A few hot symbols get most of the traffic, like a real watchlist
+        weights = [1 / (rank + 1) ** 1.2 for rank in range(len(symbols))]
+        return [f"Is {symbol} a good investment right now?" for symbol in rng.choices(symbols, weights, k=count)]
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+
+def chat_caller(url=None):
+    """Return a callable sending one message to /chat, in process or over HTTP."""
+    if url:
+        import requests
+
+        session = requests.Session()
+
+        def call(message):
+            response = session.post(f"{url}/chat", json={"message": message}, timeout=600)
+            return response.status_code == 200
+        return call
+
+    import app
+
+    client = app.app.test_client()
+
+    def call(message):
+        return client.post("/chat", json={"message": message}).status_code == 200
+    return call
+
+
+def esg_caller():
+    import esg
+
+    def call(message):
+        reply = esg.chat_response(message)
+        return bool(reply) and not reply.startswith("I apologize")
+    return call
+
+
+def run_load(call, messages, concurrency):
+    """Send ``messages`` through ``call`` from ``concurrency`` threads and summarize the latencies."""
+    latencies = []
+    errors = 0
+
+    def timed(message):
+        started = time.monotonic()
+        try:
+            ok = call(message)
+        except Exception as e:
+            logger.error("Request failed: %s", e)
+            ok = False
+        return ok, time.monotonic() - started
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for ok, seconds in pool.map(timed, messages):
+            if ok:
+                latencies.append(seconds)
+            else:
+                errors += 1
+    return summarize(latencies, errors, time.monotonic() - started)
+
+
+def run_cold_start(target, symbol, env, runs):
+    """Measure import, model load and first answer in fresh interpreter processes."""
+    samples = []
+    for _ in range(runs):
+        started = time.monotonic()
+        output = subprocess.run(
+            [sys.executable, "-m", "bench.run_bench", "--cold-start-child", target, "--symbol", symbol],
+            env=env, capture_output=True, text=True, check=True
+        ).stdout
+        sample = json.loads(output.strip().splitlines()[-1])
+        sample["process_seconds"] = time.monotonic() - started
+        samples.append(sample)
+    totals = sorted(s["process_seconds"] for s in samples)
+    return {
+        "runs": runs,
+        "samples": samples,
+        "p50_seconds": percentile(totals, 50),
+        "p95_seconds": percentile(totals, 95),
+        "p99_seconds": percentile(totals, 99),
+    }
+
+
+def cold_start_child(target, symbol):
+    """Body of a cold start run; prints one JSON line with the phase timings."""
+    started = time.monotonic()
+    if target == "chat":
+        import app
+        imported = time.monotonic()
+        app.ticker_directory.start()
+        ready = app.get_inference_scheduler(app.MODEL_FILENAME).warmup()
+        call = chat_caller()
+    else:
+        import esg
+        from model_manager import get_model_manager
+        imported = time.monotonic()
+        ready = get_model_manager(esg.MODEL_FILENAME).warmup()
+        call = esg_caller()
+    loaded = time.monotonic()
+    ok = call(f"What is the current price of {symbol}?")
+    answered = time.monotonic()
+    print(json.dumps({
+        "ok": bool(ready and ok),
+        "import_seconds": imported - started,
+        "model_load_seconds": loaded - imported,
+        "first_response_seconds": answered - loaded,
+    }))
+
+
+def configure_environment(base_url, model_path, workdir):
+    """Point the backend modules at the mock server, the model and a scratch ESG store and ticker snapshot."""
+    os.environ["YAHOO_FINANCE_BASE_URL"] = base_url
+    os.environ["ESG_API_BASE_URL"] = base_url
+    os.environ["MODEL_PATH"] = model_path
+    os.environ.setdefault("ESG_CACHE_PATH", os.path.join(workdir, "esg_cache.sqlite3"))
+    # The default snapshot in the working directory may hold a real listing, or would get the mock one
+    os.environ.setdefault("TICKER_SNAPSHOT_PATH", os.path.join(workdir, "ticker_snapshot.bin"))
+    os.environ.setdefault("MARKET_DATA_RETRY_DELAY", "0.1")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("LOG_FILE", os.path.join(workdir, "bench.log"))
+
+
+def print_report(results):
+    print(f"\n{'target':<8} {'scenario':<12} {'reqs':>5} {'errs':>5} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    fmt = lambda v: f"{v:8.3f}" if isinstance(v, (int, float)) else f"{'-':>8}"
+    for (target, scenario), r in results.items():
+        print(f"{target:<8} {scenario:<12} {r.get('requests', r.get('runs', 0)):>5} {r.get('errors', 0):>5} "
+              f"{fmt(r.get('throughput_rps'))} {fmt(r['p50_seconds'])} {fmt(r['p95_seconds'])} {fmt(r['p99_seconds'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load benchmark for the chatbot backend")
+    parser.add_argument("--model", help="GGUF model path (defaults to MODEL_PATH or the tiny model)")
+    parser.add_argument("--fetch-tiny-model", action="store_true", help="download the tiny benchmark model")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--targets", nargs="+", choices=TARGETS, default=list(TARGETS))
+    parser.add_argument("--requests", type=int, default=20, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--cold-runs", type=int, default=3)
+    parser.add_argument("--url", help="send /chat to a running server instead of the in-process Flask app")
+    parser.add_argument("--latency-ms", type=float, default=80.0, help="mock upstream latency")
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="fraction of mock responses that are 429s")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--synthetic-tickers", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--cold-start-child", choices=TARGETS, help=argparse.SUPPRESS)
+    parser.add_argument("--symbol", default="AAPL", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cold_start_child:
+        cold_start_child(args.cold_start_child, args.symbol)
+        return
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    model_path = args.model or os.environ.get("MODEL_PATH")
+    if args.fetch_tiny_model or not model_path:
+        model_path = fetch_tiny_model()
+
+    fixtures = load_fixtures()
+    symbols = list(fixtures["quotes"])
+    mock = MockRapidAPI(fixtures, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, rate_limit=args.rate_limit,
+                        page_size=args.page_size, synthetic_tickers=args.synthetic_tickers, seed=args.seed)
+    base_url = mock.start()
+    workdir = tempfile.mkdtemp(prefix="chatbot-bench-")
+    configure_environment(base_url, model_path, workdir)
+    rng = random.Random(args.seed)
+    results = {}
+
+    try:
+        if "cold" in args.scenarios:
+            for target in args.targets:
+                logger.warning("Running cold start for %s", target)
+                results[(target, "cold")] = run_cold_start(target, symbols[0], dict(os.environ), args.cold_runs)
+
+        warm = [s for s in args.scenarios if s != "cold"]
+        for target in args.targets if warm else ():
+            if target == "chat" and not args.url:
+                import app
+                app.ticker_directory.start()
+                if not app.ticker_directory.wait_until_loaded(DIRECTORY_LOAD_TIMEOUT):
+                    logger.warning("Ticker directory not loaded after %ss, measuring without it",
+                                   DIRECTORY_LOAD_TIMEOUT)
+                app.get_inference_scheduler(app.MODEL_FILENAME).warmup()
+            call = chat_caller(args.url) if target == "chat" else esg_caller()
+            for scenario in warm:
+                logger.warning("Running %s against %s", scenario, target)
+                messages = scenario_messages(scenario, symbols, args.requests, rng)
+                results[(target, scenario)] = run_load(call, messages, args.concurrency)
+    finally:
+        mock.stop()
+
+    print_report(results)
+    print(f"\nMock upstream requests: {mock.requests}, injected 429s: {mock.rate_limited}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "model": model_path,
+                "settings": {k: v for k, v in vars(args).items() if k not in ("cold_start_child", "symbol")},
+                "upstream_requests": mock.requests,
+                "injected_429s": mock.rate_limited,
+                "results": [{"target": t, "scenario": s, **r} for (t, s), r in results.items()],
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
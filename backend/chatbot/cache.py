@@ -0,0 +1,193 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    """A single upstream load that concurrent callers wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries expire after ``ttl`` seconds.
+
+    ``get_or_load`` coalesces concurrent misses for the same key: the first
+    caller runs the loader and every other caller waits for its result
+    instead of issuing its own upstream request. Expired entries are kept
+    for another ``stale_ttl`` seconds and returned when a reload fails.
+    Subscribers are called with every value stored, see subscribe.
+    """
+
+    def __init__(self, maxsize=1024, ttl=5.0, name="cache", stale_ttl=0.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.name = name
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._flights = {}
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stale_served = 0
+
+    def get(self, key, stale=False):
+        """
+        Return the cached value for ``key`` or None if it is missing or expired
+
+        With ``stale=True`` an expired value still inside the stale window is
+        returned too. Stale lookups are fallbacks and do not count towards the
+        hit rate.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.monotonic()
+            if entry is not None and entry[0] + self.stale_ttl < now:
+                del self._entries[key]
+                entry = None
+            if entry is None or (entry[0] < now and not stale):
+                if not stale:
+                    self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if not stale:
+                self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        """Store ``value`` under ``key`` and evict the least recently used entries."""
+        with self._lock:
+            self._set_locked(key, value, ttl)
+        self._notify(key, value)
+
+    def _set_locked(self, key, value, ttl=None):
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def get_or_load(self, key, loader, cache_if=bool, count=True):
+        """
+        Return the cached value for ``key``, loading it once on a miss
+
+        Args:
+            key: Cache key
+            loader: Zero-argument callable fetching the value upstream
+            cache_if: Predicate deciding whether a loaded value is stored (empty results are not by default)
+            count: False when the caller already counted this lookup with get
+
+        Returns:
+            Cached or freshly loaded value, or the stale value if the load came back empty or failed
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.monotonic()
+            if entry is not None and entry[0] >= now:
+                self._entries.move_to_end(key)
+                self.hits += count
+                return entry[1]
+            stale = entry[1] if entry is not None and entry[0] + self.stale_ttl >= now else None
+
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += count
+                leader = False
+            else:
+                self.misses += count
+                flight = _Flight()
+                self._flights[key] = flight
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        stored = False
+        try:
+            flight.value = loader()
+        except Exception as e:
+            if stale is None:
+                flight.error = e
+                raise
+            logger.warning("Reloading %s from %s cache failed, serving stale value: %s", key, self.name, e)
+            flight.value = stale
+            self.stale_served += 1
+        finally:
+            with self._lock:
+                if flight.error is None and flight.value is not stale and cache_if(flight.value):
+                    self._set_locked(key, flight.value)
+                    stored = True
+                elif flight.error is None and stale is not None and flight.value is not stale:
+                    logger.info("Upstream returned nothing for %s, serving stale %s entry", key, self.name)
+                    flight.value = stale
+                    self.stale_served += 1
+                self._flights.pop(key, None)
+            flight.done.set()
+        if stored:
+            self._notify(key, flight.value)
+        return flight.value
+
+    def subscribe(self, callback):
+        """
+        Call ``callback(key, value)`` for every value stored from now on
+
+        The callback is first called for every entry already cached, stale
+        ones included, so a subscriber starts with the same data as the cache.
+        Callbacks run on the storing thread, outside the cache lock.
+        """
+        with self._lock:
+            self._subscribers.append(callback)
+            now = time.monotonic()
+            entries = [(key, value) for key, (expires_at, value) in self._entries.items()
+                       if expires_at + self.stale_ttl >= now]
+        for key, value in entries:
+            callback(key, value)
+
+    def _notify(self, key, value):
+        for callback in self._subscribers:
+            try:
+                callback(key, value)
+            except Exception as e:
+                logger.exception("Subscriber of %s cache failed on %s: %s", self.name, key, e)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key):
+        """True if ``key`` has a fresh entry. Does not count as a lookup or refresh the entry's LRU position."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] >= time.monotonic()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Return hit/miss counters and the current size."""
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "stale_served": self.stale_served,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else None,
+        }
@@ -0,0 +1,234 @@
+import logging
+import os
+import re
+import time
+
+from data_gathering import gather
+
+logger = logging.getLogger(__name__)
+
+# Multi-symbol configuration
+MAX_QUERY_SYMBOLS = int(os.environ.get("MAX_QUERY_SYMBOLS", "20"))
+QUOTE_BATCH_SIZE = int(os.environ.get("QUOTE_BATCH_SIZE", "20"))  # symbols per batched quote request
+QUOTE_BATCH_ENABLED = os.environ.get("QUOTE_BATCH_ENABLED", "1") == "1"
+QUOTE_MISSING_TTL = float(os.environ.get("QUOTE_MISSING_TTL", "60"))  # seconds a symbol without a quote is remembered
+
+_SYMBOL_PATTERN = re.compile(r'\b([A-Z]{1,5})\b')
+_VALID_SYMBOL = re.compile(r'^[A-Z0-9^][A-Z0-9.\-=^]{0,11}$')
+
+# Uppercase words that show up in financial questions but are not meant as tickers,
+# including common English words that are also listed symbols (ALL, IT, NOW, ON, ...)
+NON_SYMBOL_WORDS = frozenset({
+    "I", "A", "AI", "CEO", "CFO", "EPS", "ESG", "ETF", "ETFS", "GDP", "IPO", "IRA", "OK", "PE", "ROI",
+    "US", "USA", "USD", "VS", "YTD",
+    "AM", "AN", "AT", "BE", "BY", "DO", "GO", "HE", "IF", "IN", "IS", "IT", "ME", "MY", "NO", "OF", "ON",
+    "OR", "SO", "TO", "UP", "WE", "ALL", "AND", "ARE", "BIG", "BUY", "CAN", "FOR", "HAS", "NEW", "NOT",
+    "NOW", "ONE", "OUT", "SEE", "THE", "TWO", "WHY", "BEST", "GOOD", "HIGH", "LOW", "REAL", "SELL",
+})
+
+
+def detect_symbols(user_message, limit=MAX_QUERY_SYMBOLS):
+    """
+    Return every ticker-like word in a user's query, in order of first mention
+
+    Single letters and common uppercase finance words are skipped.
+    """
+    symbols = []
+    for match in _SYMBOL_PATTERN.finditer(user_message):
+        symbol = match.group(1)
+        if len(symbol) < 2 or symbol in NON_SYMBOL_WORDS or symbol in symbols:
+            continue
+        symbols.append(symbol)
+        if len(symbols) == limit:
+            break
+    return symbols
+
+
+def normalize_symbols(symbols, limit=MAX_QUERY_SYMBOLS):
+    """
+    Validate a client-supplied symbol list
+
+    Args:
+        symbols: List of ticker symbols
+        limit: Maximum number of symbols accepted
+
+    Returns:
+        Uppercased, de-duplicated symbols
+
+    Raises:
+        ValueError: If the list is malformed or too long
+    """
+    if not isinstance(symbols, list) or not all(isinstance(s, str) for s in symbols):
+        raise ValueError("'symbols' must be a list of ticker symbols.")
+    normalized = []
+    for symbol in symbols:
+        symbol = symbol.strip().upper()
+        if not _VALID_SYMBOL.match(symbol):
+            raise ValueError(f"Invalid ticker symbol: {symbol!r}")
+        if symbol not in normalized:
+            normalized.append(symbol)
+    if len(normalized) > limit:
+        raise ValueError(f"At most {limit} symbols can be requested at once.")
+    return normalized
+
+
+def parse_batch_quotes(data):
+    """
+    Split a batched quote response into per-symbol responses
+
+    Each value has the same ``{"body": {...}}`` shape as a single-symbol
+    quote response, so it can go through extract_ticker_data and the quote
+    cache unchanged.
+    """
+    body = data.get("body") if isinstance(data, dict) else None
+    if not isinstance(body, list):
+        return {}
+    quotes = {}
+    for quote in body:
+        if isinstance(quote, dict) and quote.get("symbol"):
+            quotes[quote["symbol"].upper()] = {"body": quote}
+    return quotes
+
+
+def has_quote(response):
+    """True if a quote response carries quote data, False for failures and symbols the API does not know."""
+    if not isinstance(response, dict):
+        return False
+    quote = response.get("data") if isinstance(response.get("data"), dict) else response.get("body")
+    return isinstance(quote, dict) and bool(quote)
+
+
+def load_quote(symbol, fetch_one, cache=None, missing_ttl=QUOTE_MISSING_TTL, count=True):
+    """
+    Return the quote response for one symbol, from ``cache`` when it has a fresh one
+
+    A response without quote data means the API does not know the symbol.
+    It is cached for ``missing_ttl`` seconds so repeated questions about a
+    misspelled or delisted symbol do not go upstream every time. Failed
+    requests (empty responses) are not cached.
+
+    Args:
+        symbol: Ticker symbol
+        fetch_one: Callable taking one symbol and fetching its quote response upstream
+        cache: Optional TTLCache of quote responses keyed by symbol
+        missing_ttl: Seconds a symbol without quote data is cached
+        count: False when the caller already counted the cache lookup
+
+    Returns:
+        Quote response, or an empty value if the request failed
+    """
+    if cache is None:
+        return fetch_one(symbol)
+    response = cache.get_or_load(symbol, lambda: fetch_one(symbol), cache_if=has_quote, count=count)
+    if response and not has_quote(response) and symbol not in cache:
+        cache.set(symbol, response, ttl=missing_ttl)
+    return response
+
+
+def fetch_quotes(symbols, fetch_batch, fetch_one, deadline, cache=None, batch_size=QUOTE_BATCH_SIZE):
+    """
+    Get quotes for many symbols with as few upstream round trips as possible
+
+    Fresh cache entries are used first, and symbols cached as unknown are
+    skipped. The remaining symbols are requested ``batch_size`` at a time
+    from the batched quote endpoint, and whatever that does not return is
+    loaded with load_quote in a concurrent fan-out bounded by the data
+    gathering pool. Each symbol counts as one cache lookup.
+
+    Args:
+        symbols: Ticker symbols
+        fetch_batch: Callable taking a symbol list and returning ``{symbol: quote response}``
+        fetch_one: Callable taking one symbol and fetching its quote response upstream
+        deadline: Absolute ``time.monotonic()`` value after which lookups are abandoned
+        cache: Optional TTLCache of quote responses keyed by symbol
+        batch_size: Symbols per batched request
+
+    Returns:
+        Dictionary mapping each symbol that has data to its quote response
+    """
+    quotes = {}
+    missing = []
+    for symbol in symbols:
+        cached = cache.get(symbol) if cache is not None else None
+        if cached is None:
+            missing.append(symbol)
+        elif has_quote(cached):
+            quotes[symbol] = cached
+
+    if missing and QUOTE_BATCH_ENABLED:
+        for start in range(0, len(missing), batch_size):
+            if time.monotonic() >= deadline:
+                break
+            for symbol, quote in fetch_batch(missing[start:start + batch_size]).items():
+                if cache is not None:
+                    cache.set(symbol, quote)
+                quotes[symbol] = quote
+
+    remaining = [s for s in missing if s not in quotes]
+    if remaining:
+        logger.info("Fetching %s quotes individually", len(remaining))
+        results = gather({symbol: (load_quote, symbol, fetch_one, cache, QUOTE_MISSING_TTL, False)
+                          for symbol in remaining}, deadline)
+        quotes.update((symbol, quote) for symbol, quote in results.items() if has_quote(quote))
+    return quotes
+
+
+def _compact_number(value):
+    if not isinstance(value, (int, float)):
+        return str(value)
+    for threshold, suffix in ((1e12, "T"), (1e9, "B"), (1e6, "M"), (1e3, "K")):
+        if abs(value) >= threshold:
+            return f"{value / threshold:.2f}{suffix}"
+    return f"{value:g}"
+
+
+def _esg_cell(esg_data, detail=True):
+    if not esg_data or "totalEsg" not in esg_data:
+        return "N/A"
+    if not detail:
+        return esg_data["totalEsg"].get("fmt", "N/A")
+    scores = [esg_data.get(key, {}).get("fmt", "N/A")
+              for key in ("totalEsg", "environmentScore", "socialScore", "governanceScore")]
+    return "{} ({}/{}/{})".format(*scores)
+
+
+def _price_cell(combined):
+    price = combined.get("price", "N/A")
+    return f"${price}" if not str(price).startswith("$") else str(price)
+
+
+# (header, TRIM_ORDER key that drops the column, cell) of comparison_table
+_COMPARISON_COLUMNS = [
+    ("Symbol", None, lambda combined: combined.get("symbol", "N/A")),
+    ("Name", None, lambda combined: str(combined.get("name", "N/A"))),
+    ("Price", None, lambda combined: _price_cell(combined)),
+    ("Change", None, lambda combined: str(combined.get("change_pct", "N/A"))),
+    ("Market Cap", "market_cap", lambda combined: _compact_number(combined.get("market_cap", "N/A"))),
+    ("52w Low-High", "52w",
+     lambda combined: f"{combined.get('52w_low', 'N/A')}-{combined.get('52w_high', 'N/A')}"),
+    ("Sector", "sector", lambda combined: str(combined.get("sector", "N/A"))),
+]
+
+
+def comparison_table(rows, missing=(), omit=()):
+    """
+    Format several symbols as one compact pipe-separated table of prompt context
+
+    Args:
+        rows: List of ``(combined_data, esg_data)`` tuples
+        missing: Symbols for which no data could be retrieved
+        omit: TRIM_ORDER keys of the columns to leave out
+
+    Returns:
+        Table text
+    """
+    columns = [column for column in _COMPARISON_COLUMNS if column[1] not in omit]
+    esg_detail = "esg_detail" not in omit
+    headers = [header for header, _, _ in columns] + ["ESG (E/S/G)" if esg_detail else "ESG"]
+    lines = [f"Comparison of {len(rows)} symbols:", " | ".join(headers)]
+    for combined, esg_data in rows:
+        cells = [cell(combined) for _, _, cell in columns]
+        lines.append(" | ".join(cells + [_esg_cell(esg_data, esg_detail)]))
+    if missing:
+        lines.append(f"No data available for: {', '.join(missing)}")
+    return "\n".join(lines) + "\n"
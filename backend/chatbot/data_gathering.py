@@ -0,0 +1,78 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+# Upstream lookups are I/O bound, so the pool can be larger than the core count
+DATA_FETCH_WORKERS = int(os.environ.get("DATA_FETCH_WORKERS", "16"))
+
+_executor = ThreadPoolExecutor(max_workers=DATA_FETCH_WORKERS, thread_name_prefix="data-fetch")
+# A task that gathers again (fetch_quotes inside a prefetch) must not wait on
+# its own pool, which can be full of tasks waiting the same way
+_inner_executor = ThreadPoolExecutor(max_workers=DATA_FETCH_WORKERS, thread_name_prefix="data-fetch-inner")
+
+
+def _pool_for_current_thread():
+    """Return the pool nested lookups of this thread run in, or None to run them inline."""
+    name = threading.current_thread().name
+    if name.startswith("data-fetch-inner"):
+        return None
+    if name.startswith("data-fetch"):
+        return _inner_executor
+    return _executor
+
+
+def _gather_inline(tasks, deadline):
+    results = {}
+    for name, (func, *args) in tasks.items():
+        if time.monotonic() >= deadline:
+            logger.warning("Data source '%s' missed the deadline, continuing without it", name)
+            results[name] = None
+            continue
+        try:
+            results[name] = func(*args)
+        except Exception as e:
+            logger.error("Data source '%s' failed: %s", name, e)
+            results[name] = None
+    return results
+
+
+def gather(tasks, deadline):
+    """
+    Run independent lookups concurrently and collect whatever finishes in time
+
+    Args:
+        tasks: Dictionary mapping a result name to a ``(function, *args)`` tuple
+        deadline: Absolute ``time.monotonic()`` value after which results are abandoned
+
+    Returns:
+        Dictionary mapping each name to its result, or None if it failed or timed out
+    """
+    executor = _pool_for_current_thread()
+    if executor is None:
+        return _gather_inline(tasks, deadline)
+
+    futures = {}
+    for name, (func, *args) in tasks.items():
+        # Run in a copy of the caller's context so log records keep its request ID
+        futures[name] = executor.submit(contextvars.copy_context().run, func, *args)
+
+    remaining = max(0.0, deadline - time.monotonic())
+    wait(futures.values(), timeout=remaining)
+
+    results = {}
+    for name, future in futures.items():
+        if not future.done():
+            # The lookup keeps running in the pool, we just stop waiting for it
+            logger.warning("Data source '%s' missed the deadline, continuing without it", name)
+            results[name] = None
+        elif future.exception() is not None:
+            logger.error("Data source '%s' failed: %s", name, future.exception())
+            results[name] = None
+        else:
+            results[name] = future.result()
+    return results
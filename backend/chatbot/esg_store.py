@@ -0,0 +1,164 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# ESG store configuration
+ESG_CACHE_PATH = os.environ.get("ESG_CACHE_PATH", "esg_cache.sqlite3")
+ESG_CACHE_TTL = float(os.environ.get("ESG_CACHE_TTL", str(24 * 60 * 60)))  # seconds
+ESG_CACHE_SIZE = int(os.environ.get("ESG_CACHE_SIZE", "20000"))
+ESG_STALE_TTL = float(os.environ.get("ESG_STALE_TTL", str(7 * 24 * 60 * 60)))  # seconds, served while the API is unavailable
+ESG_PREWARM_SYMBOLS = [s.strip().upper() for s in os.environ.get("ESG_PREWARM_SYMBOLS", "").split(",") if s.strip()]
+
+
+def valid_esg(data):
+    """
+    True if ``data`` is an ESG score payload
+
+    The API reports some errors (unknown symbol, quota exceeded) as a 200
+    with a message body, which must not be stored as the symbol's score.
+    """
+    return isinstance(data, dict) and isinstance(data.get("totalEsg"), dict)
+
+
+class ESGStore:
+    """
+    Long-lived ESG score cache persisted to SQLite.
+
+    Scores are kept in memory for ``ttl`` seconds and written through to
+    ``path`` so a restarted process starts with every score that is still
+    fresh. Older scores are kept for another ``stale_ttl`` seconds and used
+    when the API cannot be reached.
+    """
+
+    def __init__(self, path=ESG_CACHE_PATH, ttl=ESG_CACHE_TTL, maxsize=ESG_CACHE_SIZE, stale_ttl=ESG_STALE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl, name="esg", stale_ttl=stale_ttl)
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS esg_scores ("
+            "symbol TEXT PRIMARY KEY, fetched_at REAL NOT NULL, data TEXT NOT NULL)"
+        )
+        self._db.commit()
+        self._load()
+
+    def _load(self):
+        now = time.time()
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT symbol, fetched_at, data FROM esg_scores WHERE fetched_at > ?",
+                (now - self.ttl - self.stale_ttl,)
+            ).fetchall()
+        loaded = 0
+        for symbol, fetched_at, data in rows:
+            data = json.loads(data)
+            if valid_esg(data):
+                self._cache.set(symbol, data, ttl=fetched_at + self.ttl - now)
+                loaded += 1
+        logger.info("ESG store loaded %s scores from %s", loaded, self.path)
+
+    def _persist(self, symbol, data):
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO esg_scores (symbol, fetched_at, data) VALUES (?, ?, ?)",
+                (symbol, time.time(), json.dumps(data))
+            )
+            self._db.commit()
+
+    def get(self, symbol, stale=False):
+        """Return the cached ESG data for ``symbol`` or None if it is missing or expired (unless ``stale``)."""
+        return self._cache.get(symbol.upper(), stale=stale)
+
+    def put(self, symbol, data):
+        """
+        Store ESG data in memory and on disk
+
+        Returns:
+            False if ``data`` is not an ESG score payload and was not stored
+        """
+        symbol = symbol.upper()
+        if not valid_esg(data):
+            if data:
+                logger.warning("Not storing ESG response for %s without scores: %.200s", symbol, data)
+            return False
+        self._cache.set(symbol, data)
+        self._persist(symbol, data)
+        return True
+
+    def get_or_fetch(self, symbol, fetch):
+        """
+        Return ESG data for ``symbol``, calling ``fetch`` only on a miss
+
+        Args:
+            symbol: Stock symbol
+            fetch: Callable taking the symbol and returning ESG data (empty dict on failure)
+
+        Returns:
+            Dictionary with ESG data or empty dict if not available
+        """
+        symbol = symbol.upper()
+
+        def load():
+            data = fetch(symbol)
+            if valid_esg(data):
+                self._persist(symbol, data)
+            elif data:
+                logger.warning("Not storing ESG response for %s without scores: %.200s", symbol, data)
+            return data
+
+        data = self._cache.get_or_load(symbol, load, cache_if=valid_esg)
+        return data if valid_esg(data) else {}
+
+    def prewarm(self, symbols, fetch, max_workers=4):
+        """
+        Fetch ESG data for every symbol that is not already fresh in the store
+
+        Args:
+            symbols: Iterable of stock symbols
+            fetch: Callable taking a symbol and returning ESG data
+            max_workers: Number of concurrent upstream requests
+
+        Returns:
+            Number of symbols that were fetched
+        """
+        missing = [s.upper() for s in symbols if self.get(s) is None]
+        if not missing:
+            return 0
+        logger.info("Prewarming ESG store with %s symbols", len(missing))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="esg-prewarm") as executor:
+            list(executor.map(lambda s: self.get_or_fetch(s, fetch), missing))
+        return len(missing)
+
+    def __contains__(self, symbol):
+        """True if the store holds a fresh score for ``symbol``."""
+        return symbol.upper() in self._cache
+
+    def subscribe(self, callback):
+        """Call ``callback(symbol, data)`` for every score in the store and every score stored from now on."""
+        self._cache.subscribe(callback)
+
+    def stats(self):
+        return self._cache.stats()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_esg_store():
+    """Return the process-wide ESGStore, opening it on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ESGStore()
+        return _store
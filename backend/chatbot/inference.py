@@ -0,0 +1,320 @@
+import contextvars
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from metrics import record_generation
+from model_manager import get_model_manager
+from prompt_cache import PrefixStateCache
+from prompts import STATIC_PREFIXES
+
+logger = logging.getLogger(__name__)
+
+# Scheduler configuration
+INFERENCE_QUEUE_SIZE = int(os.environ.get("INFERENCE_QUEUE_SIZE", "16"))
+INFERENCE_REPLICAS = int(os.environ.get("INFERENCE_REPLICAS", "1"))
+INFERENCE_ENGINE = os.environ.get("INFERENCE_ENGINE", "single")  # "single" or "batch"
+
+
+class QueueFullError(Exception):
+    """Raised when the inference queue cannot accept another job."""
+
+
+class ModelUnavailableError(Exception):
+    """Raised when the model could not be loaded."""
+
+
+_STREAM_END = object()
+
+
+class _Job:
+    def __init__(self, prompt, params, stream):
+        self.prompt = prompt
+        self.params = params
+        self.stream = stream
+        self.future = Future()
+        self.chunks = queue.Queue() if stream else None
+        self.cancelled = False
+        self.enqueued_at = time.monotonic()
+        self.wait_seconds = None
+        self.prompt_tokens = None
+        self.replica = None
+        self.context = contextvars.copy_context()  # Carries the request ID into the worker's log records
+
+
+class StreamHandle:
+    """
+    Iterator over the completion chunks of a streaming job.
+
+    ``prompt_tokens`` and ``wait_seconds`` are filled in once the job starts
+    running. Closing the iterator early cancels the generation.
+    """
+
+    def __init__(self, job):
+        self._job = job
+
+    @property
+    def prompt_tokens(self):
+        return self._job.prompt_tokens
+
+    @property
+    def wait_seconds(self):
+        return self._job.wait_seconds
+
+    def __iter__(self):
+        try:
+            while True:
+                chunk = self._job.chunks.get()
+                if chunk is _STREAM_END:
+                    break
+                yield chunk
+            # Surface errors raised by the worker
+            self._job.future.result()
+        finally:
+            self._job.cancelled = True
+
+
+def run_completion(model, prompt, params, prompt_tokens=None, on_chunk=None, cancelled=None):
+    """
+    Run one completion in streaming mode so prompt evaluation and generation can be timed apart
+
+    Args:
+        model: Llama instance
+        prompt: Prompt text
+        params: Generation parameters passed to the model
+        prompt_tokens: Prompt token count reported in the usage block
+        on_chunk: Optional callable receiving each completion chunk
+        cancelled: Optional callable returning True to stop generating
+
+    Returns:
+        Tuple of (completion dictionary, timings dictionary)
+    """
+    started = time.monotonic()
+    first_token_at = None
+    text = []
+    finish_reason = None
+    completion_tokens = 0
+    for chunk in model(prompt=prompt, stream=True, **params):
+        if cancelled is not None and cancelled():
+            logger.info("Streaming client went away, stopping generation")
+            finish_reason = "cancelled"
+            break
+        if first_token_at is None:
+            first_token_at = time.monotonic()
+        choice = chunk.get("choices", [{}])[0]
+        if choice.get("text"):
+            text.append(choice["text"])
+            completion_tokens += 1
+        finish_reason = choice.get("finish_reason") or finish_reason
+        if on_chunk is not None:
+            on_chunk(chunk)
+    finished = time.monotonic()
+    first_token_at = first_token_at or finished
+
+    output = {
+        "choices": [{"text": "".join(text), "finish_reason": finish_reason}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": (prompt_tokens or 0) + completion_tokens,
+        },
+    }
+    timings = {
+        "prompt_eval_seconds": first_token_at - started,
+        "generation_seconds": finished - first_token_at,
+        "completion_tokens": completion_tokens,
+    }
+    return output, timings
+
+
+class InferenceScheduler:
+    """
+    Serializes access to one model through a bounded job queue.
+
+    A single worker thread owns the model and runs jobs in arrival order.
+    When ``max_queue`` jobs are already waiting, new submissions are rejected
+    with QueueFullError instead of piling up behind the model.
+    """
+
+    def __init__(self, model_manager, max_queue=INFERENCE_QUEUE_SIZE):
+        self.model_manager = model_manager
+        self.max_queue = max_queue
+        self.prefix_cache = PrefixStateCache(STATIC_PREFIXES)
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._start_lock = threading.Lock()
+        self._worker = None
+        self._running_job = None
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def start(self):
+        """Start the worker thread if it is not already running."""
+        with self._start_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="inference-worker", daemon=True)
+                self._worker.start()
+
+    def warmup(self):
+        """
+        Load the model and start the worker. Returns True if the model is ready.
+
+        The one-token warmup generation is queued like any request, since the
+        worker may already be running jobs on the same llama.cpp context,
+        which is not thread-safe.
+        """
+        self.start()
+        if self.model_manager.get() is None:
+            return False
+        try:
+            started = time.time()
+            self.submit("Hello", max_tokens=1).result()
+            logger.info("Model warmup completed in %.2fs", time.time() - started)
+        except QueueFullError:
+            logger.info("Inference queue full, skipping the warmup generation")
+        except Exception as e:
+            logger.exception("Model warmup failed: %s", e)
+        return True
+
+    def load_status(self):
+        """Return the model load phase and progress, see ModelManager.load_status."""
+        return self.model_manager.load_status()
+
+    @property
+    def context_tokens(self):
+        """Context window available to one generation."""
+        return self.model_manager.n_ctx
+
+    def _enqueue(self, job):
+        self.start()
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self.rejected += 1
+            logger.warning("Inference queue full (%s jobs), rejecting request", self.max_queue)
+            raise QueueFullError("The model is busy, please retry shortly.")
+
+    def submit(self, prompt, **params):
+        """
+        Queue a completion job
+
+        Args:
+            prompt: Prompt text
+            **params: Generation parameters passed to the model
+
+        Returns:
+            Future resolving to the model output dictionary
+
+        Raises:
+            QueueFullError: If the queue is full
+        """
+        job = _Job(prompt, params, stream=False)
+        self._enqueue(job)
+        return job.future
+
+    def submit_stream(self, prompt, **params):
+        """
+        Queue a streaming completion job
+
+        Returns:
+            StreamHandle yielding completion chunks as the model produces them
+
+        Raises:
+            QueueFullError: If the queue is full
+        """
+        job = _Job(prompt, params, stream=True)
+        self._enqueue(job)
+        return StreamHandle(job)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            job.wait_seconds = time.monotonic() - job.enqueued_at
+            self.total_wait_seconds += job.wait_seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, job.wait_seconds)
+            self._running_job = job
+            try:
+                job.context.run(self._execute, job)
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.exception("Inference job failed: %s", e)
+                if not job.future.done():
+                    job.future.set_exception(e)
+            finally:
+                if job.stream:
+                    job.chunks.put(_STREAM_END)
+                self._running_job = None
+                self._queue.task_done()
+
+    def _execute(self, job):
+        if job.cancelled:
+            job.future.set_result(None)
+            return
+
+        model = self.model_manager.get()
+        if model is None:
+            raise ModelUnavailableError("The language model could not be loaded.")
+
+        prompt_tokens = model.tokenize(job.prompt.encode("utf-8"))
+        job.prompt_tokens = len(prompt_tokens)
+        self.prefix_cache.restore(model, prompt_tokens)
+        output, timings = run_completion(
+            model, job.prompt, job.params, job.prompt_tokens,
+            on_chunk=job.chunks.put if job.stream else None,
+            cancelled=lambda: job.cancelled
+        )
+        record_generation(job.prompt_tokens, timings)
+        job.future.set_result(None if job.stream else output)
+
+    def stats(self):
+        """Return queue depth and wait time statistics."""
+        started = self.completed + self.failed
+        return {
+            "mode": "single",
+            "queue_depth": self._queue.qsize(),
+            "max_queue": self.max_queue,
+            "busy": self._running_job is not None,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_wait_seconds": self.total_wait_seconds / started if started else None,
+            "max_wait_seconds": self.max_wait_seconds,
+            "model": self.model_manager.stats(),
+            "prefix_cache": self.prefix_cache.stats(),
+        }
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_inference_scheduler(model_path):
+    """
+    Return the process-wide scheduler for ``model_path``
+
+    With INFERENCE_REPLICAS above 1 this is a ReplicaPool running that many
+    model processes. With INFERENCE_ENGINE=batch it is a BatchEngine merging
+    concurrent requests into one decode loop. Otherwise it is an
+    InferenceScheduler around the shared model.
+    """
+    with _schedulers_lock:
+        scheduler = _schedulers.get(model_path)
+        if scheduler is None:
+            if INFERENCE_REPLICAS > 1:
+                from replica_pool import ReplicaPool
+                scheduler = ReplicaPool(model_path, replicas=INFERENCE_REPLICAS)
+            elif INFERENCE_ENGINE == "batch":
+                from batch_engine import BatchEngine
+                # The engine decodes in its own multi-sequence context, so the
+                # model's default context only needs to be small
+                scheduler = BatchEngine(get_model_manager(model_path, n_ctx=512))
+            else:
+                scheduler = InferenceScheduler(get_model_manager(model_path))
+            _schedulers[model_path] = scheduler
+        return scheduler
@@ -0,0 +1,149 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import uuid
+
+# Logging configuration
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOG_FILE = os.environ.get("LOG_FILE", "finance_api.log")  # empty disables the file handler
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")  # json or text
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "")  # per-module levels, e.g. "market_data=WARNING,inference=DEBUG"
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(request_id)s - %(message)s'
+REPLICA_TEXT_FORMAT = '%(asctime)s - %(levelname)s - replica %(replica)s - %(request_id)s - %(message)s'
+
+# Attributes every LogRecord has; anything else was passed through ``extra``
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+_request_id = contextvars.ContextVar("request_id", default="-")
+_listener = None
+_configure_lock = threading.Lock()
+
+
+def new_request_id(request_id=None):
+    """Bind a request ID (a fresh one unless given) to the current context and return it."""
+    request_id = request_id or uuid.uuid4().hex[:16]
+    _request_id.set(request_id)
+    return request_id
+
+
+def current_request_id():
+    return _request_id.get()
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp each record with the request ID of the context that logged it."""
+
+    def filter(self, record):
+        if not hasattr(record, "request_id"):
+            record.request_id = _request_id.get()
+        return True
+
+
+class ReplicaFilter(logging.Filter):
+    """Stamp each record with the index of the replica process that logged it."""
+
+    def __init__(self, replica):
+        super().__init__()
+        self.replica = replica
+
+    def filter(self, record):
+        record.replica = self.replica
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the time, level, logger, request ID, message and any extra fields."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Resolve everything that may change after the call returns: the request ID
+        # lives in a context variable and the arguments may be mutated later.
+        # Formatting into JSON or text is left to the listener thread.
+        record = copy.copy(record)
+        RequestIdFilter().filter(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def parse_levels(spec):
+    """Parse "module=LEVEL,module=LEVEL" into a dictionary."""
+    levels = {}
+    for item in spec.split(","):
+        name, _, level = item.strip().partition("=")
+        if name and level:
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging(level=LOG_LEVEL, log_file=LOG_FILE, fmt=LOG_FORMAT, levels=LOG_LEVELS, replica=None):
+    """
+    Route every log record through a queue to a background writer thread
+
+    Request threads only enqueue records; formatting and the file and
+    console writes happen on the listener thread. Safe to call more than
+    once, only the first call configures anything.
+
+    Args:
+        level: Root log level
+        log_file: File to append to, or an empty string for console only
+        fmt: "json" for one JSON object per line, "text" for the classic format
+        levels: Per-module levels as "module=LEVEL,..." or a dictionary
+        replica: Index of the replica process this is, added to every record
+    """
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            return
+
+        formatter = JsonFormatter() if fmt == "json" else \
+            logging.Formatter(TEXT_FORMAT if replica is None else REPLICA_TEXT_FORMAT)
+        handlers = [logging.StreamHandler()]
+        if log_file:
+            handlers.append(logging.FileHandler(log_file))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        log_queue = queue.SimpleQueue()
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        queue_handler = _QueueHandler(log_queue)
+        if replica is not None:
+            queue_handler.addFilter(ReplicaFilter(replica))
+        root.addHandler(queue_handler)
+        root.setLevel(level)
+        for name, module_level in (parse_levels(levels) if isinstance(levels, str) else levels).items():
+            logging.getLogger(name).setLevel(module_level)
+
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
@@ -0,0 +1,448 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import UPSTREAM_RESPONSES, UPSTREAM_RETRIES, UPSTREAM_SHED
+
+logger = logging.getLogger(__name__)
+
+# Client configuration
+MARKET_DATA_POOL_SIZE = int(os.environ.get("MARKET_DATA_POOL_SIZE", "16"))
+MARKET_DATA_TIMEOUT = float(os.environ.get("MARKET_DATA_TIMEOUT", "10"))  # seconds
+MARKET_DATA_MAX_RETRIES = int(os.environ.get("MARKET_DATA_MAX_RETRIES", "3"))
+MARKET_DATA_RETRY_DELAY = float(os.environ.get("MARKET_DATA_RETRY_DELAY", "2"))  # seconds
+
+# Rate governor configuration, per RapidAPI host
+MARKET_DATA_RATE = float(os.environ.get("MARKET_DATA_RATE", "5"))  # requests per second
+MARKET_DATA_BURST = int(os.environ.get("MARKET_DATA_BURST", "10"))
+MARKET_DATA_HOST_RATES = os.environ.get("MARKET_DATA_HOST_RATES", "")  # e.g. "yahoo-finance127.p.rapidapi.com=2"
+MARKET_DATA_MAX_WAIT = float(os.environ.get("MARKET_DATA_MAX_WAIT", "1"))  # longest wait for a request slot, seconds
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get("CIRCUIT_RESET_TIMEOUT", "30"))  # seconds
+
+
+class RetryPolicy:
+    """Linear backoff retry policy shared by every market data request."""
+
+    def __init__(self, max_retries=MARKET_DATA_MAX_RETRIES, retry_delay=MARKET_DATA_RETRY_DELAY):
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+    def backoff(self, attempt):
+        """Seconds to wait before retrying after the given zero-based attempt."""
+        return self.retry_delay * (attempt + 1)
+
+    def retry_after(self, response, attempt):
+        """Seconds to wait after a 429, honoring the Retry-After header when it is numeric."""
+        try:
+            return float(response.headers.get("Retry-After", self.backoff(attempt)))
+        except ValueError:
+            return self.backoff(attempt)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at ``rate`` tokens per second up to ``burst``.
+
+    ``reserve`` hands out a slot and says how long the caller must wait for
+    it, so the sync client can sleep and the async client can await. A 429
+    pauses the whole bucket, making every caller back off together.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill_locked(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, max_wait):
+        """
+        Reserve one request slot
+
+        Returns:
+            Seconds to wait before sending, or None if that would exceed ``max_wait``
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill_locked(now)
+            wait = max(0.0, self._paused_until - now)
+            if self._tokens < 1:
+                wait = max(wait, (1 - self._tokens) / self.rate)
+            if wait > max_wait:
+                return None
+            self._tokens -= 1
+            return wait
+
+    def pause(self, seconds):
+        """Stop handing out slots for ``seconds`` (after a 429)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    @property
+    def tokens(self):
+        with self._lock:
+            self._refill_locked(time.monotonic())
+            return self._tokens
+
+
+class CircuitBreaker:
+    """
+    Stops calling a host after ``failure_threshold`` consecutive 429s, 5xx
+    responses or connection errors.
+
+    While open every request fails immediately. After ``reset_timeout``
+    seconds a single probe request is let through: success closes the
+    circuit, failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probe_started = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a request may be sent now."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and now - self.opened_at < self.reset_timeout:
+                return False
+            # Half-open: one probe at a time, and a lost probe does not wedge the circuit
+            if self._probe_started is not None and now - self._probe_started < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_started = now
+            return True
+
+    def cancel_probe(self):
+        """Give back a probe allow() granted for a request that was not sent after all."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probe_started = None
+
+    @property
+    def rejecting(self):
+        """True while requests are being failed fast."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.OPEN:
+                return now - self.opened_at < self.reset_timeout
+            return self._probe_started is not None and now - self._probe_started < self.reset_timeout
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Circuit for %s closed", self.name)
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning("Circuit for %s opened after %s failures", self.name, self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probe_started = None
+
+
+class HostGovernor:
+    """Rate budget and circuit breaker shared by every request to one host."""
+
+    def __init__(self, host, rate, burst):
+        self.host = host
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(host)
+
+    def stats(self):
+        return {
+            "rate": self.bucket.rate,
+            "burst": self.bucket.burst,
+            "tokens": round(self.bucket.tokens, 2),
+            "circuit": self.breaker.state,
+            "failures": self.breaker.failures,
+        }
+
+
+class RateGovernor:
+    """Creates one HostGovernor per host, using MARKET_DATA_HOST_RATES overrides when present."""
+
+    def __init__(self, rate=MARKET_DATA_RATE, burst=MARKET_DATA_BURST, host_rates=MARKET_DATA_HOST_RATES):
+        self.rate = rate
+        self.burst = burst
+        self.host_rates = {}
+        for item in host_rates.split(","):
+            host, _, host_rate = item.strip().partition("=")
+            if host and host_rate:
+                self.host_rates[host.strip()] = float(host_rate)
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def for_host(self, host):
+        governor = self._hosts.get(host)
+        if governor is not None:
+            return governor
+        with self._lock:
+            governor = self._hosts.get(host)
+            if governor is None:
+                governor = HostGovernor(host, self.host_rates.get(host, self.rate), self.burst)
+                self._hosts[host] = governor
+            return governor
+
+    def admit(self, host, description, max_wait):
+        """
+        Decide whether a request to ``host`` may go out
+
+        Returns:
+            Seconds to wait before sending, or None if the request should fail fast
+        """
+        governor = self.for_host(host)
+        # The breaker goes first so requests it rejects do not use up the rate budget
+        if not governor.breaker.allow():
+            logger.warning("Circuit for %s is open, skipping %s", host, description)
+            UPSTREAM_SHED.inc(host=host, reason="circuit_open")
+            return None
+        wait = governor.bucket.reserve(max_wait)
+        if wait is None:
+            governor.breaker.cancel_probe()
+            logger.warning("Rate budget for %s exhausted, skipping %s", host, description)
+            UPSTREAM_SHED.inc(host=host, reason="rate_budget")
+            return None
+        return wait
+
+    def record(self, host, status=None, retry_after=None):
+        """Feed a response status (None for a connection error) back into the host's breaker and bucket."""
+        governor = self.for_host(host)
+        if status == 429:
+            governor.bucket.pause(retry_after or 0)
+            governor.breaker.record_failure()
+        elif status is None or status >= 500:
+            governor.breaker.record_failure()
+        else:
+            governor.breaker.record_success()
+
+    def available(self, host):
+        """Return False while the host's circuit is open."""
+        return not self.for_host(host).breaker.rejecting
+
+    def stats(self):
+        with self._lock:
+            hosts = dict(self._hosts)
+        return {host: governor.stats() for host, governor in hosts.items()}
+
+
+class MarketDataClient:
+    """
+    HTTP client for the RapidAPI market data endpoints.
+
+    Keeps one pooled keep-alive session per host so repeated calls reuse
+    TCP/TLS connections, and applies a single retry policy to every request.
+    Requests first pass the shared rate governor: when a host's budget is
+    spent or its circuit is open they fail fast with None, and callers fall
+    back to cached data instead of sleeping in the request thread.
+    """
+
+    def __init__(self, pool_size=MARKET_DATA_POOL_SIZE, timeout=MARKET_DATA_TIMEOUT, retry_policy=None,
+                 governor=None, max_wait=MARKET_DATA_MAX_WAIT):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.governor = governor or rate_governor
+        self.max_wait = max_wait
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session_for(self, url):
+        """Return the pooled session for the host of ``url``."""
+        host = urlsplit(url).netloc
+        session = self._sessions.get(host)
+        if session is not None:
+            return session
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers["Connection"] = "keep-alive"
+                self._sessions[host] = session
+            return session
+
+    def available(self, url):
+        """Return False while the circuit for the host of ``url`` is open."""
+        return self.governor.available(urlsplit(url).netloc)
+
+    def headroom(self, url):
+        """Return how many requests the host of ``url`` could take right now, 0 while its circuit is open."""
+        host = urlsplit(url).netloc
+        if not self.governor.available(host):
+            return 0
+        return int(self.governor.for_host(host).bucket.tokens)
+
+    def get_json(self, url, headers=None, params=None, description=None):
+        """
+        GET a JSON document, retrying rate limits and connection errors
+
+        Args:
+            url: Endpoint URL
+            headers: Request headers (RapidAPI host and key)
+            params: Optional query parameters
+            description: Label used in log messages (defaults to the URL)
+
+        Returns:
+            Parsed JSON body, or None if the request failed or was shed by the rate governor
+        """
+        description = description or url
+        host = urlsplit(url).netloc
+        session = self.session_for(url)
+        policy = self.retry_policy
+
+        for attempt in range(policy.max_retries):
+            wait = self.governor.admit(host, description, self.max_wait)
+            if wait is None:
+                return None
+            if wait:
+                time.sleep(wait)
+            try:
+                response = session.get(url, headers=headers, params=params, timeout=self.timeout)
+                UPSTREAM_RESPONSES.inc(host=host, status=response.status_code)
+
+                if response.status_code == 200:
+                    self.governor.record(host, 200)
+                    return response.json()
+                elif response.status_code == 429:  # Rate limit exceeded
+                    # Pauses the host's bucket, so the next attempt only goes out if the pause is short
+                    retry_after = policy.retry_after(response, attempt)
+                    logger.warning("Rate limit hit on %s, attempt %s, pausing %s for %s seconds",
+                                   description, attempt+1, host, retry_after)
+                    self.governor.record(host, 429, retry_after)
+                    UPSTREAM_RETRIES.inc(host=host, reason="rate_limit")
+                else:
+                    self.governor.record(host, response.status_code)
+                    logger.error("Error fetching %s: Status %s", description, response.status_code)
+                    logger.debug("Response: %s...", response.text[:500])
+                    return None
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.error("Request exception on %s, attempt %s: %s", description, attempt+1, e)
+                self.governor.record(host, None)
+                if attempt < policy.max_retries - 1:
+                    UPSTREAM_RETRIES.inc(host=host, reason="error")
+                    time.sleep(min(policy.backoff(attempt), self.max_wait))
+
+        logger.error("Max retries reached for %s", description)
+        return None
+
+    def stats(self):
+        """Return the rate budget and circuit state of every host."""
+        return self.governor.stats()
+
+    def close(self):
+        """Close every pooled session."""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+class AsyncMarketDataClient:
+    """
+    Non-blocking counterpart of MarketDataClient for the asyncio server.
+
+    Uses one pooled httpx.AsyncClient for every host and shares the retry
+    policy and rate governor, but waits with ``asyncio.sleep`` so a
+    throttled request only parks a coroutine.
+    """
+
+    def __init__(self, pool_size=MARKET_DATA_POOL_SIZE, timeout=MARKET_DATA_TIMEOUT, retry_policy=None,
+                 governor=None, max_wait=MARKET_DATA_MAX_WAIT):
+        import httpx
+
+        self.timeout = timeout
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.governor = governor or rate_governor
+        self.max_wait = max_wait
+        self._httpx = httpx
+        self._client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=pool_size * 4, max_keepalive_connections=pool_size),
+            headers={"Connection": "keep-alive"}
+        )
+
+    async def get_json(self, url, headers=None, params=None, description=None):
+        """
+        GET a JSON document, retrying rate limits and connection errors
+
+        Returns:
+            Parsed JSON body, or None if the request failed or was shed by the rate governor
+        """
+        description = description or url
+        host = urlsplit(url).netloc
+        policy = self.retry_policy
+
+        for attempt in range(policy.max_retries):
+            wait = self.governor.admit(host, description, self.max_wait)
+            if wait is None:
+                return None
+            if wait:
+                await asyncio.sleep(wait)
+            try:
+                response = await self._client.get(url, headers=headers, params=params)
+                UPSTREAM_RESPONSES.inc(host=host, status=response.status_code)
+
+                if response.status_code == 200:
+                    self.governor.record(host, 200)
+                    return response.json()
+                elif response.status_code == 429:  # Rate limit exceeded
+                    retry_after = policy.retry_after(response, attempt)
+                    logger.warning("Rate limit hit on %s, attempt %s, pausing %s for %s seconds",
+                                   description, attempt+1, host, retry_after)
+                    self.governor.record(host, 429, retry_after)
+                    UPSTREAM_RETRIES.inc(host=host, reason="rate_limit")
+                else:
+                    self.governor.record(host, response.status_code)
+                    logger.error("Error fetching %s: Status %s", description, response.status_code)
+                    return None
+            except (self._httpx.HTTPError, ValueError) as e:
+                logger.error("Request exception on %s, attempt %s: %s", description, attempt+1, e)
+                self.governor.record(host, None)
+                if attempt < policy.max_retries - 1:
+                    UPSTREAM_RETRIES.inc(host=host, reason="error")
+                    await asyncio.sleep(min(policy.backoff(attempt), self.max_wait))
+
+        logger.error("Max retries reached for %s", description)
+        return None
+
+    async def close(self):
+        await self._client.aclose()
+
+
+# Process-wide rate governor shared by the sync and async clients
+rate_governor = RateGovernor()
+
+# Process-wide client shared by app.py and esg.py
+market_data_client = MarketDataClient()
@@ -0,0 +1,220 @@
+import logging
+import os
+import threading
+import time
+
+from comparison import QUOTE_BATCH_SIZE
+from metrics import MARKET_REFRESHES
+
+logger = logging.getLogger(__name__)
+
+# Background refresh configuration
+MARKET_REFRESH_ENABLED = os.environ.get("MARKET_REFRESH_ENABLED", "0") == "1"
+MARKET_REFRESH_SYMBOLS = [s.strip().upper() for s in os.environ.get("MARKET_REFRESH_SYMBOLS", "").split(",") if s.strip()]
+MARKET_REFRESH_WATCHLIST_SIZE = int(os.environ.get("MARKET_REFRESH_WATCHLIST_SIZE", "50"))
+MARKET_REFRESH_HALF_LIFE = float(os.environ.get("MARKET_REFRESH_HALF_LIFE", "3600"))  # seconds for a query's weight to halve
+MARKET_REFRESH_MIN_SCORE = float(os.environ.get("MARKET_REFRESH_MIN_SCORE", "0.1"))  # decayed queries a symbol needs to stay listed
+MARKET_REFRESH_QUOTE_INTERVAL = float(os.environ.get("MARKET_REFRESH_QUOTE_INTERVAL", "5"))  # seconds
+MARKET_REFRESH_ESG_INTERVAL = float(os.environ.get("MARKET_REFRESH_ESG_INTERVAL", str(6 * 60 * 60)))  # seconds
+MARKET_REFRESH_ESG_PER_CYCLE = 5  # watchlist newcomers without a score fetched per quote cycle
+MARKET_REFRESH_RESERVE = int(os.environ.get("MARKET_REFRESH_RESERVE", "3"))  # request slots left to live traffic
+
+
+class Watchlist:
+    """
+    The symbols users ask about most, learned from traffic.
+
+    Every mention adds a weight that grows exponentially with time, which is
+    the same as decaying all older mentions with a half-life of
+    ``half_life`` seconds. A symbol whose decayed score falls below
+    ``min_score`` queries is dropped. Pinned symbols are always on the list.
+    """
+
+    def __init__(self, size=MARKET_REFRESH_WATCHLIST_SIZE, pinned=MARKET_REFRESH_SYMBOLS,
+                 half_life=MARKET_REFRESH_HALF_LIFE, min_score=MARKET_REFRESH_MIN_SCORE):
+        self.size = size
+        self.pinned = list(pinned)
+        self.half_life = half_life
+        self.min_score = min_score
+        self._scores = {}
+        self._origin = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, symbols):
+        """Count one query mentioning ``symbols``."""
+        if not symbols:
+            return
+        with self._lock:
+            weight = self._weight_locked()
+            if weight > 2 ** 32:
+                # Rescale before the weights overflow
+                self._scores = {symbol: score / weight for symbol, score in self._scores.items()}
+                self._origin = time.monotonic()
+                weight = 1.0
+            for symbol in symbols:
+                self._scores[symbol] = self._scores.get(symbol, 0.0) + weight
+            if len(self._scores) > 10 * self.size:
+                kept = sorted(self._scores.items(), key=lambda item: item[1], reverse=True)[:2 * self.size]
+                self._scores = dict(kept)
+
+    def _weight_locked(self):
+        return 2 ** ((time.monotonic() - self._origin) / self.half_life)
+
+    def symbols(self):
+        """Return the pinned symbols followed by the most asked-about ones, up to ``size`` in total."""
+        with self._lock:
+            threshold = self.min_score * self._weight_locked()
+            self._scores = {symbol: score for symbol, score in self._scores.items() if score >= threshold}
+            ranked = sorted(self._scores, key=self._scores.get, reverse=True)
+        symbols = list(self.pinned)
+        for symbol in ranked:
+            if len(symbols) >= self.size:
+                break
+            if symbol not in symbols:
+                symbols.append(symbol)
+        return symbols
+
+
+class MarketRefresher:
+    """
+    Keeps the quote cache and the ESG store warm for the watchlist.
+
+    A daemon thread fetches batched quotes for every watchlist symbol each
+    ``quote_interval`` seconds and stores them for two intervals, so request
+    handlers read a fresh quote without going upstream. ESG scores are
+    fetched for symbols new to the watchlist and re-fetched for the whole
+    list every ``esg_interval`` seconds. Upstream latency, retries and rate
+    limit waits all happen on the refresher thread, which only sends
+    requests while ``headroom`` says live traffic has slots to spare. The
+    thread exits once the watchlist is empty and is started again by the
+    next query that records a symbol.
+    """
+
+    def __init__(self, watchlist, fetch_quotes, quote_cache, fetch_esg, esg_store, headroom=None,
+                 quote_interval=MARKET_REFRESH_QUOTE_INTERVAL, esg_interval=MARKET_REFRESH_ESG_INTERVAL):
+        """
+        Args:
+            watchlist: Watchlist of symbols to refresh
+            fetch_quotes: Callable taking a symbol list and returning ``{symbol: quote response}``
+            quote_cache: TTLCache the quotes are stored in
+            fetch_esg: Callable taking a symbol and returning ESG data (empty dict on failure)
+            esg_store: Zero-argument callable returning the ESGStore
+            headroom: Optional callable taking "quote" or "esg" and returning False when upstream is too busy
+            quote_interval: Seconds between quote refreshes
+            esg_interval: Seconds between refreshes of every watchlist ESG score
+        """
+        self.watchlist = watchlist
+        self._fetch_quotes = fetch_quotes
+        self._quote_cache = quote_cache
+        self._fetch_esg = fetch_esg
+        self._esg_store = esg_store
+        self._headroom = headroom or (lambda kind: True)
+        self.quote_interval = quote_interval
+        self.esg_interval = esg_interval
+
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._next_esg_refresh = time.monotonic() + esg_interval
+        self.last_quote_refresh = None
+        self.last_esg_refresh = None
+
+    def start(self):
+        """Start the refresh thread if it is not already running."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="market-refresher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the refresh thread."""
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            symbols = self.watchlist.symbols()
+            if not symbols:
+                with self._start_lock:
+                    # A symbol recorded before this check keeps the thread, one recorded after it starts a new one
+                    if not self.watchlist.symbols():
+                        logger.info("Watchlist is empty, market refresher idle until the next query")
+                        self._thread = None
+                        return
+                continue
+            try:
+                self.refresh_quotes(symbols)
+                full = started >= self._next_esg_refresh
+                self.refresh_esg(symbols, full)
+                if full:
+                    self._next_esg_refresh = started + self.esg_interval
+            except Exception as e:
+                logger.exception("Market data refresh failed: %s", e)
+            self._stop.wait(max(0.0, self.quote_interval - (time.monotonic() - started)))
+
+    def refresh_quotes(self, symbols):
+        """
+        Fetch quotes for ``symbols`` in batches and store them in the quote cache
+
+        Returns:
+            Number of symbols refreshed
+        """
+        refreshed = 0
+        for start in range(0, len(symbols), QUOTE_BATCH_SIZE):
+            batch = symbols[start:start + QUOTE_BATCH_SIZE]
+            if not self._headroom("quote"):
+                logger.info("Upstream busy, skipping quote refresh of %s symbols", len(symbols) - start)
+                MARKET_REFRESHES.inc(len(symbols) - start, kind="quote", outcome="skipped")
+                break
+            quotes = self._fetch_quotes(batch)
+            for symbol, quote in quotes.items():
+                self._quote_cache.set(symbol, quote, ttl=2 * self.quote_interval)
+            refreshed += len(quotes)
+            MARKET_REFRESHES.inc(len(quotes), kind="quote", outcome="refreshed")
+            MARKET_REFRESHES.inc(len(batch) - len(quotes), kind="quote", outcome="failed")
+        if symbols:
+            self.last_quote_refresh = time.time()
+        return refreshed
+
+    def refresh_esg(self, symbols, full=False):
+        """
+        Fetch ESG scores into the ESG store
+
+        Args:
+            symbols: Watchlist symbols
+            full: Re-fetch every symbol; otherwise only up to MARKET_REFRESH_ESG_PER_CYCLE without a fresh score
+
+        Returns:
+            Number of symbols refreshed
+        """
+        store = self._esg_store()
+        targets = symbols if full else [s for s in symbols if s not in store][:MARKET_REFRESH_ESG_PER_CYCLE]
+        refreshed = 0
+        for index, symbol in enumerate(targets):
+            if self._stop.is_set():
+                break
+            if not self._headroom("esg"):
+                logger.info("Upstream busy, skipping ESG refresh of %s symbols", len(targets) - index)
+                MARKET_REFRESHES.inc(len(targets) - index, kind="esg", outcome="skipped")
+                break
+            stored = store.put(symbol, self._fetch_esg(symbol))
+            refreshed += stored
+            MARKET_REFRESHES.inc(kind="esg", outcome="refreshed" if stored else "failed")
+        if full:
+            self.last_esg_refresh = time.time()
+            logger.info("Refreshed ESG scores for %s of %s watchlist symbols", refreshed, len(targets))
+        return refreshed
+
+    def stats(self):
+        return {
+            "running": self._thread is not None and self._thread.is_alive(),
+            "watchlist": self.watchlist.symbols(),
+            "quote_interval": self.quote_interval,
+            "esg_interval": self.esg_interval,
+            "last_quote_refresh": self.last_quote_refresh,
+            "last_esg_refresh": self.last_esg_refresh,
+        }
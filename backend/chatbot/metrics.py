@@ -0,0 +1,182 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from sub-millisecond cache hits to long CPU generations
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+_registry = []
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, optionally split by labels."""
+
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts, sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = [[0] * len(self.buckets), 0.0, 0]
+                self._values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the ``with`` block."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def timed(self, func, **labels):
+        """Wrap ``func`` so every call is observed."""
+        def wrapper(*args, **kwargs):
+            with self.time(**labels):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        lines = []
+        for key, (counts, total, count) in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', bound))} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    Point-in-time value read from a callback when metrics are rendered.
+
+    The callback returns a number, or a dictionary mapping label value
+    tuples to numbers.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, callback, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def _samples(self):
+        try:
+            value = self.callback()
+        except Exception:
+            return []
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {v}"
+                for key, v in value.items() if v is not None]
+
+
+def render():
+    """Render every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in list(_registry):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Chat pipeline
+CHAT_REQUESTS = Counter("chat_requests_total", "Chat requests by endpoint and HTTP status", ["endpoint", "status"])
+CHAT_STAGE_SECONDS = Histogram("chat_stage_seconds", "Latency of each chat_response stage", ["stage"])
+TICKER_PAGES_FETCHED = Counter("ticker_pages_fetched_total", "Ticker listing pages fetched from the API")
+
+# Upstream market data
+UPSTREAM_RESPONSES = Counter("upstream_responses_total", "Upstream HTTP responses by host and status", ["host", "status"])
+UPSTREAM_RETRIES = Counter("upstream_retries_total", "Upstream request retries by host and reason", ["host", "reason"])
+UPSTREAM_SHED = Counter("upstream_shed_total", "Upstream requests failed fast by the rate governor", ["host", "reason"])
+MARKET_REFRESHES = Counter("market_refresh_total", "Symbols handled by the background market data refresher",
+                           ["kind", "outcome"])
+
+# Generation
+PROMPT_TOKENS = Counter("prompt_tokens_total", "Prompt tokens sent to the model")
+COMPLETION_TOKENS = Counter("completion_tokens_total", "Completion tokens generated by the model")
+TOKENS_PER_SECOND = Histogram("generation_tokens_per_second", "Generation speed per request",
+                              buckets=TOKENS_PER_SECOND_BUCKETS)
+
+
+def record_generation(prompt_tokens, timings):
+    """
+    Record the model-side stages of one completion
+
+    Args:
+        prompt_tokens: Number of prompt tokens, or None if unknown
+        timings: Dictionary with prompt_eval_seconds, generation_seconds and completion_tokens
+    """
+    CHAT_STAGE_SECONDS.observe(timings["prompt_eval_seconds"], stage="prompt_eval")
+    CHAT_STAGE_SECONDS.observe(timings["generation_seconds"], stage="generation")
+    if prompt_tokens:
+        PROMPT_TOKENS.inc(prompt_tokens)
+    COMPLETION_TOKENS.inc(timings["completion_tokens"])
+    if timings["generation_seconds"] > 0:
+        TOKENS_PER_SECOND.observe(timings["completion_tokens"] / timings["generation_seconds"])
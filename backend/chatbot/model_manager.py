@@ -0,0 +1,339 @@
+import glob
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Model configuration
+DEFAULT_N_CTX = 4096
+DEFAULT_N_THREADS = 4
+MODEL_GPU_LAYERS = os.environ.get("MODEL_GPU_LAYERS", "auto")  # "auto" offloads everything only when a GPU is present
+MODEL_USE_MMAP = os.environ.get("MODEL_USE_MMAP", "1") == "1"
+MODEL_USE_MLOCK = os.environ.get("MODEL_USE_MLOCK", "0") == "1"  # pin the weights in RAM so they are never paged out
+MODEL_PREFETCH = os.environ.get("MODEL_PREFETCH", "0") == "1"  # read the file into the page cache before mapping it
+
+PREFETCH_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Device nodes of the GPU backends llama.cpp can be built with on Linux (CUDA, ROCm, Vulkan)
+_GPU_DEVICE_PATTERNS = ("/dev/nvidia[0-9]*", "/dev/kfd", "/dev/dri/renderD*")
+
+
+def gpu_available():
+    """
+    Return True if llama.cpp can offload layers to a GPU on this machine
+
+    Checks that llama-cpp-python was built with a GPU backend and, on Linux,
+    that a GPU device node exists, so CPU-only nodes never attempt a GPU load.
+    """
+    try:
+        import llama_cpp
+    except ImportError:
+        return False
+    supports_offload = getattr(llama_cpp, "llama_supports_gpu_offload", None)
+    if supports_offload is None or not supports_offload():
+        return False
+    if os.environ.get("CUDA_VISIBLE_DEVICES") in ("", "-1"):
+        return False
+    if sys.platform.startswith("linux"):
+        return any(glob.glob(pattern) for pattern in _GPU_DEVICE_PATTERNS)
+    return True
+
+
+def resolve_gpu_layers(setting=MODEL_GPU_LAYERS):
+    """Turn a MODEL_GPU_LAYERS setting into an ``n_gpu_layers`` value."""
+    if str(setting).lower() != "auto":
+        return int(setting)
+    if gpu_available():
+        logger.info("GPU detected, offloading all layers")
+        return -1
+    logger.info("No GPU detected, loading the model on CPU")
+    return 0
+
+
+def prefetch_file(path, on_progress=None, chunk_size=PREFETCH_CHUNK_SIZE):
+    """
+    Read a file sequentially so its pages are in the page cache before it is memory-mapped
+
+    A single sequential read is much faster than the random page faults
+    llama.cpp would otherwise take while loading and on the first tokens.
+
+    Args:
+        path: File to read
+        on_progress: Optional callable receiving the fraction read so far
+        chunk_size: Bytes per read
+    """
+    size = os.path.getsize(path)
+    done = 0
+    buffer = bytearray(chunk_size)
+    with open(path, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while True:
+            read = f.readinto(buffer)
+            if not read:
+                break
+            done += read
+            if on_progress:
+                on_progress(done / size if size else 1.0)
+
+
+def initialize_llama(model_path, n_ctx=DEFAULT_N_CTX, n_threads=DEFAULT_N_THREADS, n_gpu_layers=None, **llama_kwargs):
+    """
+    Initialize the Llama model on the hardware detected up front
+
+    Args:
+        model_path: Path to GGUF model file
+        n_ctx: Context window size
+        n_threads: Number of CPU threads used for generation
+        n_gpu_layers: Layers to offload, defaults to MODEL_GPU_LAYERS
+        **llama_kwargs: Extra keyword arguments passed to Llama
+
+    Returns:
+        Llama model instance or None if initialization failed
+    """
+    from llama_cpp import Llama
+
+    if not os.path.exists(model_path):
+        logger.error("Model file not found at %s", model_path)
+        return None
+
+    if n_gpu_layers is None:
+        n_gpu_layers = resolve_gpu_layers()
+    llama_kwargs.setdefault("use_mmap", MODEL_USE_MMAP)
+    llama_kwargs.setdefault("use_mlock", MODEL_USE_MLOCK)
+
+    device = "GPU" if n_gpu_layers else "CPU"
+    logger.info("Initializing Llama model on %s (mmap: %s, mlock: %s)", device,
+                llama_kwargs["use_mmap"], llama_kwargs["use_mlock"])
+    try:
+        model = Llama(
+            model_path=model_path,
+            n_ctx=n_ctx,
+            n_threads=n_threads,
+            n_gpu_layers=n_gpu_layers,
+            **llama_kwargs
+        )
+        logger.info("Llama model initialized successfully on %s", device)
+        return model
+    except Exception as e:
+        if not n_gpu_layers:
+            logger.exception("Error initializing Llama model on CPU: %s", e)
+            return None
+        # A GPU was detected but could not take the model, e.g. not enough memory
+        logger.warning("Error initializing Llama model on GPU (%s), falling back to CPU", e)
+        return initialize_llama(model_path, n_ctx=n_ctx, n_threads=n_threads, n_gpu_layers=0, **llama_kwargs)
+
+
+def resident_memory_mb():
+    """Return the resident set size of this process in MB, or None if unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        # ru_maxrss is the peak, in KB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except Exception:
+        return None
+
+
+class ModelManager:
+    """
+    Owns one long-lived Llama instance for the process.
+
+    The model is loaded on first use (or by an explicit ``warmup``) and reused
+    for every request until ``reload`` is called. ``load_status`` reports the
+    load phase and progress while it happens, so a server can answer health
+    checks before the model is ready.
+    """
+
+    def __init__(self, model_path, n_ctx=DEFAULT_N_CTX, n_threads=DEFAULT_N_THREADS, prefetch=MODEL_PREFETCH):
+        self.model_path = model_path
+        self.n_ctx = n_ctx
+        self.n_threads = n_threads
+        self.prefetch = prefetch
+        self._model = None
+        self._lock = threading.Lock()
+        self.load_seconds = None
+        self.loaded_at = None
+        self.resident_mb = None
+        self.phase = "idle"  # idle, prefetching, loading, ready or failed
+        self.progress = 0.0
+        self.load_started_at = None
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    def get(self):
+        """
+        Return the shared model, loading it if needed
+
+        Returns:
+            Llama model instance or None if loading failed
+        """
+        model = self._model
+        if model is not None:
+            return model
+        with self._lock:
+            if self._model is None:
+                self._load()
+            return self._model
+
+    def _set_progress(self, progress):
+        self.progress = progress
+
+    def _load(self):
+        rss_before = resident_memory_mb()
+        started = time.time()
+        self.load_started_at = started
+        # Progress is approximate: prefetching covers the first half, the llama.cpp load the rest
+        if self.prefetch and os.path.exists(self.model_path):
+            self.phase = "prefetching"
+            prefetch_file(self.model_path, on_progress=lambda fraction: self._set_progress(fraction / 2))
+            logger.info("Prefetched %s in %.2fs", self.model_path, time.time() - started)
+        self.phase = "loading"
+        model = initialize_llama(self.model_path, n_ctx=self.n_ctx, n_threads=self.n_threads)
+        if model is None:
+            self.phase = "failed"
+            return
+        self.load_seconds = time.time() - started
+        self.loaded_at = time.time()
+        rss_after = resident_memory_mb()
+        if rss_before is not None and rss_after is not None:
+            self.resident_mb = rss_after - rss_before
+        self._model = model
+        self.phase = "ready"
+        self.progress = 1.0
+        logger.info("Model %s loaded in %.2fs (resident delta: %s MB)", self.model_path, self.load_seconds,
+                    self.resident_mb if self.resident_mb is not None else 'N/A')
+
+    def load_status(self):
+        """Return whether the model is ready, the current load phase and its approximate progress."""
+        elapsed = self.load_seconds if self.loaded else None
+        if elapsed is None and self.load_started_at is not None:
+            elapsed = time.time() - self.load_started_at
+        return {
+            "ready": self.loaded,
+            "phase": self.phase,
+            "progress": round(self.progress, 3),
+            "elapsed_seconds": elapsed,
+        }
+
+    def warmup(self):
+        """
+        Load the model and run a one-token generation so the weights are paged in
+
+        The generation runs on the calling thread, so only a caller that owns
+        the model may use it; InferenceScheduler.warmup queues its own instead.
+
+        Returns:
+            Boolean indicating if the model is ready
+        """
+        model = self.get()
+        if model is None:
+            return False
+        try:
+            started = time.time()
+            model(prompt="Hello", max_tokens=1)
+            logger.info("Model warmup completed in %.2fs", time.time() - started)
+        except Exception as e:
+            logger.exception("Model warmup failed: %s", e)
+        return True
+
+    def reload(self, model_path=None):
+        """
+        Drop the current model and load it again, optionally from a new path
+
+        Returns:
+            Boolean indicating if the reload succeeded
+        """
+        with self._lock:
+            if model_path:
+                self.model_path = model_path
+            self._model = None
+            self.progress = 0.0
+            self._load()
+            return self._model is not None
+
+    def stats(self):
+        """Return load time and memory information about the managed model."""
+        file_size_mb = None
+        if os.path.exists(self.model_path):
+            file_size_mb = os.path.getsize(self.model_path) / (1024 * 1024)
+        return {
+            "model_path": self.model_path,
+            "loaded": self.loaded,
+            "load_seconds": self.load_seconds,
+            "loaded_at": self.loaded_at,
+            "file_size_mb": file_size_mb,
+            "resident_mb": self.resident_mb,
+            "process_resident_mb": resident_memory_mb(),
+        }
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+_tokenizers = {}
+_tokenizers_lock = threading.Lock()
+
+
+def get_model_manager(model_path, **kwargs):
+    """
+    Return the process-wide ModelManager for ``model_path``
+
+    Args:
+        model_path: Path to GGUF model file
+        **kwargs: Passed to ModelManager when it is first created
+
+    Returns:
+        ModelManager instance shared by every caller in the process
+
+    Raises:
+        ValueError: If the manager already exists with different settings than ``kwargs``
+    """
+    with _managers_lock:
+        manager = _managers.get(model_path)
+        if manager is None:
+            manager = ModelManager(model_path, **kwargs)
+            _managers[model_path] = manager
+            return manager
+        conflicts = {name: value for name, value in kwargs.items() if getattr(manager, name) != value}
+        if conflicts:
+            current = ", ".join(f"{name}={getattr(manager, name)!r}" for name in conflicts)
+            requested = ", ".join(f"{name}={value!r}" for name, value in conflicts.items())
+            raise ValueError(f"The model manager for {model_path} already runs with {current}, cannot use {requested}")
+        return manager
+
+
+def get_tokenizer(model_path):
+    """
+    Return a vocabulary-only Llama for ``model_path``, shared by the process
+
+    It loads in a fraction of the time and memory of the full model and lets
+    request threads count prompt tokens without touching the model owned by
+    the inference worker (or living in a replica process).
+
+    Returns:
+        Llama instance that can only tokenize, or None if the model file is
+        missing or the vocabulary could not be loaded
+    """
+    with _tokenizers_lock:
+        if model_path in _tokenizers:
+            return _tokenizers[model_path]
+        if not os.path.exists(model_path):
+            return None
+        try:
+            from llama_cpp import Llama
+            tokenizer = Llama(model_path=model_path, vocab_only=True, verbose=False)
+        except Exception as e:
+            logger.warning("Could not load the tokenizer of %s, estimating token counts: %s", model_path, e)
+            tokenizer = None
+        _tokenizers[model_path] = tokenizer
+        return tokenizer
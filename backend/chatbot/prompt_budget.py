@@ -0,0 +1,160 @@
+import logging
+import os
+import threading
+
+from model_manager import get_tokenizer
+from prompts import INVESTMENT_INSTRUCTIONS, GENERAL_INSTRUCTIONS, TRIM_ORDER, build_enriched_prompt, \
+    is_investment_query, static_prefix
+
+logger = logging.getLogger(__name__)
+
+# Completion budget per query class, overridable as "factual=200,investment=600"
+MAX_TOKENS_BY_CLASS = {"factual": 256, "general": 512, "comparison": 640, "investment": 800}
+MAX_TOKENS_BY_CLASS.update(
+    (name.strip(), int(value)) for name, _, value in
+    (item.partition("=") for item in os.environ.get("PROMPT_MAX_TOKENS", "").split(",")) if value
+)
+MIN_COMPLETION_TOKENS = int(os.environ.get("MIN_COMPLETION_TOKENS", "128"))
+PROMPT_SAFETY_TOKENS = 16  # slack for tokenizing the prompt in pieces
+
+# Short questions about one of these are answered in a few sentences
+FACTUAL_TERMS = [
+    "price", "trading at", "quote", "market cap", "volume", "esg score", "how much", "what is", "52", "sector"
+]
+FACTUAL_MAX_WORDS = 12
+
+
+def classify_query(user_message, symbols):
+    """Return "comparison", "investment", "factual" or "general" for a query about ``symbols``."""
+    if len(symbols) > 1:
+        return "comparison"
+    if is_investment_query(user_message):
+        return "investment"
+    message = user_message.lower()
+    if len(message.split()) <= FACTUAL_MAX_WORDS and any(term in message for term in FACTUAL_TERMS):
+        return "factual"
+    return "general"
+
+
+class TokenCounter:
+    """
+    Counts prompt tokens with the model's tokenizer.
+
+    Counts of the static instruction prefixes are computed once. Without a
+    tokenizer, counts are estimated at three characters per token, which
+    overestimates for English text.
+    """
+
+    def __init__(self, tokenize=None):
+        """
+        Args:
+            tokenize: The model's ``Llama.tokenize`` or None to estimate
+        """
+        self._tokenize = tokenize
+        self._static = {}
+
+    @property
+    def exact(self):
+        return self._tokenize is not None
+
+    def count(self, text):
+        if self._tokenize is None:
+            return len(text) // 3 + 1
+        return len(self._tokenize(text.encode("utf-8"), add_bos=False))
+
+    def count_static(self, text):
+        count = self._static.get(text)
+        if count is None:
+            count = self._static[text] = self.count(text)
+        return count
+
+
+class PromptPlan:
+    """A prompt that fits the context window, with its completion budget."""
+
+    def __init__(self, text, prompt_tokens, max_tokens, query_class, trimmed):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.max_tokens = max_tokens
+        self.query_class = query_class
+        self.trimmed = trimmed  # market fields left out to fit
+
+    def generation_params(self, params):
+        """Return ``params`` with this prompt's completion budget."""
+        return dict(params, max_tokens=self.max_tokens)
+
+    def stats(self):
+        return {
+            "query_class": self.query_class,
+            "prompt_tokens": self.prompt_tokens,
+            "max_tokens": self.max_tokens,
+            "trimmed": self.trimmed,
+        }
+
+
+def plan_prompt(user_message, render_summary, query_class, counter, context_tokens):
+    """
+    Build the most detailed prompt that leaves room for the query class's completion budget
+
+    Args:
+        user_message: The user's query
+        render_summary: Callable taking a trim level and returning the market data text,
+            or None when the data cannot be trimmed further. Level ``n`` drops
+            ``TRIM_ORDER[:n]``, levels past that may drop comparison rows.
+        query_class: Result of classify_query
+        counter: TokenCounter for the model
+        context_tokens: Context window of one generation
+
+    Returns:
+        PromptPlan
+    """
+    investment_query = is_investment_query(user_message)
+    prefix = static_prefix(INVESTMENT_INSTRUCTIONS if investment_query else GENERAL_INSTRUCTIONS)
+    max_tokens = MAX_TOKENS_BY_CLASS.get(query_class, MAX_TOKENS_BY_CLASS["general"])
+
+    level = 0
+    summary = render_summary(level)
+    while True:
+        prompt = build_enriched_prompt(user_message, summary, investment_query)
+        # One extra token for BOS
+        prompt_tokens = counter.count_static(prefix) + counter.count(prompt[len(prefix):]) + 1
+        if prompt_tokens + max_tokens + PROMPT_SAFETY_TOKENS <= context_tokens:
+            break
+        trimmed_summary = render_summary(level + 1)
+        if trimmed_summary is None:
+            # Nothing left to trim, give the completion whatever room remains but never more
+            max_tokens = max(1, context_tokens - prompt_tokens - PROMPT_SAFETY_TOKENS)
+            if max_tokens < MIN_COMPLETION_TOKENS:
+                logger.warning("Prompt of %s tokens leaves only %s completion tokens in a %s-token context",
+                               prompt_tokens, max_tokens, context_tokens)
+            break
+        level += 1
+        summary = trimmed_summary
+
+    trimmed = TRIM_ORDER[:level] + (["rows"] if level > len(TRIM_ORDER) else [])
+    if level:
+        logger.info("Trimmed %s from the prompt to fit %s tokens", trimmed, context_tokens)
+    logger.info("Prompt has %s%s tokens, %s-class completion budget %s",
+                "" if counter.exact else "~", prompt_tokens, query_class, max_tokens)
+    return PromptPlan(prompt, prompt_tokens, max_tokens, query_class, trimmed)
+
+
+_counters = {}
+_counters_lock = threading.Lock()
+
+
+def get_token_counter(model_path):
+    """
+    Return the process-wide TokenCounter for ``model_path``
+
+    Until the model's tokenizer can be loaded an estimating counter is
+    returned, and loading is tried again on the next call.
+    """
+    with _counters_lock:
+        counter = _counters.get(model_path)
+        if counter is None:
+            tokenizer = get_tokenizer(model_path)
+            if tokenizer is None:
+                return TokenCounter()
+            counter = _counters[model_path] = TokenCounter(tokenizer.tokenize)
+        return counter
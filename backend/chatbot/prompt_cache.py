@@ -0,0 +1,82 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def common_prefix_length(a, b):
+    """Return the number of leading tokens shared by two token sequences."""
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+
+class PrefixStateCache:
+    """
+    Precomputed KV state for fixed prompt preambles.
+
+    ``warm`` evaluates each prefix once and saves the model state. Before a
+    completion, ``restore`` loads the state whose tokens match the start of
+    the prompt, and llama-cpp then skips re-evaluating those tokens because
+    they already sit in the context.
+
+    A cache belongs to one model instance and must only be used from the
+    thread that runs that model.
+    """
+
+    def __init__(self, prefixes):
+        self.prefixes = list(prefixes)
+        self._states = []  # (prefix tokens, saved state)
+        self.warmed = False
+        self.hits = 0
+        self.misses = 0
+
+    def warm(self, model):
+        """Evaluate every prefix on ``model`` and keep its state."""
+        self._states = []
+        for prefix in self.prefixes:
+            started = time.time()
+            tokens = model.tokenize(prefix.encode("utf-8"))
+            model.reset()
+            model.eval(tokens)
+            self._states.append((tokens, model.save_state()))
+            logger.info("Cached KV state for a %s-token prompt prefix in %.2fs", len(tokens), time.time() - started)
+        model.reset()
+        self.warmed = True
+
+    def restore(self, model, prompt_tokens):
+        """
+        Load the saved state matching the start of the prompt into ``model``
+
+        Args:
+            model: Llama instance the cache was warmed on
+            prompt_tokens: Tokenized prompt about to be evaluated
+
+        Returns:
+            Number of prompt tokens that will not need evaluating
+        """
+        if not self.warmed:
+            self.warm(model)
+
+        best_length, best_state = 0, None
+        for tokens, state in self._states:
+            length = common_prefix_length(tokens, prompt_tokens)
+            if length > best_length:
+                best_length, best_state = length, state
+
+        if best_state is None:
+            self.misses += 1
+            return 0
+        self.hits += 1
+
+        # The context may already hold this prefix from the previous request
+        current = model.input_ids[:model.n_tokens]
+        if common_prefix_length(current, prompt_tokens) < best_length:
+            model.load_state(best_state)
+        return best_length
+
+    def stats(self):
+        return {"prefixes": len(self._states), "hits": self.hits, "misses": self.misses}
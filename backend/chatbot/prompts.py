@@ -0,0 +1,193 @@
+import logging
+import time
+
+from comparison import comparison_table
+
+logger = logging.getLogger(__name__)
+
+# Fixed instruction preambles. Every prompt starts with one of these verbatim so
+# the model's KV state for them can be computed once and reused.
+INVESTMENT_INSTRUCTIONS = (
+    "The user is asking about investment advice. Analyze the current market data provided below, "
+    "and give a balanced assessment that considers both financial performance and ESG factors. "
+    "Include pros and cons, potential risks, and suggest sustainable alternatives if appropriate. "
+    "Focus on educational information rather than direct financial advice."
+)
+
+GENERAL_INSTRUCTIONS = (
+    "Answer the following financial query by providing a detailed analysis based on the real-time "
+    "market data below. Include relevant ESG (Environmental, Social, Governance) considerations "
+    "and focus on clear, actionable information."
+)
+
+INVESTMENT_TERMS = [
+    "invest", "buy", "sell", "worth", "stock", "good investment",
+    "should i", "portfolio", "holding", "position"
+]
+
+
+def is_investment_query(user_message):
+    """Check if the query is asking about investing."""
+    message = user_message.lower()
+    return any(term in message for term in INVESTMENT_TERMS)
+
+
+def static_prefix(instructions):
+    """Return the part of the prompt that never changes for the given instructions."""
+    return f"{instructions}\n\n"
+
+
+# Market fields in the order they are dropped when a prompt does not fit,
+# least useful first; the price, change and total ESG score are always kept
+TRIM_ORDER = ["industry", "open", "high", "low", "volume", "52w", "sector", "market_cap", "esg_detail"]
+
+
+STATIC_PREFIXES = [static_prefix(INVESTMENT_INSTRUCTIONS), static_prefix(GENERAL_INSTRUCTIONS)]
+
+
+def build_enriched_prompt(user_message, ticker_summary, investment_query=None):
+    """
+    Build the model prompt: static instructions first, then the query and market data
+
+    Args:
+        user_message: The user's query
+        ticker_summary: Market and ESG data text for the prompt
+        investment_query: Whether to use the investment instructions (detected from the message if None)
+
+    Returns:
+        Prompt string
+    """
+    if investment_query is None:
+        investment_query = is_investment_query(user_message)
+    instructions = INVESTMENT_INSTRUCTIONS if investment_query else GENERAL_INSTRUCTIONS
+
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+    return (
+        f"{static_prefix(instructions)}"
+        f"User Query: {user_message}\n\n"
+        f"Current Market Data (as of {timestamp}):\n{ticker_summary}\n\n"
+        "Answer:"
+    )
+
+
+def extract_ticker_data(ticker_data, realtime_data):
+    """Extract and combine ticker data from both APIs."""
+    result = {}
+
+    if ticker_data:
+        result["symbol"] = ticker_data.get("symbol", "N/A")
+        result["price"] = ticker_data.get("lastsale", "N/A")
+        result["change_pct"] = ticker_data.get("pctchange", "N/A")
+        result["name"] = ticker_data.get("name", "N/A")
+
+    if realtime_data:
+        quote_data = None
+        if isinstance(realtime_data, dict):
+            if "data" in realtime_data and isinstance(realtime_data["data"], dict):
+                quote_data = realtime_data["data"]
+            elif "body" in realtime_data and isinstance(realtime_data["body"], dict):
+                quote_data = realtime_data["body"]
+
+        if quote_data:
+            if "symbol" in quote_data:
+                result["symbol"] = quote_data.get("symbol", result.get("symbol", "N/A"))
+            if "regularMarketPrice" in quote_data:
+                result["price"] = quote_data.get("regularMarketPrice", result.get("price", "N/A"))
+            if "regularMarketChangePercent" in quote_data:
+                change_pct = quote_data.get("regularMarketChangePercent")
+                result["change_pct"] = f"{change_pct:.2f}%" if isinstance(change_pct, (int, float)) else str(change_pct)
+            result["open"] = quote_data.get("regularMarketOpen", "N/A")
+            result["high"] = quote_data.get("regularMarketDayHigh", "N/A")
+            result["low"] = quote_data.get("regularMarketDayLow", "N/A")
+            result["volume"] = quote_data.get("regularMarketVolume", "N/A")
+            result["market_cap"] = quote_data.get("marketCap", "N/A")
+            result["52w_high"] = quote_data.get("fiftyTwoWeekHigh", "N/A")
+            result["52w_low"] = quote_data.get("fiftyTwoWeekLow", "N/A")
+            if "longName" in quote_data:
+                result["name"] = quote_data.get("longName", result.get("name", "N/A"))
+            result["sector"] = quote_data.get("sector", "N/A")
+            result["industry"] = quote_data.get("industry", "N/A")
+
+    return result
+
+
+
+# Optional details of describe_symbol in output order, with the TRIM_ORDER key that drops them
+SYMBOL_DETAIL_FIELDS = [
+    ("open", "open", "Open: ${}"),
+    ("high", "high", "High: ${}"),
+    ("low", "low", "Low: ${}"),
+    ("volume", "volume", "Volume: {}"),
+    ("market_cap", "market_cap", "Market Cap: ${}"),
+    ("52w_high", "52w", "52w High: ${}"),
+    ("52w_low", "52w", "52w Low: ${}"),
+    ("sector", "sector", "Sector: {}"),
+    ("industry", "industry", "Industry: {}"),
+]
+
+
+def describe_symbol(combined_data, esg_data, omit=()):
+    """Format combined ticker data and ESG scores as one line of prompt context, leaving out the ``omit`` fields."""
+    symbol = combined_data.get("symbol", "N/A")
+    if esg_data and "totalEsg" in esg_data:
+        esg_score = esg_data["totalEsg"].get("fmt", "N/A")
+        env_score = esg_data.get("environmentScore", {}).get("fmt", "N/A")
+        social_score = esg_data.get("socialScore", {}).get("fmt", "N/A")
+        gov_score = esg_data.get("governanceScore", {}).get("fmt", "N/A")
+        esg_text = f"ESG Score: {esg_score}, Environmental: {env_score}, Social: {social_score}, Governance: {gov_score}"
+        if "esg_detail" in omit:
+            esg_text = f"ESG Score: {esg_score}"
+    else:
+        esg_text = "No ESG data available"
+
+    price = combined_data.get("price", "N/A")
+    change_pct = combined_data.get("change_pct", "N/A")
+    name = combined_data.get("name", symbol)
+    detail_text = f"{symbol} ({name}): Price ${price} ({change_pct})"
+
+    for field, trim_key, label in SYMBOL_DETAIL_FIELDS:
+        if trim_key not in omit and combined_data.get(field, "N/A") != "N/A":
+            detail_text += "; " + label.format(combined_data[field])
+
+    return detail_text + f"; {esg_text}"
+
+
+def empty_summary(target_symbol):
+    """Prompt context used when no ticker data could be retrieved."""
+    logger.warning("No ticker data could be retrieved")
+    if target_symbol:
+        return f"No information available for {target_symbol}."
+    return "No specific ticker symbol detected in your query. Please include a stock symbol (e.g., AAPL for Apple) if you want stock information."
+
+
+
+def summarize_market_data(market_data, level=0):
+    """
+    Format gathered market data as prompt context, trimmed to ``level``.
+
+    Level ``n`` leaves out the fields ``TRIM_ORDER[:n]``; comparisons have
+    further levels that each halve the rows. Returns None past the last level.
+    """
+    omit = TRIM_ORDER[:level]
+    if len(market_data) > 1:
+        rows = [row for row in market_data.values() if row]
+        missing = [symbol for symbol, row in market_data.items() if row is None]
+        kept = len(rows) >> max(0, level - len(TRIM_ORDER))
+        if not kept and rows:
+            return None
+        table = comparison_table(rows[:kept], missing, omit)
+        if kept < len(rows):
+            table += f"Also asked about: {', '.join(combined['symbol'] for combined, _ in rows[kept:])}\n"
+        return table
+    if level and (not market_data or level > len(TRIM_ORDER)):
+        return None
+    for symbol, row in market_data.items():
+        if row is None:
+            return f"No detailed data available for {symbol}. " if not level else None
+        return describe_symbol(*row, omit=omit) + " "
+    return empty_summary(None)
+
+
+def screened_summary(heading, summary):
+    """Put a screen's heading above its summary, keeping None (nothing left to trim) as is."""
+    return heading + summary if summary is not None else None
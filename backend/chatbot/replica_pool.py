@@ -0,0 +1,326 @@
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from inference import (INFERENCE_QUEUE_SIZE, ModelUnavailableError, QueueFullError, StreamHandle, _Job, _STREAM_END,
+                       run_completion)
+from logging_config import configure_logging
+from metrics import record_generation
+from model_manager import DEFAULT_N_CTX, initialize_llama
+from prompt_cache import PrefixStateCache
+from prompts import STATIC_PREFIXES
+
+logger = logging.getLogger(__name__)
+
+# Replica configuration
+REPLICA_THREADS = int(os.environ.get("REPLICA_THREADS", "0"))  # 0 splits the available cores evenly
+REPLICA_PIN_CORES = os.environ.get("REPLICA_PIN_CORES", "1") == "1"
+REPLICA_MAX_RESTARTS = int(os.environ.get("REPLICA_MAX_RESTARTS", "3"))  # respawns of a replica that exited
+REPLICA_POLL_INTERVAL = 1.0  # seconds between liveness checks of an idle replica
+
+
+def available_cores():
+    """Return the CPU cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _replica_main(index, model_path, n_threads, cores, jobs, results, cancel):
+    """Entry point of a replica process: load the model, then serve jobs until a None job arrives."""
+    # Same format, levels and file as the parent, with the replica index on every record
+    configure_logging(replica=index)
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+    started = time.time()
+    # Weights are memory-mapped, so every replica shares the same page cache copy of the file
+    model = initialize_llama(model_path, n_ctx=DEFAULT_N_CTX, n_threads=n_threads, use_mmap=True)
+    if model is None:
+        results.put((None, "failed", index))
+        return
+    prefix_cache = PrefixStateCache(STATIC_PREFIXES)
+    prefix_cache.warm(model)
+    results.put((None, "ready", {"index": index, "load_seconds": time.time() - started}))
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        job_id, prompt, params, stream = job
+        try:
+            prompt_tokens = model.tokenize(prompt.encode("utf-8"))
+            results.put((job_id, "started", len(prompt_tokens)))
+            prefix_cache.restore(model, prompt_tokens)
+            output, timings = run_completion(
+                model, prompt, params, len(prompt_tokens),
+                on_chunk=(lambda chunk: results.put((job_id, "chunk", chunk))) if stream else None,
+                cancelled=lambda: cancel.value == job_id
+            )
+            results.put((job_id, "result", (None if stream else output, timings)))
+        except Exception as e:
+            logger.exception("Replica %s job failed: %s", index, e)
+            results.put((job_id, "error", str(e)))
+
+
+class _Replica:
+    def __init__(self, index, process, jobs, results, cancel, cores, n_threads, restarts=0):
+        self.index = index
+        self.restarts = restarts
+        self.process = process
+        self.jobs = jobs
+        self.results = results
+        self.cancel = cancel
+        self.cores = cores
+        self.n_threads = n_threads
+        self.in_flight = 0
+        self.completed = 0
+        self.ready = threading.Event()
+        self.failed = False
+        self.load_seconds = None
+
+
+class ReplicaPool:
+    """
+    Runs N model replicas in separate processes and routes each job to the
+    least-loaded one.
+
+    Each replica gets its own thread count and, when REPLICA_PIN_CORES is set,
+    its own slice of the CPU cores. A replica process that exits has its
+    pending jobs failed and is respawned, up to REPLICA_MAX_RESTARTS times.
+    Exposes the same submit/submit_stream interface as InferenceScheduler.
+    """
+
+    def __init__(self, model_path, replicas, threads_per_replica=REPLICA_THREADS,
+                 pin_cores=REPLICA_PIN_CORES, max_queue=INFERENCE_QUEUE_SIZE):
+        self.model_path = model_path
+        self.replicas = replicas
+        cores = available_cores()
+        self.threads_per_replica = threads_per_replica or max(1, len(cores) // replicas)
+        self.pin_cores = pin_cores
+        self.max_queue = max_queue
+        self._cores = cores
+        self._replicas = []
+        self._jobs = {}
+        self._next_job_id = 0
+        self._lock = threading.Lock()
+        self._started = False
+        self.rejected = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.started_jobs = 0
+
+    def start(self):
+        """Spawn the replica processes if they are not already running."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for index in range(self.replicas):
+                replica = self._spawn(index)
+                self._replicas.append(replica)
+                self._watch(replica)
+            logger.info("Started %s model replicas with %s threads each", self.replicas, self.threads_per_replica)
+
+    def _spawn(self, index, restarts=0):
+        """Start the process of replica ``index`` and return its _Replica."""
+        context = multiprocessing.get_context("spawn")
+        cores = None
+        if self.pin_cores:
+            first = (index * self.threads_per_replica) % len(self._cores)
+            cores = self._cores[first:first + self.threads_per_replica]
+        jobs = context.Queue()
+        results = context.Queue()
+        cancel = context.Value("q", -1)
+        process = context.Process(
+            target=_replica_main,
+            args=(index, self.model_path, self.threads_per_replica, cores, jobs, results, cancel),
+            name=f"model-replica-{index}",
+            daemon=True
+        )
+        process.start()
+        return _Replica(index, process, jobs, results, cancel, cores, self.threads_per_replica, restarts)
+
+    def _watch(self, replica):
+        threading.Thread(target=self._read_results, args=(replica,),
+                         name=f"replica-{replica.index}-results", daemon=True).start()
+
+    def warmup(self, timeout=None):
+        """Start the replicas and wait for them to load. Returns True if at least one is ready."""
+        self.start()
+        for replica in self._replicas:
+            replica.ready.wait(timeout)
+        return any(r.ready.is_set() and not r.failed for r in self._replicas)
+
+    @property
+    def context_tokens(self):
+        """Context window available to one generation."""
+        return DEFAULT_N_CTX
+
+    def load_status(self):
+        """Return whether any replica is ready to serve and how many have finished loading."""
+        replicas = list(self._replicas)
+        ready = sum(1 for r in replicas if r.ready.is_set() and not r.failed)
+        finished = sum(1 for r in replicas if r.ready.is_set())
+        if not replicas:
+            phase = "idle"
+        elif ready:
+            phase = "ready"
+        elif finished == len(replicas):
+            phase = "failed"
+        else:
+            phase = "loading"
+        load_times = [r.load_seconds for r in replicas if r.load_seconds is not None]
+        return {
+            "ready": ready > 0,
+            "phase": phase,
+            "progress": round(finished / self.replicas, 3),
+            "elapsed_seconds": max(load_times) if load_times else None,
+            "replicas_ready": ready,
+        }
+
+    def _read_results(self, replica):
+        while True:
+            try:
+                job_id, kind, payload = replica.results.get(timeout=REPLICA_POLL_INTERVAL)
+            except queue.Empty:
+                if replica.process.is_alive():
+                    continue
+                self._replace(replica)
+                return
+            if job_id is None:
+                if kind == "ready":
+                    replica.load_seconds = payload["load_seconds"]
+                    logger.info("Replica %s ready in %.2fs", replica.index, replica.load_seconds)
+                else:
+                    replica.failed = True
+                    logger.error("Replica %s failed to load the model", replica.index)
+                replica.ready.set()
+                if replica.failed:
+                    self._fail_pending(replica)
+                    return
+                continue
+
+            with self._lock:
+                job = self._jobs.get(job_id)
+            if job is None:
+                continue
+
+            if kind == "started":
+                job.prompt_tokens = payload
+                job.wait_seconds = time.monotonic() - job.enqueued_at
+                self.total_wait_seconds += job.wait_seconds
+                self.max_wait_seconds = max(self.max_wait_seconds, job.wait_seconds)
+                self.started_jobs += 1
+                if job.cancelled:
+                    replica.cancel.value = job_id
+            elif kind == "chunk":
+                if job.cancelled:
+                    replica.cancel.value = job_id
+                else:
+                    job.chunks.put(payload)
+            else:
+                if kind == "result":
+                    output, timings = payload
+                    record_generation(job.prompt_tokens, timings)
+                    job.future.set_result(output)
+                else:
+                    job.future.set_exception(RuntimeError(payload))
+                if job.stream:
+                    job.chunks.put(_STREAM_END)
+                with self._lock:
+                    self._jobs.pop(job_id, None)
+                    replica.in_flight -= 1
+                    replica.completed += 1
+
+    def _fail_pending(self, replica, error=None):
+        """Take ``replica`` out of rotation and fail every job routed to it with ``error``."""
+        with self._lock:
+            replica.failed = True
+            pending = [(job_id, job) for job_id, job in self._jobs.items() if job.replica is replica]
+            for job_id, _ in pending:
+                self._jobs.pop(job_id, None)
+            replica.in_flight = 0
+        for _, job in pending:
+            job.future.set_exception(error or ModelUnavailableError("The language model could not be loaded."))
+            if job.stream:
+                job.chunks.put(_STREAM_END)
+        return len(pending)
+
+    def _replace(self, replica):
+        """Fail the jobs of a replica whose process exited and respawn it."""
+        failed = self._fail_pending(
+            replica, RuntimeError(f"Model replica {replica.index} exited while running the request."))
+        # Unblock warmup if the replica died while loading
+        replica.ready.set()
+        logger.error("Replica %s exited with code %s, failed %s pending jobs",
+                     replica.index, replica.process.exitcode, failed)
+        if replica.restarts >= REPLICA_MAX_RESTARTS:
+            logger.error("Replica %s exited %s times, not restarting it", replica.index, replica.restarts + 1)
+            return
+        respawned = self._spawn(replica.index, replica.restarts + 1)
+        with self._lock:
+            self._replicas[self._replicas.index(replica)] = respawned
+        self._watch(respawned)
+        logger.warning("Restarted replica %s (restart %s of %s)", replica.index, respawned.restarts,
+                       REPLICA_MAX_RESTARTS)
+
+    def _dispatch(self, job):
+        self.start()
+        with self._lock:
+            live = [r for r in self._replicas if not r.failed]
+            if not live:
+                raise ModelUnavailableError("The language model could not be loaded.")
+            # Every replica may run one job and hold up to max_queue waiting ones in total
+            if len(self._jobs) >= len(live) + self.max_queue:
+                self.rejected += 1
+                logger.warning("Replica pool full (%s jobs), rejecting request", len(self._jobs))
+                raise QueueFullError("The model is busy, please retry shortly.")
+            replica = min(live, key=lambda r: r.in_flight)
+            job_id = self._next_job_id
+            self._next_job_id += 1
+            job.replica = replica
+            self._jobs[job_id] = job
+            replica.in_flight += 1
+        replica.jobs.put((job_id, job.prompt, job.params, job.stream))
+
+    def submit(self, prompt, **params):
+        """Queue a completion job on the least-loaded replica. Returns a Future of the model output."""
+        job = _Job(prompt, params, stream=False)
+        self._dispatch(job)
+        return job.future
+
+    def submit_stream(self, prompt, **params):
+        """Queue a streaming completion job on the least-loaded replica. Returns a StreamHandle."""
+        job = _Job(prompt, params, stream=True)
+        self._dispatch(job)
+        return StreamHandle(job)
+
+    def stats(self):
+        """Return per-replica load and queue statistics."""
+        with self._lock:
+            in_flight = len(self._jobs)
+            replicas = [{
+                "index": r.index,
+                "alive": r.process.is_alive(),
+                "ready": r.ready.is_set() and not r.failed,
+                "cores": r.cores,
+                "threads": r.n_threads,
+                "in_flight": r.in_flight,
+                "completed": r.completed,
+                "load_seconds": r.load_seconds,
+                "restarts": r.restarts,
+            } for r in self._replicas]
+        return {
+            "mode": "replicas",
+            "queue_depth": max(0, in_flight - len(replicas)),
+            "max_queue": self.max_queue,
+            "in_flight": in_flight,
+            "rejected": self.rejected,
+            "avg_wait_seconds": self.total_wait_seconds / self.started_jobs if self.started_jobs else None,
+            "max_wait_seconds": self.max_wait_seconds,
+            "replicas": replicas,
+        }
@@ -0,0 +1,78 @@
+import logging
+import math
+import os
+import re
+
+from cache import TTLCache
+from prompts import is_investment_query
+
+logger = logging.getLogger(__name__)
+
+# Response cache configuration
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "300"))  # seconds
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "256"))
+RESPONSE_PRICE_TOLERANCE = float(os.environ.get("RESPONSE_PRICE_TOLERANCE", "0.01"))  # relative price move that invalidates
+
+_WHITESPACE = re.compile(r"\s+")
+
+response_cache = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, name="response")
+
+
+def normalize_message(user_message):
+    """Lowercase a query, collapse whitespace and drop trailing punctuation."""
+    return _WHITESPACE.sub(" ", user_message).strip().lower().rstrip("?!. ")
+
+
+def price_bucket(price, tolerance=RESPONSE_PRICE_TOLERANCE):
+    """
+    Map a price onto a logarithmic grid with steps of ``tolerance``
+
+    Prices within roughly ``tolerance`` of each other share a bucket, so
+    small ticks keep the same fingerprint while real moves change it.
+    Non-numeric prices (e.g. "$189.84" from the listing) are parsed first.
+    """
+    if isinstance(price, str):
+        try:
+            price = float(price.replace("$", "").replace(",", ""))
+        except ValueError:
+            return price
+    if not isinstance(price, (int, float)) or price <= 0 or tolerance <= 0:
+        return price
+    return math.floor(math.log(price) / math.log1p(tolerance))
+
+
+def data_fingerprint(market_data, tolerance=RESPONSE_PRICE_TOLERANCE):
+    """
+    Coarse fingerprint of the market data a prompt was built from
+
+    Args:
+        market_data: Dictionary mapping each symbol to ``(combined_data, esg_data)`` or None if it had no data
+        tolerance: Relative price tolerance, see price_bucket
+
+    Returns:
+        Tuple of ``(symbol, price bucket, total ESG score)``, or None if any symbol had no data
+    """
+    fingerprint = []
+    for symbol, row in sorted(market_data.items()):
+        if row is None:
+            return None
+        combined_data, esg_data = row
+        esg_score = (esg_data or {}).get("totalEsg", {}).get("fmt")
+        fingerprint.append((symbol, price_bucket(combined_data.get("price"), tolerance), esg_score))
+    return tuple(fingerprint)
+
+
+def response_key(user_message, market_data, tolerance=RESPONSE_PRICE_TOLERANCE):
+    """
+    Cache key for the response to a query, or None if the response should not be cached
+
+    Responses are only cached when every symbol in the query had data, so an
+    answer written around a failed lookup is never replayed.
+    """
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    fingerprint = data_fingerprint(market_data, tolerance)
+    if fingerprint is None:
+        return None
+    return normalize_message(user_message), is_investment_query(user_message), fingerprint
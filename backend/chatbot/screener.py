@@ -0,0 +1,306 @@
+import logging
+import math
+import os
+import re
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Screening configuration
+SCREEN_DEFAULT_RESULTS = int(os.environ.get("SCREEN_DEFAULT_RESULTS", "5"))
+SCREEN_MAX_RESULTS = int(os.environ.get("SCREEN_MAX_RESULTS", "10"))
+SCREEN_MIN_MARKET_CAP = float(os.environ.get("SCREEN_MIN_MARKET_CAP", "300000000"))  # dollars, for screens on daily change
+
+# Phrases asking for an ordering and the (column, descending) they map to, first match wins.
+# Phrases match whole words, optionally plural. ESG scores are risk scores, so the best ESG
+# names have the lowest score.
+SCREEN_ORDERS = [
+    (("up most", "up the most", "gainer", "best performer", "best performing", "top performer", "top performing",
+      "biggest gain", "rising", "climbing"),
+     ("change_pct", True)),
+    (("down most", "down the most", "loser", "worst performer", "worst performing", "biggest drop", "biggest loss",
+      "biggest losses", "falling", "dropping"),
+     ("change_pct", False)),
+    (("best esg", "top esg", "lowest esg", "most sustainable", "greenest", "esg leader"), ("esg", False)),
+    (("worst esg", "highest esg", "least sustainable", "esg laggard"), ("esg", True)),
+    (("largest", "biggest company", "biggest companies", "biggest stock", "most valuable", "highest market cap",
+      "mega cap"),
+     ("market_cap", True)),
+    (("smallest", "small cap", "lowest market cap"), ("market_cap", False)),
+]
+
+# Queries that want other stocks to compare with, screened by market cap unless they ask for an ordering
+SCREEN_REQUEST_TERMS = [
+    "compare", "compared", "versus", "vs", "against", "other stock", "alternative",
+    "competitor", "similar companies", "sector performance"
+]
+
+# A screen is about the market, so one of these has to appear too: "why are rates rising?" is not a screen
+SCREEN_NOUNS = [
+    "stock", "share", "equity", "equities", "ticker", "company", "companies", "name", "gainer", "loser",
+    "performer", "market", "sector", "cap"
+]
+
+
+def _word_pattern(phrases):
+    """Regex matching any of ``phrases`` as whole words, optionally followed by a plural "s"."""
+    return re.compile(r"\b(?:" + "|".join(sorted(map(re.escape, phrases), key=len, reverse=True)) + r")s?\b")
+
+
+_ORDER_PATTERNS = [(_word_pattern(phrases), order) for phrases, order in SCREEN_ORDERS]
+_REQUEST_PATTERN = _word_pattern(SCREEN_REQUEST_TERMS)
+_NOUN_PATTERN = _word_pattern(SCREEN_NOUNS)
+
+# Words people use for the sectors reported by the quote API
+SECTOR_ALIASES = {
+    "tech": "Technology", "technology": "Technology", "software": "Technology", "semiconductor": "Technology",
+    "chip": "Technology",
+    "communication": "Communication Services", "telecom": "Communication Services", "media": "Communication Services",
+    "consumer cyclical": "Consumer Cyclical", "consumer discretionary": "Consumer Cyclical", "retail": "Consumer Cyclical",
+    "consumer defensive": "Consumer Defensive", "consumer staples": "Consumer Defensive", "staples": "Consumer Defensive",
+    "financial": "Financial Services", "finance": "Financial Services", "bank": "Financial Services",
+    "insurance": "Financial Services",
+    "health": "Healthcare", "pharma": "Healthcare", "biotech": "Healthcare", "medical": "Healthcare",
+    "energy": "Energy", "oil": "Energy",
+    "industrial": "Industrials", "utilit": "Utilities", "real estate": "Real Estate", "reit": "Real Estate",
+    "material": "Basic Materials", "mining": "Basic Materials", "chemical": "Basic Materials",
+}
+_SECTOR_PATTERN = re.compile(r"\b(" + "|".join(sorted(map(re.escape, SECTOR_ALIASES), key=len, reverse=True)) + r")")
+_COUNT_PATTERN = re.compile(r"\b(?:top|best|worst|bottom|biggest|largest|smallest)\s+(\d{1,3})\b|\b(\d{1,3})\s+(?:stocks|companies|names)\b")
+
+_COLUMN_LABELS = {"change_pct": "daily change", "esg": "ESG risk score", "market_cap": "market cap"}
+
+
+class Screen:
+    """A screening request: which column to order by, in which direction, and what to keep."""
+
+    def __init__(self, order_by, descending, limit=SCREEN_DEFAULT_RESULTS, sector=None, min_market_cap=None):
+        self.order_by = order_by
+        self.descending = descending
+        self.limit = limit
+        self.sector = sector
+        self.min_market_cap = min_market_cap
+
+    def describe(self, shown, candidates):
+        """Heading for the prompt context of a screen showing ``shown`` of the ``candidates`` stocks it ranked."""
+        subject = f"{self.sector} stocks" if self.sector else "stocks"
+        direction = "highest" if self.descending else "lowest"
+        if self.order_by == "esg":
+            direction += " risk" if self.descending else " risk, best"
+        heading = f"Top {shown} {subject} by {_COLUMN_LABELS[self.order_by]} ({direction} first)"
+        if self.min_market_cap:
+            heading += f", market cap at least ${self.min_market_cap / 1e6:,.0f}M"
+        return f"{heading}, ranked among {candidates} stocks with local data:\n"
+
+
+def parse_screen(user_message):
+    """
+    Return the Screen a query asks for, or None if it does not ask for one
+
+    Orderings come from SCREEN_ORDERS; a query that only asks for stocks to
+    compare with (SCREEN_REQUEST_TERMS) gets the largest companies. Either
+    needs one of SCREEN_NOUNS as well. Sectors are matched through
+    SECTOR_ALIASES and "top 10" style counts are capped at SCREEN_MAX_RESULTS.
+    """
+    message = user_message.lower()
+    if not _NOUN_PATTERN.search(message):
+        return None
+    order = next((order for pattern, order in _ORDER_PATTERNS if pattern.search(message)), None)
+    if order is None:
+        if not _REQUEST_PATTERN.search(message):
+            return None
+        order = ("market_cap", True)
+
+    sector = _SECTOR_PATTERN.search(message)
+    count = _COUNT_PATTERN.search(message)
+    limit = int(count.group(1) or count.group(2)) if count else SCREEN_DEFAULT_RESULTS
+    order_by, descending = order
+    return Screen(
+        order_by,
+        descending,
+        limit=max(1, min(limit, SCREEN_MAX_RESULTS)),
+        sector=SECTOR_ALIASES[sector.group(1)] if sector else None,
+        min_market_cap=SCREEN_MIN_MARKET_CAP if order_by == "change_pct" and "small cap" not in message else None
+    )
+
+
+def _quote_fields(response):
+    """Return ``(price, change_pct, market_cap, sector, name)`` from a quote response, None for missing values."""
+    quote = None
+    if isinstance(response, dict):
+        quote = response.get("data") if isinstance(response.get("data"), dict) else response.get("body")
+    if not isinstance(quote, dict):
+        return None
+
+    def number(key):
+        value = quote.get(key)
+        return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+    sector = quote.get("sector")
+    name = quote.get("longName")
+    return (number("regularMarketPrice"), number("regularMarketChangePercent"), number("marketCap"),
+            sector if isinstance(sector, str) and sector else None, name if isinstance(name, str) else None)
+
+
+def _esg_score(data):
+    score = data.get("totalEsg", {}).get("raw") if isinstance(data, dict) else None
+    return float(score) if isinstance(score, (int, float)) else math.nan
+
+
+class MarketScreener:
+    """
+    Vectorized stock screens over locally held market data.
+
+    Keeps NumPy columns aligned with the ticker directory's snapshot: price,
+    daily change and market cap from the listing, overlaid with the latest
+    quote seen for a symbol, plus sector codes from quotes and total ESG
+    scores from the ESG store. Quotes and scores are pushed in through
+    update_quote and update_esg (typically as cache subscribers), so a screen
+    is a filter and a partial sort over the columns and never calls upstream.
+    Sector and ESG screens only see symbols whose quote or score has been
+    fetched before.
+    """
+
+    def __init__(self, directory, esg_store=None):
+        """
+        Args:
+            directory: TickerDirectory whose snapshot defines the universe
+            esg_store: Optional zero-argument callable returning the ESGStore to subscribe to on first use
+        """
+        self._directory = directory
+        self._esg_store = esg_store
+        self._lock = threading.Lock()
+        self._quotes = {}  # symbol -> _quote_fields of its latest quote
+        self._esg = {}  # symbol -> ESG data
+        self._sectors = []  # sector code -> name
+        self._sector_codes = {}
+        self._state = (None, None)  # (snapshot, columns built for it)
+
+    def update_quote(self, symbol, response):
+        """Record the latest quote response for ``symbol``."""
+        fields = _quote_fields(response)
+        if fields is None:
+            return
+        symbol = symbol.upper()
+        with self._lock:
+            self._quotes[symbol] = fields
+            snapshot, columns = self._state
+            if columns is not None:
+                row = snapshot.index(symbol)
+                if row is not None:
+                    self._apply_quote(columns, row, fields)
+
+    def update_esg(self, symbol, data):
+        """Record the latest ESG data for ``symbol``."""
+        if not data:
+            return
+        symbol = symbol.upper()
+        with self._lock:
+            self._esg[symbol] = data
+            snapshot, columns = self._state
+            if columns is not None:
+                row = snapshot.index(symbol)
+                if row is not None:
+                    columns["esg"][row] = _esg_score(data)
+
+    def _apply_quote(self, columns, row, fields):
+        price, change_pct, market_cap, sector, _ = fields
+        if price is not None:
+            columns["price"][row] = price
+        if change_pct is not None:
+            columns["change_pct"][row] = change_pct
+        if market_cap is not None:
+            columns["market_cap"][row] = market_cap
+        if sector is not None:
+            code = self._sector_codes.get(sector)
+            if code is None:
+                code = self._sector_codes[sector] = len(self._sectors)
+                self._sectors.append(sector)
+            columns["sector"][row] = code
+
+    def _current(self):
+        """Return the directory's snapshot and the columns for it, rebuilding them after a directory reload."""
+        snapshot = self._directory.snapshot
+        state = self._state
+        if state[0] is snapshot:
+            return state
+        with self._lock:
+            esg_store, self._esg_store = self._esg_store, None
+        if esg_store is not None:
+            # Replays every stored score into update_esg, which takes the lock
+            esg_store().subscribe(self.update_esg)
+        with self._lock:
+            if self._state[0] is snapshot:
+                return self._state
+            columns = {
+                "price": np.array(snapshot.price),
+                "change_pct": np.array(snapshot.change_pct),
+                "market_cap": np.array(snapshot.market_cap),
+                "sector": np.full(len(snapshot), -1, dtype=np.int16),
+                "esg": np.full(len(snapshot), np.nan),
+            }
+            for symbol, fields in self._quotes.items():
+                row = snapshot.index(symbol)
+                if row is not None:
+                    self._apply_quote(columns, row, fields)
+            for symbol, data in self._esg.items():
+                row = snapshot.index(symbol)
+                if row is not None:
+                    columns["esg"][row] = _esg_score(data)
+            self._state = (snapshot, columns)
+            logger.info("Screener indexed %s symbols, %s with quotes and %s with ESG scores",
+                        len(snapshot), len(self._quotes), len(self._esg))
+            return self._state
+
+    def _rank(self, columns, screen):
+        """Return the rows passing the screen's filters in rank order, up to its limit, and how many passed."""
+        values = columns[screen.order_by]
+        mask = ~np.isnan(values)
+        if screen.sector is not None:
+            code = self._sector_codes.get(screen.sector)
+            if code is None:
+                return np.empty(0, dtype=np.intp), 0
+            mask &= columns["sector"] == code
+        if screen.min_market_cap:
+            mask &= columns["market_cap"] >= screen.min_market_cap
+
+        candidates = np.flatnonzero(mask)
+        keys = -values[candidates] if screen.descending else values[candidates]
+        if len(candidates) > screen.limit:
+            top = np.argpartition(keys, screen.limit - 1)[:screen.limit]
+        else:
+            top = np.arange(len(candidates))
+        top = top[np.argsort(keys[top], kind="stable")]
+        return candidates[top], len(candidates)
+
+    def run(self, screen):
+        """Run a screen, returning ``(symbols in rank order, number of stocks that passed the filters)``."""
+        snapshot, columns = self._current()
+        rows, candidates = self._rank(columns, screen)
+        return [snapshot.symbol(row) for row in rows], candidates
+
+    def market_data(self, screen):
+        """
+        Run a screen and return its rows in the shape the prompt builders use
+
+        Returns:
+            ``(heading, {symbol: (combined_data, esg_data)})`` in rank order
+        """
+        snapshot, columns = self._current()
+        rows, candidates = self._rank(columns, screen)
+        market_data = {}
+        for row in rows:
+            symbol = snapshot.symbol(row)
+            quote = self._quotes.get(symbol)
+            combined_data = {"symbol": symbol, "name": (quote and quote[4]) or snapshot.name(row)}
+            price, change_pct, market_cap = columns["price"][row], columns["change_pct"][row], columns["market_cap"][row]
+            combined_data["price"] = "N/A" if np.isnan(price) else f"{price:.2f}"
+            combined_data["change_pct"] = "N/A" if np.isnan(change_pct) else f"{change_pct:.2f}%"
+            if not np.isnan(market_cap):
+                combined_data["market_cap"] = int(market_cap)
+            if columns["sector"][row] >= 0:
+                combined_data["sector"] = self._sectors[columns["sector"][row]]
+            market_data[symbol] = (combined_data, self._esg.get(symbol))
+        return screen.describe(len(market_data), candidates), market_data
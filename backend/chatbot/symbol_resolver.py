@@ -0,0 +1,202 @@
+import re
+from collections import deque
+
+from comparison import MAX_QUERY_SYMBOLS, NON_SYMBOL_WORDS
+
+# Listing name parts that are not how people refer to a company
+_SHARE_CLASS = re.compile(
+    r"\s+(common stock|ordinary shares?|class [a-z]\b|american depositary|depositary shares?|"
+    r"units?\b|warrants?\b|rights?\b|preferred|series [a-z]\b).*$")
+_COMPANY_SUFFIX = re.compile(
+    r"[\s,]+(inc|incorporated|corp|corporation|co|company|ltd|limited|plc|holdings?|group|n\.?v|s\.?a|ag|se|lp|llc)\.?$")
+_DOMAIN_SUFFIX = re.compile(r"\.(com|net|io)$")
+
+# Uppercase letters only, so lowered text keeps the positions of the original
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+MIN_ALIAS_LENGTH = 3
+
+# English words that open listing names ("Best Buy", "Top Financial") but far
+# more often open a question, so they never become a first-word alias
+COMMON_WORDS = frozenset(word.lower() for word in NON_SYMBOL_WORDS) | frozenset({
+    "about", "advanced", "after", "american", "any", "best", "better", "big", "blue", "bright", "can", "capital",
+    "clear", "compare", "core", "could", "does", "easy", "every", "find", "first", "free", "general", "get",
+    "give", "global", "gold", "golden", "great", "green", "help", "here", "home", "how", "international",
+    "just", "key", "life", "list", "live", "look", "main", "many", "more", "most", "much", "national", "next",
+    "only", "open", "other", "our", "over", "power", "prime", "pure", "rank", "safe", "should", "show", "simple",
+    "smart", "some", "star", "sun", "tell", "than", "that", "their", "there", "these", "this", "top", "total",
+    "true", "united", "value", "very", "what", "when", "where", "which", "who", "will", "with", "world", "would",
+    "you", "your",
+})
+
+# Characters that may sit between the end of a sentence and its first word
+_SENTENCE_OPENERS = " \t\"'(*-"
+
+
+def name_aliases(name):
+    """
+    Return the ways a listing name is likely written in a question
+
+    "Apple Inc. Common Stock" gives ["apple"], "The Coca-Cola Company Common
+    Stock" gives ["coca-cola", "coca cola"].
+    """
+    alias = name.translate(_ASCII_LOWER).strip()
+    alias = _SHARE_CLASS.sub("", alias).replace(" (the)", "")
+    while True:
+        shorter = _COMPANY_SUFFIX.sub("", alias).rstrip(" ,&")
+        if shorter == alias:
+            break
+        alias = shorter
+    alias = _DOMAIN_SUFFIX.sub("", alias)
+    if alias.startswith("the "):
+        alias = alias[4:]
+    aliases = [alias] if len(alias) >= MIN_ALIAS_LENGTH else []
+    if "-" in alias:
+        aliases.append(alias.replace("-", " "))
+    return aliases
+
+
+def _starts_sentence(text, start):
+    """Whether the word at ``start`` is the first of its sentence."""
+    before = text[:start].rstrip(_SENTENCE_OPENERS)
+    return not before or before[-1] in ".!?:;\n"
+
+
+class SymbolResolver:
+    """
+    Finds every ticker symbol and company name mentioned in a message in one pass.
+
+    An Aho-Corasick automaton over the lowercased symbols and company name
+    aliases of the listing scans the message once. Symbol matches must be
+    written in uppercase and name matches capitalized, both on word
+    boundaries. A single-word name that is also a common English word is
+    ignored when it opens a sentence, and one that is a common uppercase
+    word (NON_SYMBOL_WORDS) is always ignored. Single letters and common uppercase words (NON_SYMBOL_WORDS)
+    only count when written as cashtags, e.g. "$F".
+    """
+
+    def __init__(self, symbols, aliases=None):
+        """
+        Args:
+            symbols: Iterable of valid ticker symbols
+            aliases: Optional dictionary mapping lowercase company names to symbols
+        """
+        self._goto = {}  # (state, character) -> state
+        self._fail = [0]
+        self._outputs = [()]  # state -> ((length, symbol, is_name), ...)
+        self.symbols = frozenset(s.upper() for s in symbols)
+        for symbol in self.symbols:
+            self._add(symbol.translate(_ASCII_LOWER), (len(symbol), symbol, False))
+        for alias, symbol in (aliases or {}).items():
+            self._add(alias, (len(alias), symbol, True))
+        self._build()
+
+    @classmethod
+    def from_tickers(cls, tickers):
+        """
+        Build a resolver from listing records with "symbol" and "name" fields
+
+        A name shared by several listings resolves to the first one, and a
+        first word of a name is added as an alias when no other name starts
+        with it and it is not a common English word (so "Exxon" finds XOM
+        while "General" and "Best" find nothing).
+        """
+        symbols = []
+        aliases = {}
+        first_words = {}
+        for ticker in tickers:
+            symbol = (ticker.get("symbol") or "").upper()
+            if not symbol:
+                continue
+            symbols.append(symbol)
+            for alias in name_aliases(ticker.get("name") or ""):
+                aliases.setdefault(alias, symbol)
+                first_word = alias.split(" ", 1)[0]
+                if first_word != alias:
+                    first_words.setdefault(first_word, set()).add(symbol)
+        for word, owners in first_words.items():
+            if len(owners) == 1 and len(word) >= MIN_ALIAS_LENGTH and word not in aliases \
+                    and word not in COMMON_WORDS:
+                aliases[word] = next(iter(owners))
+        return cls(symbols, aliases)
+
+    def _add(self, pattern, output):
+        state = 0
+        for character in pattern:
+            next_state = self._goto.get((state, character))
+            if next_state is None:
+                next_state = len(self._fail)
+                self._goto[(state, character)] = next_state
+                self._fail.append(0)
+                self._outputs.append(())
+            state = next_state
+        self._outputs[state] += (output,)
+
+    def _build(self):
+        children = {}
+        for (state, character), child in self._goto.items():
+            children.setdefault(state, []).append((character, child))
+        pending = deque(child for _, child in children.get(0, ()))
+        while pending:
+            state = pending.popleft()
+            for character, child in children.get(state, ()):
+                pending.append(child)
+                fallback = self._fail[state]
+                while fallback and (fallback, character) not in self._goto:
+                    fallback = self._fail[fallback]
+                target = self._goto.get((fallback, character), 0)
+                self._fail[child] = target if target != child else 0
+                self._outputs[child] += self._outputs[self._fail[child]]
+
+    def _matches(self, text):
+        """Yield (start, end, symbol) for every accepted mention in ``text``."""
+        lowered = text.translate(_ASCII_LOWER)
+        state = 0
+        for index, character in enumerate(lowered):
+            while state and (state, character) not in self._goto:
+                state = self._fail[state]
+            state = self._goto.get((state, character), 0)
+            for length, symbol, is_name in self._outputs[state]:
+                start, end = index + 1 - length, index + 1
+                if (start > 0 and text[start - 1].isalnum()) or (end < len(text) and text[end].isalnum()):
+                    continue
+                mention = text[start:end]
+                if is_name:
+                    if not mention[0].isupper():
+                        continue
+                    if " " not in mention:
+                        # "The CEO of Apple" is not about a listing named "CEO Corp"
+                        if mention.upper() in NON_SYMBOL_WORDS:
+                            continue
+                        # Every sentence starts capitalized, so an opening "Show" or "Best" is just a word
+                        if mention.lower() in COMMON_WORDS and _starts_sentence(text, start):
+                            continue
+                elif mention != symbol:
+                    continue
+                elif not (start > 0 and text[start - 1] == "$"):
+                    if len(symbol) < 2 or symbol in NON_SYMBOL_WORDS:
+                        continue
+                yield start, end, symbol
+
+    def resolve(self, text, limit=MAX_QUERY_SYMBOLS):
+        """
+        Return the symbols mentioned in ``text``, in order of first mention
+
+        Overlapping mentions keep the leftmost, longest one, so "Exxon Mobil"
+        is one mention of XOM rather than two.
+        """
+        matches = sorted(self._matches(text), key=lambda m: (m[0], m[0] - m[1]))
+        symbols = []
+        covered_to = 0
+        for start, end, symbol in matches:
+            if start < covered_to:
+                continue
+            covered_to = end
+            if symbol not in symbols:
+                symbols.append(symbol)
+                if len(symbols) == limit:
+                    break
+        return symbols
+
+    def __len__(self):
+        return len(self.symbols)
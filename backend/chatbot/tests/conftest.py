@@ -0,0 +1,92 @@
+"""
+Shared fixtures for the backend tests.
+
+The servers are exercised against bench/mock_rapidapi.py and a fake
+inference scheduler, so the tests need neither API quota nor a model file.
+Module level settings are read at import time, which is why the environment
+is configured here before any backend module is imported.
+"""
+import os
+import sys
+import tempfile
+from concurrent.futures import Future
+
+import pytest
+
+CHATBOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CHATBOT_DIR)
+
+WORKDIR = tempfile.mkdtemp(prefix="chatbot-tests-")
+os.environ.update({
+    "LOG_FILE": "",
+    "LOG_LEVEL": "WARNING",
+    "ESG_CACHE_PATH": os.path.join(WORKDIR, "esg_cache.sqlite3"),
+    "TICKER_SNAPSHOT_PATH": os.path.join(WORKDIR, "ticker_snapshot.bin"),
+    "MODEL_PATH": os.path.join(WORKDIR, "missing.gguf"),
+    "MARKET_DATA_RETRY_DELAY": "0.05",
+    "MARKET_DATA_RATE": "1000",
+    "MARKET_DATA_BURST": "1000",
+    "MARKET_REFRESH_ENABLED": "0",
+})
+
+from bench.mock_rapidapi import MockRapidAPI  # noqa: E402
+
+
+class FakeScheduler:
+    """Stands in for the inference scheduler, answering every prompt with ``reply``."""
+
+    context_tokens = 2048
+
+    def __init__(self, reply="ok"):
+        self.reply = reply
+        self.prompts = []
+        self.params = []
+
+    def submit(self, prompt, **params):
+        self.prompts.append(prompt)
+        self.params.append(params)
+        future = Future()
+        future.set_result({"choices": [{"text": f" {self.reply} "}]})
+        return future
+
+    def warmup(self):
+        return True
+
+    def load_status(self):
+        return {"ready": True, "phase": "ready", "progress": 1.0, "elapsed_seconds": 0.0}
+
+    def stats(self):
+        return {"mode": "fake", "queue_depth": 0, "completed": len(self.prompts)}
+
+
+@pytest.fixture(scope="session")
+def mock_api():
+    """The RapidAPI stand-in, with the backend pointed at it."""
+    mock = MockRapidAPI(synthetic_tickers=150, page_size=100)
+    base_url = mock.start()
+    os.environ["YAHOO_FINANCE_BASE_URL"] = base_url
+    os.environ["ESG_API_BASE_URL"] = base_url
+    yield mock
+    mock.stop()
+
+
+@pytest.fixture(scope="session")
+def app_module(mock_api):
+    """The Flask app module with its ticker directory loaded from the mock listing."""
+    import app
+
+    app.ticker_directory.start()
+    assert app.ticker_directory.wait_until_loaded(10)
+    return app
+
+
+@pytest.fixture
+def scheduler(app_module, monkeypatch):
+    """A FakeScheduler installed in place of the model, with the response cache emptied."""
+    import asgi_app
+
+    fake = FakeScheduler()
+    monkeypatch.setattr(app_module, "get_inference_scheduler", lambda model_path: fake)
+    monkeypatch.setattr(asgi_app, "get_inference_scheduler", lambda model_path: fake)
+    app_module.response_cache.clear()
+    return fake
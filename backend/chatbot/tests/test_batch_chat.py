@@ -0,0 +1,46 @@
+from concurrent.futures import Future
+
+import pytest
+
+from batch_chat import batch_symbols, parse_queries, read_jsonl, run_batch
+from inference import ModelUnavailableError
+
+
+def answered(prompt):
+    future = Future()
+    future.set_result(prompt.upper())
+    return future
+
+
+def test_read_jsonl_reports_the_bad_line():
+    assert read_jsonl('{"message": "a"}\n\n"b"\n') == [{"message": "a"}, "b"]
+    with pytest.raises(ValueError, match="Line 2"):
+        read_jsonl('"a"\nnot json')
+
+
+def test_parse_queries_and_symbols():
+    queries = parse_queries(["How is AAPL?", {"id": "x", "message": "KO vs PEP", "symbols": ["ko", "pep"],
+                                              "cache": False}])
+    assert queries[0] == {"id": 0, "message": "How is AAPL?", "symbols": None, "cache": True}
+    assert queries[1] == {"id": "x", "message": "KO vs PEP", "symbols": ["KO", "PEP"], "cache": False}
+    assert batch_symbols(queries, lambda message: ["AAPL", "KO"]) == ["AAPL", "KO", "PEP"]
+    with pytest.raises(ValueError):
+        parse_queries([{"id": 1}])
+
+
+def test_run_batch_yields_every_result():
+    prompts = [({"id": 1}, "one"), ({"id": 2}, None), ({"id": 3}, "three")]
+    results = {query["id"]: (output, error) for query, output, error in run_batch(prompts, answered, in_flight=1)}
+    assert results[1] == ("ONE", None)
+    assert results[2][0] is None and results[2][1]
+    assert results[3] == ("THREE", None)
+
+
+def test_unavailable_model_fails_each_query():
+    def unavailable(prompt):
+        raise ModelUnavailableError("The language model could not be loaded.")
+
+    prompts = [({"id": index}, f"prompt {index}") for index in range(3)]
+    results = list(run_batch(prompts, unavailable))
+    assert [query["id"] for query, _, _ in results] == [0, 1, 2]
+    assert all(output is None and "could not be loaded" in error for _, output, error in results)
@@ -0,0 +1,83 @@
+import time
+
+import pytest
+
+import batch_engine
+import model_manager
+from batch_engine import BatchEngine
+from inference import ModelUnavailableError, _Job
+
+
+class FakeManager:
+    """A model manager whose model never loads."""
+
+    n_threads = 1
+
+    def get(self):
+        return None
+
+    def stats(self):
+        return {}
+
+
+class FakeLlama:
+    def tokenize(self, data):
+        return list(data)
+
+
+def test_seq_id_returned_when_the_prefix_copy_fails(monkeypatch):
+    removed = []
+
+    def copy_fails(ctx, src, dst, p0, p1):
+        raise RuntimeError("copy failed")
+
+    monkeypatch.setattr(batch_engine, "_kv_seq_cp", copy_fails)
+    monkeypatch.setattr(batch_engine, "_kv_seq_rm", lambda ctx, seq_id: removed.append(seq_id))
+    engine = BatchEngine(FakeManager(), max_sequences=2)
+    engine.llama = FakeLlama()
+    engine.ctx = object()
+    engine._prefix_tokens = [list(b"shared preamble")]
+    engine._free_seq_ids = [1, 2]
+
+    with pytest.raises(RuntimeError):
+        engine._start_sequence(_Job("shared preamble and a question", {}, stream=False))
+    assert sorted(engine._free_seq_ids) == [1, 2]
+    assert removed == [2]
+
+
+def test_engine_recovers_after_a_failed_setup(monkeypatch):
+    monkeypatch.setattr(batch_engine, "BATCH_RETRY_DELAY", 0.05)
+    engine = BatchEngine(FakeManager(), max_sequences=1)
+    setups = []
+
+    def setup():
+        setups.append(True)
+        if len(setups) == 1:
+            raise ModelUnavailableError("The language model could not be loaded.")
+
+    def step():
+        job = engine._active.pop()
+        engine._finish_job(job, {"choices": [{"text": "ok"}]})
+
+    monkeypatch.setattr(engine, "_setup", setup)
+    monkeypatch.setattr(engine, "_start_sequence", lambda job: job)
+    monkeypatch.setattr(engine, "_step", step)
+
+    with pytest.raises(ModelUnavailableError):
+        engine.submit("hello").result(timeout=5)
+    # Requests during the backoff fail fast, the next context comes up after it
+    deadline = time.monotonic() + 5
+    while len(setups) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert engine.submit("hello").result(timeout=5) == {"choices": [{"text": "ok"}]}
+    assert len(setups) == 2
+    assert engine.stats()["restarts"] == 1
+
+
+def test_model_manager_rejects_conflicting_settings(monkeypatch):
+    monkeypatch.setattr(model_manager, "_managers", {})
+    manager = model_manager.get_model_manager("model.gguf", n_ctx=512)
+    assert model_manager.get_model_manager("model.gguf") is manager
+    assert model_manager.get_model_manager("model.gguf", n_ctx=512) is manager
+    with pytest.raises(ValueError, match="n_ctx=512"):
+        model_manager.get_model_manager("model.gguf", n_ctx=4096)
@@ -0,0 +1,129 @@
+import threading
+import time
+
+import pytest
+
+from cache import TTLCache
+
+
+def test_get_or_load_caches_until_ttl():
+    cache = TTLCache(ttl=0.05)
+    calls = []
+    assert cache.get_or_load("AAPL", lambda: calls.append(1) or {"price": 1}) == {"price": 1}
+    assert cache.get_or_load("AAPL", lambda: calls.append(1) or {"price": 2}) == {"price": 1}
+    time.sleep(0.06)
+    assert cache.get_or_load("AAPL", lambda: calls.append(1) or {"price": 3}) == {"price": 3}
+    assert len(calls) == 2
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_concurrent_misses_share_one_load():
+    cache = TTLCache(ttl=5)
+    release = threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        release.wait(5)
+        return {"price": 1}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load("AAPL", loader))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    while cache.stats()["coalesced"] < 7:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert results == [{"price": 1}] * 8
+    assert cache.stats()["misses"] == 1
+
+
+def test_waiters_see_the_leaders_error():
+    cache = TTLCache(ttl=5)
+    started = threading.Event()
+    release = threading.Event()
+
+    def loader():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("upstream down")
+
+    errors = []
+
+    def load():
+        try:
+            cache.get_or_load("AAPL", loader)
+        except RuntimeError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=load)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=load)
+    follower.start()
+    while cache.stats()["coalesced"] < 1:
+        time.sleep(0.001)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert len(errors) == 2
+    assert "AAPL" not in cache
+
+
+def test_stale_value_served_when_reload_fails():
+    cache = TTLCache(ttl=0.01, stale_ttl=5)
+    cache.get_or_load("AAPL", lambda: {"price": 1})
+    time.sleep(0.02)
+
+    def failing():
+        raise RuntimeError("upstream down")
+
+    assert cache.get_or_load("AAPL", failing) == {"price": 1}
+    assert cache.get_or_load("AAPL", lambda: {}) == {"price": 1}
+    assert cache.stats()["stale_served"] == 2
+    assert cache.get("AAPL") is None
+    assert cache.get("AAPL", stale=True) == {"price": 1}
+
+
+def test_error_without_stale_value_propagates():
+    cache = TTLCache(ttl=5)
+
+    def failing():
+        raise RuntimeError("upstream down")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_load("AAPL", failing)
+    assert cache.get_or_load("AAPL", lambda: {"price": 1}) == {"price": 1}
+
+
+def test_empty_results_are_not_stored():
+    cache = TTLCache(ttl=5)
+    assert cache.get_or_load("NOPE", lambda: {}) == {}
+    assert "NOPE" not in cache
+    assert len(cache) == 0
+
+
+def test_lru_eviction():
+    cache = TTLCache(maxsize=2, ttl=5)
+    cache.set("A", 1)
+    cache.set("B", 2)
+    cache.get("A")
+    cache.set("C", 3)
+    assert "A" in cache
+    assert "B" not in cache
+    assert "C" in cache
+
+
+def test_subscribers_get_existing_and_new_values():
+    cache = TTLCache(ttl=5)
+    cache.set("A", 1)
+    seen = []
+    cache.subscribe(lambda key, value: seen.append((key, value)))
+    cache.set("B", 2)
+    cache.get_or_load("C", lambda: 3)
+    assert seen == [("A", 1), ("B", 2), ("C", 3)]
@@ -0,0 +1,93 @@
+import time
+
+from cache import TTLCache
+from comparison import detect_symbols, fetch_quotes, load_quote, normalize_symbols
+
+NOT_LISTED = {"meta": {"symbol": "NOPE"}, "body": {}}
+
+
+def quote(symbol):
+    return {"body": {"symbol": symbol, "regularMarketPrice": 1.0}}
+
+
+class Upstream:
+    """Batch endpoint knowing ``batched``, single-symbol endpoint knowing ``single``, counting requests."""
+
+    def __init__(self, batched=(), single=(), failing=()):
+        self.batched = set(batched)
+        self.single = set(single)
+        self.failing = set(failing)
+        self.batch_calls = []
+        self.single_calls = []
+
+    def fetch_batch(self, symbols):
+        self.batch_calls.append(list(symbols))
+        return {symbol: quote(symbol) for symbol in symbols if symbol in self.batched}
+
+    def fetch_one(self, symbol):
+        self.single_calls.append(symbol)
+        if symbol in self.failing:
+            return {}
+        return quote(symbol) if symbol in self.single else dict(NOT_LISTED)
+
+
+def deadline():
+    return time.monotonic() + 5
+
+
+def test_detect_symbols_skips_common_words():
+    assert detect_symbols("Is AAPL or MSFT the BEST buy NOW?") == ["AAPL", "MSFT"]
+
+
+def test_normalize_symbols():
+    assert normalize_symbols([" aapl", "AAPL", "brk.b"]) == ["AAPL", "BRK.B"]
+
+
+def test_each_symbol_is_one_cache_lookup():
+    upstream = Upstream(batched={"AAPL"}, single={"MSFT"})
+    cache = TTLCache(ttl=5)
+    quotes = fetch_quotes(["AAPL", "MSFT"], upstream.fetch_batch, upstream.fetch_one, deadline(), cache=cache)
+    assert set(quotes) == {"AAPL", "MSFT"}
+    assert upstream.single_calls == ["MSFT"]
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (0, 2)
+
+    fetch_quotes(["AAPL", "MSFT"], upstream.fetch_batch, upstream.fetch_one, deadline(), cache=cache)
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (2, 2)
+    assert len(upstream.batch_calls) == 1
+
+
+def test_unknown_symbols_are_cached_briefly():
+    upstream = Upstream(batched={"AAPL"})
+    cache = TTLCache(ttl=5)
+    for _ in range(3):
+        quotes = fetch_quotes(["AAPL", "NOPE"], upstream.fetch_batch, upstream.fetch_one, deadline(), cache=cache)
+        assert list(quotes) == ["AAPL"]
+    assert upstream.batch_calls == [["AAPL", "NOPE"]]
+    assert upstream.single_calls == ["NOPE"]
+    assert load_quote("NOPE", upstream.fetch_one, cache) == NOT_LISTED
+    assert upstream.single_calls == ["NOPE"]
+
+
+def test_negative_entries_expire():
+    upstream = Upstream()
+    cache = TTLCache(ttl=5)
+    load_quote("NOPE", upstream.fetch_one, cache, missing_ttl=0.01)
+    time.sleep(0.02)
+    load_quote("NOPE", upstream.fetch_one, cache, missing_ttl=0.01)
+    assert upstream.single_calls == ["NOPE", "NOPE"]
+
+
+def test_failed_requests_are_not_cached():
+    upstream = Upstream(failing={"AAPL"})
+    cache = TTLCache(ttl=5)
+    for _ in range(2):
+        assert fetch_quotes(["AAPL"], upstream.fetch_batch, upstream.fetch_one, deadline(), cache=cache) == {}
+    assert upstream.single_calls == ["AAPL", "AAPL"]
+    assert "AAPL" not in cache
+
+
+def test_without_a_cache_every_call_goes_upstream():
+    upstream = Upstream(single={"AAPL"})
+    for _ in range(2):
+        assert list(fetch_quotes(["AAPL"], upstream.fetch_batch, upstream.fetch_one, deadline())) == ["AAPL"]
+    assert upstream.single_calls == ["AAPL", "AAPL"]
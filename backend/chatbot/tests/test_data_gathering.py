@@ -0,0 +1,46 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import data_gathering
+from data_gathering import gather
+
+
+def test_collects_results_failures_and_misses():
+    def fail():
+        raise ValueError("upstream down")
+
+    results = gather({"value": (lambda x: x * 2, 21), "error": (fail,), "slow": (time.sleep, 1)},
+                     time.monotonic() + 0.2)
+    assert results == {"value": 42, "error": None, "slow": None}
+
+
+def test_nested_gather_does_not_wait_on_its_own_pool(monkeypatch):
+    # With one worker the outer task holds the only thread its inner lookups could use
+    monkeypatch.setattr(data_gathering, "_executor", ThreadPoolExecutor(1, thread_name_prefix="data-fetch"))
+    threads = []
+
+    def lookup(symbol):
+        threads.append(threading.current_thread().name)
+        return symbol.lower()
+
+    def prefetch(symbols):
+        nested = gather({symbol: (lookup, symbol) for symbol in symbols}, time.monotonic() + 2)
+        return gather({"again": (lookup, "KO")}, time.monotonic() + 2) | nested
+
+    results = gather({"quotes": (prefetch, ["AAPL", "MSFT"])}, time.monotonic() + 2)
+    assert results == {"quotes": {"again": "ko", "AAPL": "aapl", "MSFT": "msft"}}
+    assert all(name.startswith("data-fetch-inner") for name in threads)
+
+
+def test_third_level_runs_inline():
+    def innermost():
+        return threading.current_thread().name
+
+    def middle():
+        return gather({"name": (innermost,)}, time.monotonic() + 2)["name"]
+
+    def outer():
+        return gather({"name": (middle,)}, time.monotonic() + 2)["name"]
+
+    assert gather({"name": (outer,)}, time.monotonic() + 2)["name"].startswith("data-fetch-inner")
@@ -0,0 +1,184 @@
+import json
+from concurrent.futures import Future
+
+import pytest
+from fastapi.testclient import TestClient
+
+from inference import ModelUnavailableError, QueueFullError
+
+
+@pytest.fixture
+def client(app_module, scheduler):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def asgi_client(app_module, scheduler):
+    import asgi_app
+
+    with TestClient(asgi_app.asgi_app) as test_client:
+        yield test_client
+
+
+def reject(prompt, **params):
+    raise QueueFullError("The model is busy, please retry shortly.")
+
+
+def unavailable(prompt, **params):
+    raise ModelUnavailableError("The language model could not be loaded.")
+
+
+def never_answer(prompt, **params):
+    return Future()
+
+
+def test_chat_requires_a_message(client):
+    assert client.post("/chat", json={}).status_code == 400
+    response = client.post("/chat", json={"message": "hi", "symbols": ["$$$"]})
+    assert response.status_code == 400
+    assert "Invalid ticker symbol" in response.get_json()["error"]
+
+
+def test_chat_answers_with_market_data(client, scheduler):
+    response = client.post("/chat", json={"message": "What is the price of AAPL?"})
+    assert response.status_code == 200
+    assert response.get_json() == {"response": "ok"}
+    assert response.headers["X-Request-ID"]
+    prompt = scheduler.prompts[0]
+    assert "What is the price of AAPL?" in prompt
+    assert "227.52" in prompt
+    assert scheduler.params[0]["max_tokens"] > 0
+
+
+def test_chat_serves_repeats_from_the_response_cache(client, scheduler):
+    for _ in range(2):
+        assert client.post("/chat", json={"message": "How is MSFT doing?"}).get_json() == {"response": "ok"}
+    assert len(scheduler.prompts) == 1
+    client.post("/chat", json={"message": "How is MSFT doing?"}, headers={"Cache-Control": "no-cache"})
+    assert len(scheduler.prompts) == 2
+
+
+def test_chat_compares_symbols(client, scheduler):
+    response = client.post("/chat", json={"message": "Compare them", "symbols": ["AAPL", "MSFT"]})
+    assert response.status_code == 200
+    assert "AAPL" in scheduler.prompts[0] and "MSFT" in scheduler.prompts[0]
+
+
+def test_chat_full_queue_is_a_503(client, scheduler, monkeypatch):
+    monkeypatch.setattr(scheduler, "submit", reject)
+    response = client.post("/chat", json={"message": "What is the price of NVDA?", "cache": False})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+
+
+def test_chat_model_unavailable_at_submit(client, app_module, scheduler, monkeypatch):
+    monkeypatch.setattr(scheduler, "submit", unavailable)
+    response = client.post("/chat", json={"message": "What is the price of NVDA?", "cache": False})
+    assert response.status_code == 200
+    assert response.get_json() == {"response": app_module.MODEL_UNAVAILABLE_MESSAGE}
+
+
+def test_chat_gives_up_on_a_lost_completion(client, app_module, scheduler, monkeypatch):
+    monkeypatch.setattr(scheduler, "submit", never_answer)
+    monkeypatch.setattr(app_module, "GENERATION_TIMEOUT", 0.05)
+    response = client.post("/chat", json={"message": "What is the price of NVDA?", "cache": False})
+    assert response.status_code == 200
+    assert response.get_json() == {"response": app_module.GENERATION_ERROR_MESSAGE}
+
+
+def test_chat_batch_streams_one_line_per_query(client, scheduler):
+    body = "\n".join(json.dumps(query) for query in [
+        {"id": "a", "message": "What is the price of AAPL?"},
+        {"id": "b", "message": "What is the price of AAPL?"},
+        {"id": "c", "message": "How is KO doing?"},
+    ])
+    response = client.post("/chat/batch", data=body, content_type="application/x-ndjson")
+    assert response.status_code == 200
+    results = {result["id"]: result for result in map(json.loads, response.get_data(as_text=True).splitlines())}
+    assert results == {"a": {"id": "a", "response": "ok"}, "b": {"id": "b", "response": "ok"},
+                       "c": {"id": "c", "response": "ok"}}
+    # Identical queries share one generation
+    assert len(scheduler.prompts) == 2
+
+
+def test_chat_batch_builds_prompts_from_the_prefetched_quotes(client, app_module, scheduler, mock_api, monkeypatch):
+    # Quotes expire as soon as they are cached, as they would in a batch outlasting the quote TTL
+    monkeypatch.setattr(app_module.quote_cache, "ttl", 0)
+    monkeypatch.setattr(app_module.quote_cache, "stale_ttl", 0)
+    app_module.quote_cache.clear()
+    body = "\n".join(json.dumps({"id": symbol, "message": f"What is the price of {symbol}?", "cache": False})
+                     for symbol in ["AAPL", "MSFT", "KO"])
+    before = mock_api.requests.get("quote", 0) + mock_api.requests.get("quotes", 0)
+    response = client.post("/chat/batch", data=body, content_type="application/x-ndjson")
+    assert len(response.get_data(as_text=True).splitlines()) == 3
+    assert mock_api.requests.get("quote", 0) + mock_api.requests.get("quotes", 0) == before + 1
+    assert any("227.52" in prompt for prompt in scheduler.prompts)
+
+
+def test_chat_batch_reports_an_unavailable_model_per_query(client, scheduler, monkeypatch):
+    monkeypatch.setattr(scheduler, "submit", unavailable)
+    body = "\n".join(json.dumps({"id": index, "message": "How is KO doing?", "cache": False}) for index in range(2))
+    response = client.post("/chat/batch", data=body, content_type="application/x-ndjson")
+    results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert sorted(result["id"] for result in results) == [0, 1]
+    assert all("could not be loaded" in result["error"] for result in results)
+
+
+def test_chat_batch_rejects_bad_input(client):
+    response = client.post("/chat/batch", data="not json", content_type="application/x-ndjson")
+    assert response.status_code == 400
+
+
+def test_health_ready_and_metrics(client):
+    health = client.get("/health").get_json()
+    assert health["status"] == "healthy"
+    assert set(health["caches"]) == {"quote", "esg", "response"}
+    assert client.get("/ready").status_code == 200
+    client.post("/chat", json={})
+    metrics = client.get("/metrics").get_data(as_text=True)
+    assert 'chat_requests_total{endpoint="/chat",status="400"}' in metrics
+
+
+def test_asgi_chat(asgi_client, scheduler):
+    assert asgi_client.post("/chat", json={}).status_code == 400
+    response = asgi_client.post("/chat", json={"message": "What is the price of AAPL?"})
+    assert response.status_code == 200
+    assert response.json() == {"response": "ok"}
+    assert "227.52" in scheduler.prompts[0]
+
+
+def test_asgi_chat_full_queue_is_a_503(asgi_client, scheduler, monkeypatch):
+    monkeypatch.setattr(scheduler, "submit", reject)
+    response = asgi_client.post("/chat", json={"message": "What is the price of NVDA?", "cache": False})
+    assert response.status_code == 503
+
+
+def test_asgi_chat_model_unavailable_at_submit(asgi_client, app_module, scheduler, monkeypatch):
+    monkeypatch.setattr(scheduler, "submit", unavailable)
+    response = asgi_client.post("/chat", json={"message": "What is the price of NVDA?", "cache": False})
+    assert response.status_code == 200
+    assert response.json() == {"response": app_module.MODEL_UNAVAILABLE_MESSAGE}
+
+
+def test_asgi_chat_gives_up_on_a_lost_completion(asgi_client, app_module, scheduler, monkeypatch):
+    monkeypatch.setattr(scheduler, "submit", never_answer)
+    monkeypatch.setattr(app_module, "GENERATION_TIMEOUT", 0.05)
+    response = asgi_client.post("/chat", json={"message": "What is the price of NVDA?", "cache": False})
+    assert response.status_code == 200
+    assert response.json() == {"response": app_module.GENERATION_ERROR_MESSAGE}
+
+
+def test_asgi_esg_data_is_stored(asgi_client, app_module):
+    import asgi_app
+    from esg_store import get_esg_store
+
+    get_esg_store()._cache.clear()
+    data = asgi_client.portal.call(asgi_app.get_esg_data, "MSFT")
+    assert data["totalEsg"]
+    assert get_esg_store().get("MSFT") == data
+
+
+def test_asgi_health_and_ready(asgi_client):
+    assert asgi_client.get("/health").json()["status"] == "healthy"
+    assert asgi_client.get("/ready").status_code == 200
+    assert "chat_requests_total" in asgi_client.get("/metrics").text
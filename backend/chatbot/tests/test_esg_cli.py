@@ -0,0 +1,84 @@
+import threading
+
+import pytest
+
+import esg
+from ticker_directory import TickerDirectory
+
+TICKERS = [
+    {"symbol": "AAPL", "name": "Apple Inc. Common Stock"},
+    {"symbol": "MSFT", "name": "Microsoft Corporation Common Stock"},
+]
+
+
+@pytest.fixture
+def release():
+    event = threading.Event()
+    yield event
+    event.set()
+
+
+def test_cli_resolves_company_names(monkeypatch):
+    directory = TickerDirectory(lambda max_pages: TICKERS)
+    directory.refresh()
+    monkeypatch.setattr(esg, "ticker_directory", directory)
+    assert esg.resolve_symbols("Compare Apple and Microsoft") == ["AAPL", "MSFT"]
+
+
+def test_cli_detects_tickers_while_the_directory_loads(monkeypatch, release):
+    def slow_listing(max_pages):
+        release.wait(5)
+        return TICKERS
+
+    monkeypatch.setattr(esg, "ticker_directory", TickerDirectory(slow_listing))
+    monkeypatch.setattr(esg, "DATA_GATHER_TIMEOUT", 0.05)
+    assert esg.resolve_symbols("Compare AAPL and Microsoft") == ["AAPL"]
+
+
+class FakeLlama:
+    """Counts a token per word and records the completion requests."""
+
+    def __init__(self):
+        self.calls = []
+
+    def tokenize(self, data, add_bos=True):
+        return data.split()
+
+    def __call__(self, prompt, max_tokens, **params):
+        self.calls.append((prompt, max_tokens))
+        return {"choices": [{"text": " ok "}]}
+
+
+class FakeManager:
+    def __init__(self, llama, n_ctx):
+        self.llama = llama
+        self.n_ctx = n_ctx
+
+    def get(self):
+        return self.llama
+
+
+class NoPrefixCache:
+    def restore(self, model, prompt_tokens):
+        return 0
+
+
+def test_cli_completion_never_overflows_the_context(monkeypatch):
+    listing = {"symbol": "AAPL", "name": "Apple Inc. Common Stock", "lastsale": "$227.52", "pctchange": "1.23%"}
+    monkeypatch.setattr(esg, "get_realtime_quote", lambda symbol: {})
+    monkeypatch.setattr(esg, "search_ticker_by_symbol", lambda symbol: listing)
+    monkeypatch.setattr(esg, "get_esg_data", lambda symbol: {})
+    monkeypatch.setattr(esg, "prefix_cache", NoPrefixCache())
+    llama = FakeLlama()
+
+    def answer(n_ctx):
+        monkeypatch.setattr(esg, "get_model_manager", lambda model_path: FakeManager(llama, n_ctx))
+        assert esg.chat_response("Tell me about the recent history of it", symbols=["AAPL"]) == "ok"
+        prompt, max_tokens = llama.calls[-1]
+        return len(llama.tokenize(prompt)), max_tokens
+
+    prompt_tokens, _ = answer(4096)
+    # Less room than MIN_COMPLETION_TOKENS is left after the prompt
+    n_ctx = prompt_tokens + 50
+    prompt_tokens, max_tokens = answer(n_ctx)
+    assert 0 < max_tokens and prompt_tokens + max_tokens <= n_ctx
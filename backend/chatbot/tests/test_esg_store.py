@@ -0,0 +1,50 @@
+from esg_store import ESGStore
+
+SCORES = {"symbol": "AAPL", "totalEsg": {"raw": 16.8, "fmt": "16.8"}}
+ERROR = {"message": "You are not subscribed to this API."}
+
+
+def open_store(tmp_path):
+    return ESGStore(path=str(tmp_path / "esg.sqlite3"), ttl=60, stale_ttl=60)
+
+
+def test_scores_persist_across_restarts(tmp_path):
+    store = open_store(tmp_path)
+    assert store.put("aapl", SCORES)
+    assert store.get("AAPL") == SCORES
+    assert open_store(tmp_path).get("AAPL") == SCORES
+
+
+def test_error_payloads_are_not_stored(tmp_path):
+    store = open_store(tmp_path)
+    assert not store.put("AAPL", ERROR)
+    assert not store.put("AAPL", {})
+    assert store.get("AAPL") is None
+    assert "AAPL" not in store
+
+
+def test_get_or_fetch_validates_before_storing(tmp_path):
+    store = open_store(tmp_path)
+    calls = []
+
+    def fetch(symbol):
+        calls.append(symbol)
+        return ERROR
+
+    assert store.get_or_fetch("AAPL", fetch) == {}
+    assert store.get_or_fetch("AAPL", fetch) == {}
+    assert calls == ["AAPL", "AAPL"]
+    assert open_store(tmp_path).get("AAPL") is None
+
+    assert store.get_or_fetch("AAPL", lambda symbol: SCORES) == SCORES
+    assert store.get_or_fetch("AAPL", fetch) == SCORES
+    assert open_store(tmp_path).get("AAPL") == SCORES
+
+
+def test_prewarm_skips_fresh_symbols(tmp_path):
+    store = open_store(tmp_path)
+    store.put("AAPL", SCORES)
+    fetched = []
+    assert store.prewarm(["AAPL", "MSFT"], lambda symbol: fetched.append(symbol) or dict(SCORES, symbol=symbol)) == 1
+    assert fetched == ["MSFT"]
+    assert "MSFT" in store
@@ -0,0 +1,61 @@
+import threading
+
+from inference import InferenceScheduler
+
+
+class FakeModel:
+    """Records the thread of every generation."""
+
+    input_ids = []
+    n_tokens = 0
+
+    def __init__(self):
+        self.threads = []
+
+    def tokenize(self, data, add_bos=True):
+        return list(data)
+
+    def reset(self):
+        pass
+
+    def eval(self, tokens):
+        self.threads.append(threading.current_thread().name)
+
+    def save_state(self):
+        return None
+
+    def load_state(self, state):
+        pass
+
+    def __call__(self, prompt, stream=False, **params):
+        self.threads.append(threading.current_thread().name)
+        return iter([{"choices": [{"text": "hi", "finish_reason": "length"}]}])
+
+
+class FakeManager:
+    n_ctx = 512
+
+    def __init__(self, model):
+        self.model = model
+
+    def get(self):
+        return self.model
+
+    def warmup(self):
+        raise AssertionError("The warmup generation must run on the inference worker")
+
+    def stats(self):
+        return {}
+
+
+def test_warmup_generation_runs_on_the_worker():
+    model = FakeModel()
+    scheduler = InferenceScheduler(FakeManager(model))
+    assert scheduler.warmup()
+    assert model.threads and set(model.threads) == {"inference-worker"}
+    assert scheduler.submit("What is the price of AAPL?", max_tokens=4).result(timeout=5)["choices"][0]["text"] == "hi"
+    assert scheduler.stats()["completed"] == 2
+
+
+def test_warmup_reports_a_missing_model():
+    assert not InferenceScheduler(FakeManager(None)).warmup()
@@ -0,0 +1,108 @@
+import time
+
+from market_data import CircuitBreaker, MarketDataClient, RateGovernor, RetryPolicy, TokenBucket
+
+
+def test_bucket_hands_out_burst_then_sheds():
+    bucket = TokenBucket(rate=1, burst=3)
+    assert [bucket.reserve(max_wait=0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.reserve(max_wait=0) is None
+    wait = bucket.reserve(max_wait=2)
+    assert 0 < wait <= 1
+
+
+def test_bucket_pause_delays_every_caller():
+    bucket = TokenBucket(rate=100, burst=10)
+    bucket.pause(0.5)
+    assert bucket.reserve(max_wait=0.1) is None
+    assert bucket.reserve(max_wait=1) > 0.3
+
+
+def test_breaker_opens_after_threshold_and_probes_after_timeout():
+    breaker = CircuitBreaker("host", failure_threshold=3, reset_timeout=0.05)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.rejecting
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Only one probe at a time
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens_the_circuit():
+    breaker = CircuitBreaker("host", failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_governor_feeds_statuses_into_the_breaker():
+    governor = RateGovernor(rate=100, burst=100)
+    governor.for_host("api").breaker.failure_threshold = 2
+    governor.record("api", 500)
+    governor.record("api", 200)
+    governor.record("api", 500)
+    assert governor.available("api")
+    governor.record("api", None)
+    assert not governor.available("api")
+    assert governor.admit("api", "test", max_wait=0) is None
+
+
+def test_open_circuit_does_not_use_the_rate_budget():
+    governor = RateGovernor(rate=0.001, burst=2)
+    breaker = governor.for_host("api").breaker
+    breaker.reset_timeout = 0.05
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    for _ in range(5):
+        assert governor.admit("api", "test", max_wait=0) is None
+    assert governor.for_host("api").bucket.tokens > 1.99
+
+    # A probe that finds the rate budget exhausted is handed back for the next request
+    time.sleep(0.06)
+    governor.for_host("api").bucket.pause(5)
+    assert governor.admit("api", "test", max_wait=0) is None
+    assert governor.available("api")
+    assert breaker.allow()
+
+
+def test_governor_pauses_host_on_rate_limit():
+    governor = RateGovernor(rate=100, burst=100)
+    governor.record("api", 429, retry_after=5)
+    assert governor.admit("api", "test", max_wait=1) is None
+    assert governor.admit("other", "test", max_wait=1) == 0.0
+
+
+def test_host_rate_overrides():
+    governor = RateGovernor(rate=5, burst=10, host_rates="slow.example=1, fast.example=50")
+    assert governor.for_host("slow.example").bucket.rate == 1
+    assert governor.for_host("fast.example").bucket.rate == 50
+    assert governor.for_host("other.example").bucket.rate == 5
+
+
+def test_client_fails_fast_while_circuit_is_open(mock_api):
+    governor = RateGovernor(rate=100, burst=100)
+    client = MarketDataClient(governor=governor, retry_policy=RetryPolicy(max_retries=1, retry_delay=0))
+    url = f"{mock_api.base_url}/api/v1/markets/quote"
+    assert client.get_json(url, params={"ticker": "AAPL"})["body"]["symbol"] == "AAPL"
+
+    host = url.split("/")[2]
+    breaker = governor.for_host(host).breaker
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    before = dict(mock_api.requests)
+    assert client.get_json(url, params={"ticker": "AAPL"}) is None
+    assert mock_api.requests == before
+    assert client.headroom(url) == 0
@@ -0,0 +1,64 @@
+import time
+
+from cache import TTLCache
+from market_refresher import MarketRefresher, Watchlist
+
+
+class FakeStore:
+    def __init__(self):
+        self.scores = {}
+
+    def __contains__(self, symbol):
+        return symbol in self.scores
+
+    def put(self, symbol, data):
+        self.scores[symbol] = data
+        return True
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_watchlist_ranks_pinned_then_most_asked():
+    watchlist = Watchlist(size=3, pinned=["SPY"])
+    watchlist.record(["AAPL", "MSFT", "KO"])
+    watchlist.record(["MSFT", "AAPL"])
+    watchlist.record(["MSFT"])
+    assert watchlist.symbols() == ["SPY", "MSFT", "AAPL"]
+
+
+def test_watchlist_drops_symbols_that_decayed():
+    watchlist = Watchlist(size=5, pinned=[], half_life=0.05, min_score=0.1)
+    watchlist.record(["AAPL"])
+    assert watchlist.symbols() == ["AAPL"]
+    time.sleep(0.25)  # five half-lives, the mention now counts 1/32
+    watchlist.record(["KO"])
+    assert watchlist.symbols() == ["KO"]
+
+
+def test_refresher_idles_while_the_watchlist_is_empty():
+    watchlist = Watchlist(size=5, pinned=[], half_life=3600)
+    fetched = []
+
+    def fetch_quotes(symbols):
+        fetched.append(list(symbols))
+        return {symbol: {"body": {"symbol": symbol}} for symbol in symbols}
+
+    store = FakeStore()
+    cache = TTLCache(maxsize=10, ttl=5, name="quote")
+    refresher = MarketRefresher(watchlist, fetch_quotes, cache, lambda symbol: {"totalEsg": {"raw": 1}},
+                                lambda: store, quote_interval=0.02)
+    refresher.start()
+    assert wait_for(lambda: not refresher.stats()["running"])
+    assert fetched == []
+
+    watchlist.record(["AAPL"])
+    refresher.start()
+    assert wait_for(lambda: cache.get("AAPL") is not None)
+    assert wait_for(lambda: "AAPL" in store)
+    refresher.stop()
+    assert wait_for(lambda: not refresher.stats()["running"])
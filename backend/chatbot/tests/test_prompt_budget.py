@@ -0,0 +1,73 @@
+from prompt_budget import MAX_TOKENS_BY_CLASS, PROMPT_SAFETY_TOKENS, TRIM_ORDER, TokenCounter, classify_query, \
+    plan_prompt
+
+
+def levels(*sizes):
+    """A render_summary whose level ``n`` is ``sizes[n]`` characters long, None past the last size."""
+    return lambda level: "x" * sizes[level] if level < len(sizes) else None
+
+
+def test_classify_query():
+    assert classify_query("Compare AAPL and MSFT", ["AAPL", "MSFT"]) == "comparison"
+    assert classify_query("Should I buy AAPL?", ["AAPL"]) == "investment"
+    assert classify_query("What is the price of AAPL?", ["AAPL"]) == "factual"
+    assert classify_query("Tell me about the recent history of Apple's services business", ["AAPL"]) == "general"
+
+
+def test_untrimmed_prompt_when_it_fits():
+    counter = TokenCounter()
+    plan = plan_prompt("What is the price of AAPL?", levels(300, 100), "factual", counter, 2048)
+    assert plan.trimmed == []
+    assert plan.max_tokens == MAX_TOKENS_BY_CLASS["factual"]
+    assert "x" * 300 in plan.text
+    assert plan.prompt_tokens + plan.max_tokens + PROMPT_SAFETY_TOKENS <= 2048
+
+
+def test_trims_fields_in_order_until_it_fits():
+    counter = TokenCounter()
+    budget = MAX_TOKENS_BY_CLASS["general"]
+    base = plan_prompt("Tell me about it", levels(0), "general", counter, 4096).prompt_tokens
+    context = base + budget + PROMPT_SAFETY_TOKENS + 100
+    plan = plan_prompt("Tell me about it", levels(3000, 2000, 1000, 150, 30), "general", counter, context)
+    assert plan.trimmed == TRIM_ORDER[:3]
+    assert "x" * 150 in plan.text and "x" * 151 not in plan.text
+    assert plan.max_tokens == budget
+    assert plan.prompt_tokens + plan.max_tokens + PROMPT_SAFETY_TOKENS <= context
+
+
+def test_rows_dropped_past_the_field_levels():
+    counter = TokenCounter()
+    sizes = [3000] * (len(TRIM_ORDER) + 1) + [30]
+    plan = plan_prompt("Compare them", levels(*sizes), "comparison", counter, 1024)
+    assert plan.trimmed == TRIM_ORDER + ["rows"]
+
+
+def test_completion_shrinks_when_nothing_is_left_to_trim():
+    counter = TokenCounter()
+    plan = plan_prompt("Tell me about it", levels(1500), "general", counter, 1024)
+    assert plan.trimmed == []
+    assert plan.max_tokens < MAX_TOKENS_BY_CLASS["general"]
+    assert plan.generation_params({"temperature": 0.7}) == {"temperature": 0.7, "max_tokens": plan.max_tokens}
+
+
+def test_completion_never_exceeds_the_remaining_room():
+    counter = TokenCounter()
+    base = plan_prompt("Tell me about it", levels(0), "general", counter, 4096).prompt_tokens
+    context = base + PROMPT_SAFETY_TOKENS + 40
+    plan = plan_prompt("Tell me about it", levels(0), "general", counter, context)
+    assert plan.max_tokens == 40
+    assert plan.prompt_tokens + plan.max_tokens + PROMPT_SAFETY_TOKENS <= context
+
+
+def test_static_prefix_counted_once():
+    calls = []
+
+    def tokenize(data, add_bos=False):
+        calls.append(data)
+        return data.split()
+
+    counter = TokenCounter(tokenize)
+    assert counter.exact
+    assert counter.count_static("one two three") == 3
+    assert counter.count_static("one two three") == 3
+    assert len(calls) == 1
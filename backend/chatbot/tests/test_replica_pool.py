@@ -0,0 +1,125 @@
+import json
+import logging
+import queue
+import time
+
+import pytest
+
+import replica_pool
+from inference import ModelUnavailableError
+from logging_config import JsonFormatter, ReplicaFilter
+from replica_pool import ReplicaPool, _Replica
+
+
+class FakeProcess:
+    """Stands in for a replica process, which the test can kill."""
+
+    def __init__(self):
+        self.alive = True
+        self.exitcode = None
+
+    def is_alive(self):
+        return self.alive
+
+    def kill(self):
+        self.exitcode = -9
+        self.alive = False
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(replica_pool, "REPLICA_POLL_INTERVAL", 0.01)
+    pool = ReplicaPool("model.gguf", replicas=2, threads_per_replica=1, pin_cores=False)
+    pool.spawned = []
+
+    def spawn(index, restarts=0):
+        replica = _Replica(index, FakeProcess(), queue.Queue(), queue.Queue(), None, None, 1, restarts)
+        replica.results.put((None, "ready", {"index": index, "load_seconds": 0.0}))
+        pool.spawned.append(replica)
+        return replica
+
+    monkeypatch.setattr(pool, "_spawn", spawn)
+    pool.start()
+    assert pool.warmup(timeout=5)
+    return pool
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_jobs_complete_through_the_results_queue(pool):
+    future = pool.submit("prompt", max_tokens=8)
+    replica = next(r for r in pool.spawned if not r.jobs.empty())
+    job_id, prompt, params, stream = replica.jobs.get()
+    assert (prompt, params, stream) == ("prompt", {"max_tokens": 8}, False)
+    replica.results.put((job_id, "started", 3))
+    timings = {"prompt_eval_seconds": 0.01, "generation_seconds": 0.02, "completion_tokens": 1}
+    replica.results.put((job_id, "result", ({"choices": [{"text": "ok"}]}, timings)))
+    assert future.result(timeout=5) == {"choices": [{"text": "ok"}]}
+
+
+def test_dead_replica_fails_its_jobs_and_is_respawned(pool):
+    futures = [pool.submit("prompt") for _ in range(4)]
+    dead = pool.spawned[0]
+    dead.process.kill()
+
+    failed = [future for future in futures[::2]]
+    for future in failed:
+        with pytest.raises(RuntimeError, match="exited"):
+            future.result(timeout=5)
+    assert not any(future.done() for future in futures[1::2])
+
+    wait_for(lambda: len(pool.spawned) == 3)
+    respawned = pool.spawned[2]
+    assert respawned.index == 0 and respawned.restarts == 1
+    wait_for(lambda: pool.stats()["replicas"][0]["ready"])
+    assert pool.stats()["replicas"][0]["restarts"] == 1
+    assert pool.stats()["in_flight"] == 2
+
+
+def test_replica_is_not_respawned_forever(pool, monkeypatch):
+    monkeypatch.setattr(replica_pool, "REPLICA_MAX_RESTARTS", 1)
+    pool.spawned[0].process.kill()
+    wait_for(lambda: len(pool.spawned) == 3)
+    pool.spawned[2].process.kill()
+    pool.spawned[1].process.kill()
+    wait_for(lambda: len(pool.spawned) == 4)
+    time.sleep(0.05)
+    pool.spawned[3].process.kill()
+    time.sleep(0.1)
+    assert len(pool.spawned) == 4
+    with pytest.raises(ModelUnavailableError):
+        pool.submit("prompt")
+
+
+def test_failed_load_fails_pending_jobs(monkeypatch):
+    monkeypatch.setattr(replica_pool, "REPLICA_POLL_INTERVAL", 0.01)
+    pool = ReplicaPool("model.gguf", replicas=1, threads_per_replica=1, pin_cores=False)
+    results = queue.Queue()
+    replica = _Replica(0, FakeProcess(), queue.Queue(), results, None, None, 1)
+    monkeypatch.setattr(pool, "_spawn", lambda index, restarts=0: replica)
+    future = pool.submit("prompt")
+    results.put((None, "failed", 0))
+    with pytest.raises(ModelUnavailableError):
+        future.result(timeout=5)
+    assert not pool.warmup(timeout=5)
+    with pytest.raises(ModelUnavailableError):
+        pool.submit("prompt")
+
+
+def test_replica_logs_through_the_shared_configuration(monkeypatch):
+    configured = []
+    monkeypatch.setattr(replica_pool, "configure_logging", lambda **kwargs: configured.append(kwargs))
+    monkeypatch.setattr(replica_pool, "initialize_llama", lambda *args, **kwargs: None)
+    results = queue.Queue()
+    replica_pool._replica_main(1, "model.gguf", 1, None, queue.Queue(), results, None)
+    assert configured == [{"replica": 1}]
+    assert results.get_nowait() == (None, "failed", 1)
+
+    record = logging.LogRecord("replica_pool", logging.INFO, "", 0, "loaded", (), None)
+    ReplicaFilter(1).filter(record)
+    assert json.loads(JsonFormatter().format(record))["replica"] == 1
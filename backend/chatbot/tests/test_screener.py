@@ -0,0 +1,112 @@
+import pytest
+
+from screener import MarketScreener, parse_screen
+from ticker_snapshot import TickerSnapshot
+
+
+class Directory:
+    def __init__(self, tickers):
+        self.snapshot = TickerSnapshot.from_tickers(tickers, created_at=1)
+
+
+def listing(symbol, price, change_pct, market_cap):
+    return {"symbol": symbol, "name": f"{symbol} Inc. Common Stock", "lastsale": f"${price}",
+            "netchange": "0.00", "pctchange": f"{change_pct}%", "marketCap": f"{market_cap:,}"}
+
+
+TICKERS = [
+    listing("AAA", 10, 5.0, 10_000_000_000),
+    listing("BBB", 20, -3.0, 50_000_000_000),
+    listing("CCC", 30, 9.0, 100_000_000),  # below the minimum market cap for change screens
+    listing("DDD", 40, 1.0, 900_000_000_000),
+    listing("EEE", 50, -7.0, 2_000_000_000),
+]
+
+
+def quote(sector, change_pct):
+    return {"body": {"sector": sector, "regularMarketChangePercent": change_pct}}
+
+
+def test_parse_screen():
+    screen = parse_screen("What are the top 3 gainers in tech today?")
+    assert (screen.order_by, screen.descending, screen.limit, screen.sector) == ("change_pct", True, 3, "Technology")
+    assert screen.min_market_cap
+
+    screen = parse_screen("Best ESG stocks in energy")
+    assert (screen.order_by, screen.descending, screen.sector, screen.min_market_cap) == ("esg", False, "Energy", None)
+
+    screen = parse_screen("Which stocks should I compare against?")
+    assert (screen.order_by, screen.descending) == ("market_cap", True)
+
+    assert parse_screen("top 50 losers").limit == 10
+    assert parse_screen("Tell me a joke") is None
+
+
+@pytest.mark.parametrize("message", [
+    "Why are interest rates rising?",
+    "How does ESG compare against governance ratings?",
+    "Which is the largest ocean?",
+    "How do stock revs work?",
+    "Will the uprising hit shares?",
+    "Are these stocks a good investment?",
+])
+def test_parse_screen_ignores_other_questions(message):
+    assert parse_screen(message) is None
+
+
+def test_parse_screen_matches_whole_words():
+    assert parse_screen("Semiconductor stocks vs the market").order_by == "market_cap"
+    assert parse_screen("Which tech companies are the biggest gainers?").order_by == "change_pct"
+
+
+def test_change_screen_ranks_and_filters():
+    screener = MarketScreener(Directory(TICKERS))
+    assert screener.run(parse_screen("top gainers")) == (["AAA", "DDD", "BBB", "EEE"], 4)
+    assert screener.run(parse_screen("biggest losers")) == (["EEE", "BBB", "DDD", "AAA"], 4)
+    assert screener.run(parse_screen("top 2 gainers")) == (["AAA", "DDD"], 4)
+    assert screener.run(parse_screen("small cap gainers"))[0][0] == "CCC"
+
+
+def test_quotes_update_the_columns():
+    screener = MarketScreener(Directory(TICKERS))
+    screener.run(parse_screen("top gainers"))
+    screener.update_quote("eee", quote("Technology", 12.0))
+    screener.update_quote("BBB", quote("Technology", 2.0))
+    screener.update_quote("AAA", quote("Energy", 3.0))
+    assert screener.run(parse_screen("top gainers"))[0][0] == "EEE"
+    assert screener.run(parse_screen("top tech gainers")) == (["EEE", "BBB"], 2)
+    assert screener.run(parse_screen("top healthcare gainers")) == ([], 0)
+
+
+def test_esg_screen_only_sees_scored_symbols():
+    scores = {"AAA": 30.0, "DDD": 12.5, "EEE": 21.0}
+    screener = MarketScreener(Directory(TICKERS))
+    for symbol, score in scores.items():
+        screener.update_esg(symbol, {"totalEsg": {"raw": score}})
+    assert screener.run(parse_screen("best ESG stocks")) == (["DDD", "EEE", "AAA"], 3)
+    assert screener.run(parse_screen("worst ESG stocks")) == (["AAA", "EEE", "DDD"], 3)
+
+
+def test_columns_rebuilt_for_a_new_snapshot():
+    directory = Directory(TICKERS)
+    screener = MarketScreener(directory)
+    screener.update_quote("AAA", quote("Energy", 1.0))
+    screener.run(parse_screen("top gainers"))
+    directory.snapshot = TickerSnapshot.from_tickers(TICKERS + [listing("FFF", 5, 50.0, 1_000_000_000)], created_at=2)
+    symbols, candidates = screener.run(parse_screen("top gainers"))
+    assert symbols[0] == "FFF"
+    assert candidates == 5
+    assert screener.run(parse_screen("energy gainers")) == (["AAA"], 1)
+
+
+def test_market_data_shape():
+    screener = MarketScreener(Directory(TICKERS))
+    screener.update_esg("DDD", {"totalEsg": {"raw": 12.5}})
+    heading, market_data = screener.market_data(parse_screen("top 2 largest companies"))
+    assert heading.startswith("Top 2 stocks by market cap")
+    assert list(market_data) == ["DDD", "BBB"]
+    combined, esg = market_data["DDD"]
+    assert combined["price"] == "40.00"
+    assert combined["market_cap"] == 900_000_000_000
+    assert esg == {"totalEsg": {"raw": 12.5}}
+    assert market_data["BBB"][1] is None
@@ -0,0 +1,73 @@
+import pytest
+
+from symbol_resolver import SymbolResolver, name_aliases
+
+TICKERS = [
+    {"symbol": "AAPL", "name": "Apple Inc. Common Stock"},
+    {"symbol": "MSFT", "name": "Microsoft Corporation Common Stock"},
+    {"symbol": "XOM", "name": "Exxon Mobil Corporation Common Stock"},
+    {"symbol": "KO", "name": "Coca-Cola Company (The) Common Stock"},
+    {"symbol": "BBY", "name": "Best Buy Co., Inc. Common Stock"},
+    {"symbol": "TOP", "name": "TOP Financial Group Limited Ordinary Shares"},
+    {"symbol": "SHOW", "name": "Show Holdings Inc. Common Stock"},
+    {"symbol": "GOOD", "name": "Gladstone Commercial Corporation Common Stock"},
+    {"symbol": "GLAD", "name": "Gladstone Capital Corporation Common Stock"},
+    {"symbol": "GAIN", "name": "Gladstone Investment Corporation Common Stock"},
+    {"symbol": "F", "name": "Ford Motor Company Common Stock"},
+    {"symbol": "TSLA", "name": "Tesla, Inc. Common Stock"},
+    {"symbol": "CEO", "name": "CEO Corp Common Stock"},
+]
+
+
+@pytest.fixture(scope="module")
+def resolver():
+    return SymbolResolver.from_tickers(TICKERS)
+
+
+def test_name_aliases():
+    assert name_aliases("Apple Inc. Common Stock") == ["apple"]
+    assert name_aliases("Coca-Cola Company (The) Common Stock") == ["coca-cola", "coca cola"]
+    assert name_aliases("TOP Financial Group Limited Ordinary Shares") == ["top financial"]
+
+
+@pytest.mark.parametrize("query", [
+    "Show me the top gainers",
+    "Top ESG stocks in energy",
+    "Should I invest in Gladstone?",
+    "Best ESG names in tech",
+])
+def test_sentence_openers_are_not_tickers(resolver, query):
+    assert resolver.resolve(query) == []
+
+
+@pytest.mark.parametrize("query, symbols", [
+    ("Compare Apple and Microsoft", ["AAPL", "MSFT"]),
+    ("How does AAPL compare with Coca Cola?", ["AAPL", "KO"]),
+    ("Is Exxon a buy?", ["XOM"]),
+    ("Exxon Mobil or Best Buy?", ["XOM", "BBY"]),
+    ("What about TOP Financial? And $F too.", ["TOP", "F"]),
+    ("Should I invest in Gladstone Commercial?", ["GOOD"]),
+    ("I like apple pie and F1", []),
+])
+def test_symbols_and_names(resolver, query, symbols):
+    assert resolver.resolve(query) == symbols
+
+
+@pytest.mark.parametrize("query, symbols", [
+    ("Tesla vs Apple", ["TSLA", "AAPL"]),
+    ("Microsoft or Tesla?", ["MSFT", "TSLA"]),
+    ("Apple stock: good buy?", ["AAPL"]),
+    ("Ford earnings", ["F"]),
+    ("Earnings are out. Microsoft beat, how did Apple do?", ["MSFT", "AAPL"]),
+])
+def test_names_opening_a_sentence(resolver, query, symbols):
+    assert resolver.resolve(query) == symbols
+
+
+def test_common_uppercase_words_are_not_names(resolver):
+    assert resolver.resolve("What's the ESG score of the CEO of Apple?") == ["AAPL"]
+    assert resolver.resolve("CEO pay at Tesla") == ["TSLA"]
+
+
+def test_limit(resolver):
+    assert resolver.resolve("AAPL, MSFT and XOM", limit=2) == ["AAPL", "MSFT"]
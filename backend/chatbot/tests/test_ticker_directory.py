@@ -0,0 +1,39 @@
+import ticker_directory
+from ticker_directory import TickerDirectory
+
+
+def listing(count):
+    return [{"symbol": f"S{index:04d}", "name": f"Company {index} Inc. Common Stock"} for index in range(count)]
+
+
+def test_refresh_keeps_the_index_when_the_listing_shrinks():
+    pages = [listing(100), listing(30), [], listing(80)]
+    directory = TickerDirectory(lambda max_pages: pages.pop(0))
+    assert directory.refresh() == 100
+    assert directory.refresh() == 100  # Truncated
+    assert directory.refresh() == 100  # Empty
+    assert directory.refresh() == 80
+    assert directory.get("S0099") is None
+
+
+def test_first_load_retried_on_a_short_backoff(monkeypatch):
+    monkeypatch.setattr(ticker_directory, "TICKER_RETRY_DELAY", 0.01)
+    calls = []
+
+    def flaky(max_pages):
+        calls.append(max_pages)
+        return listing(10) if len(calls) >= 3 else []
+
+    directory = TickerDirectory(flaky, refresh_interval=3600)
+    directory.start()
+    try:
+        assert directory.wait_until_loaded(5)
+        assert len(calls) == 3
+    finally:
+        directory.stop()
+
+
+def test_listing_abandoned_on_a_failed_page(app_module, monkeypatch):
+    responses = [{"body": listing(100)}, None, {"body": listing(100)}, {"body": []}]
+    monkeypatch.setattr(app_module.market_data_client, "get_json", lambda url, **kwargs: responses.pop(0))
+    assert app_module.get_all_ticker_pages(max_pages=5) == []
@@ -0,0 +1,71 @@
+import math
+
+import pytest
+
+from ticker_snapshot import TickerSnapshot, parse_number
+
+TICKERS = [
+    {"symbol": "MSFT", "name": "Microsoft Corporation Common Stock", "lastsale": "$415.10", "netchange": "-1.74",
+     "pctchange": "-0.420%", "marketCap": "3,090,000,000,000"},
+    {"symbol": "AAPL", "name": "Apple Inc. Common Stock", "lastsale": "$227.52", "netchange": "2.80",
+     "pctchange": "1.230%", "marketCap": "3,460,000,000,000"},
+    {"symbol": "APLE", "name": "Apple Hospitality REIT, Inc. Common Stock", "lastsale": "$0.5",
+     "netchange": "0.01", "pctchange": "0.100%", "marketCap": ""},
+    {"symbol": "", "name": "No symbol"},
+]
+
+
+def test_parse_number():
+    assert parse_number("$227.52") == 227.52
+    assert parse_number("1.230%") == 1.23
+    assert parse_number("3,460,000,000") == 3.46e9
+    assert math.isnan(parse_number(""))
+    assert math.isnan(parse_number(None))
+
+
+def test_records_keep_the_listing_formats():
+    snapshot = TickerSnapshot.from_tickers(TICKERS, created_at=1)
+    assert len(snapshot) == 3
+    assert snapshot.get("aapl") == TICKERS[1]
+    assert snapshot.get("MSFT") == TICKERS[0]
+    assert snapshot.get("APLE")["marketCap"] == "N/A"
+    assert snapshot.get("APLE")["lastsale"] == "$0.5000"
+    assert snapshot.get("NOPE") is None
+    assert snapshot.get("TOOLONGSYMBOL") is None
+
+
+def test_search_name_is_a_case_insensitive_prefix_match():
+    snapshot = TickerSnapshot.from_tickers(TICKERS, created_at=1)
+    assert [snapshot.symbol(row) for row in snapshot.search_name("apple")] == ["APLE", "AAPL"]
+    assert [snapshot.symbol(row) for row in snapshot.search_name("Apple I")] == ["AAPL"]
+    assert [snapshot.symbol(row) for row in snapshot.search_name("apple", limit=1)] == ["APLE"]
+    assert snapshot.search_name("zebra") == []
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = str(tmp_path / "ticker_snapshot.bin")
+    snapshot = TickerSnapshot.from_tickers(TICKERS, created_at=123.5)
+    snapshot.save(path)
+    loaded = TickerSnapshot.load(path)
+
+    assert loaded.created_at == 123.5
+    assert len(loaded) == len(snapshot)
+    assert list(loaded.names()) == list(snapshot.names())
+    for symbol, _ in snapshot.names():
+        assert loaded.get(symbol) == snapshot.get(symbol)
+    assert [loaded.symbol(row) for row in loaded.search_name("apple")] == ["APLE", "AAPL"]
+    assert not loaded.price.flags.writeable
+
+
+def test_load_rejects_other_files(tmp_path):
+    path = tmp_path / "not_a_snapshot.bin"
+    path.write_bytes(b"something else entirely")
+    with pytest.raises(ValueError):
+        TickerSnapshot.load(str(path))
+
+
+def test_empty_listing():
+    snapshot = TickerSnapshot.from_tickers([], created_at=0)
+    assert len(snapshot) == 0
+    assert snapshot.get("AAPL") is None
+    assert snapshot.search_name("a") == []
@@ -0,0 +1,226 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from comparison import MAX_QUERY_SYMBOLS
+from symbol_resolver import SymbolResolver
+from ticker_snapshot import EMPTY_SNAPSHOT, TickerSnapshot
+
+try:
+    import fcntl
+except ImportError:  # Windows, every process refreshes on its own
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+TICKER_SNAPSHOT_POLL = int(os.environ.get("TICKER_SNAPSHOT_POLL", "60"))  # seconds
+TICKER_MIN_LISTING_RATIO = float(os.environ.get("TICKER_MIN_LISTING_RATIO", "0.5"))  # of the current listing a reload must reach
+TICKER_RETRY_DELAY = 5.0  # seconds before retrying a failed first load, doubled after each failure
+
+
+@contextmanager
+def _snapshot_writer(snapshot_path):
+    """Yield True if this process should fetch the listing, False if another process is already writing the snapshot."""
+    if not snapshot_path or fcntl is None:
+        yield True
+        return
+    with open(snapshot_path + ".lock", "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+
+class TickerDirectory:
+    """
+    Index of the full tickers listing.
+
+    The listing is kept as a columnar TickerSnapshot, and a SymbolResolver
+    finds the symbols and company names mentioned in a message. With a
+    ``snapshot_path`` the snapshot is written to disk after every reload and
+    mapped read-only, so worker processes on one host share a single copy: a
+    worker starts from the file left by another, picks up newer files as
+    they appear and only fetches the listing itself once the file is older
+    than ``refresh_interval``. A daemon thread does this in the background,
+    so lookups never touch the network.
+    """
+
+    def __init__(self, fetch_pages, refresh_interval=3600, max_pages=200, snapshot_path=None,
+                 poll_interval=TICKER_SNAPSHOT_POLL):
+        """
+        Args:
+            fetch_pages: Callable taking ``max_pages`` and returning a list of ticker dicts
+            refresh_interval: Seconds between background reloads
+            max_pages: Upper bound on pages requested per reload
+            snapshot_path: File shared with other processes, or None to keep the snapshot in memory
+            poll_interval: Seconds between checks for a newer snapshot file
+        """
+        self._fetch_pages = fetch_pages
+        self.refresh_interval = refresh_interval
+        self.max_pages = max_pages
+        self.snapshot_path = snapshot_path or None
+        self.poll_interval = poll_interval
+
+        self._snapshot = EMPTY_SNAPSHOT
+        self._snapshot_mtime = None
+        self._resolver = SymbolResolver(())
+        self._refresh_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._loaded = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_refresh = None
+
+    def start(self):
+        """Start the background refresh thread if it is not already running."""
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="ticker-directory", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the background refresh thread."""
+        self._stop.set()
+
+    def _run(self):
+        retry_delay = TICKER_RETRY_DELAY
+        while not self._stop.is_set():
+            try:
+                self.load_snapshot()
+                if self.last_refresh is None or time.time() - self.last_refresh >= self.refresh_interval:
+                    with _snapshot_writer(self.snapshot_path) as writer:
+                        if writer:
+                            self.refresh()
+            except Exception as e:
+                logger.exception("Ticker directory refresh failed: %s", e)
+            if not self._loaded.is_set():
+                # Lookups wait on the first listing, so retry soon rather than after a full interval
+                self._stop.wait(min(retry_delay, self.refresh_interval))
+                retry_delay *= 2
+            elif self.snapshot_path:
+                self._stop.wait(min(self.refresh_interval, self.poll_interval))
+            else:
+                self._stop.wait(self.refresh_interval)
+
+    def load_snapshot(self):
+        """
+        Swap in the snapshot file if another process wrote a newer one
+
+        Returns:
+            True if a snapshot was loaded
+        """
+        if not self.snapshot_path:
+            return False
+        try:
+            mtime = os.stat(self.snapshot_path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._snapshot_mtime:
+            return False
+        with self._refresh_lock:
+            try:
+                snapshot = TickerSnapshot.load(self.snapshot_path)
+            except (OSError, ValueError) as e:
+                logger.warning("Could not load ticker snapshot %s: %s", self.snapshot_path, e)
+                return False
+            self._snapshot_mtime = mtime
+            self._swap(snapshot)
+            logger.info("Ticker directory mapped %s symbols from %s (%.0fs old)",
+                        len(snapshot), self.snapshot_path, time.time() - snapshot.created_at)
+            return True
+
+    def refresh(self):
+        """
+        Reload the listing and swap in a freshly built index
+
+        An empty listing, or one below TICKER_MIN_LISTING_RATIO of the current
+        one (most likely truncated), keeps the current index.
+
+        Returns:
+            Number of tickers in the directory after the refresh
+        """
+        with self._refresh_lock:
+            started = time.time()
+            tickers = self._fetch_pages(max_pages=self.max_pages)
+            if not tickers:
+                logger.warning("Ticker directory refresh returned no tickers, keeping previous index")
+                return len(self._snapshot)
+            if len(tickers) < TICKER_MIN_LISTING_RATIO * len(self._snapshot):
+                logger.warning("Ticker directory refresh returned %s tickers against %s before, keeping previous index",
+                               len(tickers), len(self._snapshot))
+                return len(self._snapshot)
+
+            snapshot = TickerSnapshot.from_tickers(tickers, created_at=started)
+            del tickers
+            if self.snapshot_path:
+                try:
+                    snapshot.save(self.snapshot_path)
+                    # Serve from the mapped file so this process shares its pages with the others
+                    self._snapshot_mtime = os.stat(self.snapshot_path).st_mtime_ns
+                    snapshot = TickerSnapshot.load(self.snapshot_path)
+                except OSError as e:
+                    logger.warning("Could not write ticker snapshot %s, keeping it in memory: %s",
+                                   self.snapshot_path, e)
+            self._swap(snapshot)
+            logger.info("Ticker directory loaded %s symbols (%s KiB) in %.2fs",
+                        len(snapshot), snapshot.nbytes // 1024, time.time() - started)
+            return len(snapshot)
+
+    def _swap(self, snapshot):
+        resolver = SymbolResolver.from_tickers({"symbol": symbol, "name": name} for symbol, name in snapshot.names())
+        # Rebinding the attributes is atomic, readers see either the old or the new index
+        self._snapshot = snapshot
+        self._resolver = resolver
+        self.last_refresh = snapshot.created_at
+        self._loaded.set()
+
+    @property
+    def loaded(self):
+        return self._loaded.is_set()
+
+    @property
+    def snapshot(self):
+        """The current TickerSnapshot, for column-wise reads."""
+        return self._snapshot
+
+    def wait_until_loaded(self, timeout=None):
+        """Block until the first load completes. Returns True if the directory is loaded."""
+        return self._loaded.wait(timeout)
+
+    def get(self, symbol):
+        """Return the ticker record for ``symbol`` or None."""
+        return self._snapshot.get(symbol)
+
+    def resolve(self, text, limit=MAX_QUERY_SYMBOLS):
+        """Return the listed symbols mentioned in ``text`` by ticker or company name, see SymbolResolver."""
+        return self._resolver.resolve(text, limit)
+
+    def search_name(self, prefix, limit=10):
+        """
+        Find tickers whose company name starts with ``prefix``
+
+        Args:
+            prefix: Case-insensitive name prefix (e.g., "apple")
+            limit: Maximum number of records to return
+
+        Returns:
+            List of ticker dictionaries ordered by name
+        """
+        snapshot = self._snapshot
+        return [snapshot.record(row) for row in snapshot.search_name(prefix, limit)]
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    def __contains__(self, symbol):
+        return self._snapshot.index(symbol) is not None if symbol else False
@@ -0,0 +1,222 @@
+import json
+import logging
+import math
+import mmap
+import os
+import tempfile
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Ticker snapshot configuration
+TICKER_SNAPSHOT_PATH = os.environ.get("TICKER_SNAPSHOT_PATH", "ticker_snapshot.bin")  # empty keeps the snapshot in memory
+
+SNAPSHOT_MAGIC = b"TICKSNP1"
+SNAPSHOT_ALIGNMENT = 64  # bytes, so every column starts on a cache line
+
+# Numeric listing fields and the column each is parsed into
+NUMERIC_FIELDS = {"lastsale": "price", "netchange": "net_change", "pctchange": "change_pct", "marketCap": "market_cap"}
+
+
+def parse_number(value):
+    """Parse a listing value such as "$227.52", "1.230%" or "3,460,000,000" into a float, NaN if it is not a number."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return math.nan
+    try:
+        return float(value.strip().lstrip("$").rstrip("%").replace(",", ""))
+    except ValueError:
+        return math.nan
+
+
+def _format_price(value):
+    return f"${value:.2f}" if value >= 1 else f"${value:.4f}"
+
+
+class TickerSnapshot:
+    """
+    Read-only columnar copy of the tickers listing.
+
+    Symbols are stored once, sorted, in a fixed-width byte column, so a
+    symbol is interned as its row number and found by binary search. Prices,
+    changes and market caps are float64 columns (NaN when the listing had no
+    number) and company names share one UTF-8 buffer. A snapshot saved to a
+    file is loaded through a read-only memory map, so every worker process on
+    a host shares the same physical pages instead of holding its own records.
+    """
+
+    def __init__(self, columns, created_at, source=None):
+        """
+        Args:
+            columns: Dictionary of column name to NumPy array, see from_tickers
+            created_at: Epoch seconds when the listing was fetched
+            source: Memory map backing the columns, kept open while they are in use
+        """
+        self.symbols = columns["symbols"]
+        self.price = columns["price"]
+        self.net_change = columns["net_change"]
+        self.change_pct = columns["change_pct"]
+        self.market_cap = columns["market_cap"]
+        self._name_data = columns["name_data"]
+        self._name_offsets = columns["name_offsets"]
+        self._name_order = columns["name_order"]  # rows sorted by lowercase name
+        self._columns = columns
+        self._source = source
+        self.created_at = created_at
+
+    @classmethod
+    def from_tickers(cls, tickers, created_at=None):
+        """
+        Build a snapshot from listing records
+
+        Records without a symbol are skipped and a symbol listed twice keeps
+        its last record.
+        """
+        records = {}
+        for ticker in tickers:
+            symbol = (ticker.get("symbol") or "").upper()
+            if symbol and symbol.isascii():
+                records[symbol] = ticker
+        symbols = sorted(records)
+        rows = [records[symbol] for symbol in symbols]
+
+        columns = {"symbols": np.array([s.encode("ascii") for s in symbols], dtype=f"S{max(map(len, symbols), default=1)}")}
+        for field, column in NUMERIC_FIELDS.items():
+            columns[column] = np.array([parse_number(row.get(field)) for row in rows], dtype=np.float64)
+
+        names = [row.get("name") or "" for row in rows]
+        encoded = [name.encode("utf-8") for name in names]
+        columns["name_offsets"] = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(name) for name in encoded], out=columns["name_offsets"][1:])
+        columns["name_data"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        order = sorted((i for i, name in enumerate(names) if name), key=lambda i: (names[i].lower(), symbols[i]))
+        columns["name_order"] = np.array(order, dtype=np.int32)
+        return cls(columns, time.time() if created_at is None else created_at)
+
+    def save(self, path):
+        """
+        Write the snapshot to ``path``
+
+        The file is written next to ``path`` and renamed over it, so processes
+        mapping the previous snapshot keep reading a complete file.
+        """
+        layout = {}
+        offset = 0
+        for name, column in self._columns.items():
+            layout[name] = [column.dtype.str, offset, len(column)]
+            offset += -(-column.nbytes // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+        header = json.dumps({"created_at": self.created_at, "count": len(self), "columns": layout}).encode("utf-8")
+        data_start = -(-(len(SNAPSHOT_MAGIC) + 8 + len(header)) // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+
+        directory = os.path.dirname(os.path.abspath(path))
+        descriptor, temp_path = tempfile.mkstemp(prefix=".ticker_snapshot.", dir=directory)
+        try:
+            with os.fdopen(descriptor, "wb") as f:
+                f.write(SNAPSHOT_MAGIC)
+                f.write(len(header).to_bytes(8, "little"))
+                f.write(header)
+                for name, column in self._columns.items():
+                    f.seek(data_start + layout[name][1])
+                    f.write(column.tobytes())
+                f.truncate(data_start + offset)
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """
+        Map a snapshot file written by save
+
+        Raises:
+            ValueError: If the file is not a ticker snapshot
+        """
+        with open(path, "rb") as f:
+            source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if source[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a ticker snapshot")
+        header_end = len(SNAPSHOT_MAGIC) + 8
+        header_length = int.from_bytes(source[len(SNAPSHOT_MAGIC):header_end], "little")
+        header = json.loads(source[header_end:header_end + header_length])
+        data_start = -(-(header_end + header_length) // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+        columns = {
+            name: np.frombuffer(source, dtype=np.dtype(dtype), count=count, offset=data_start + offset)
+            for name, (dtype, offset, count) in header["columns"].items()
+        }
+        return cls(columns, header["created_at"], source)
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self._columns.values())
+
+    def index(self, symbol):
+        """Return the row of ``symbol`` or None."""
+        try:
+            key = symbol.upper().encode("ascii")
+        except UnicodeEncodeError:
+            return None
+        if len(key) > self.symbols.dtype.itemsize:
+            return None
+        row = int(np.searchsorted(self.symbols, key))
+        if row < len(self.symbols) and self.symbols[row] == key:
+            return row
+        return None
+
+    def symbol(self, row):
+        return self.symbols[row].decode("ascii")
+
+    def name(self, row):
+        start, end = self._name_offsets[row], self._name_offsets[row + 1]
+        return self._name_data[start:end].tobytes().decode("utf-8")
+
+    def record(self, row):
+        """Return row ``row`` as a listing record with the listing's string formats."""
+        price, net_change, change_pct, market_cap = (
+            float(self.price[row]), float(self.net_change[row]), float(self.change_pct[row]), float(self.market_cap[row]))
+        return {
+            "symbol": self.symbol(row),
+            "name": self.name(row),
+            "lastsale": "N/A" if math.isnan(price) else _format_price(price),
+            "netchange": "N/A" if math.isnan(net_change) else f"{net_change:.2f}",
+            "pctchange": "N/A" if math.isnan(change_pct) else f"{change_pct:.3f}%",
+            "marketCap": "N/A" if math.isnan(market_cap) else f"{market_cap:,.0f}",
+        }
+
+    def get(self, symbol):
+        """Return the listing record for ``symbol`` or None."""
+        row = self.index(symbol) if symbol else None
+        return None if row is None else self.record(row)
+
+    def search_name(self, prefix, limit=10):
+        """Return the rows whose lowercase company name starts with ``prefix``, ordered by name."""
+        prefix = prefix.lower()
+        order = self._name_order
+        low, high = 0, len(order)
+        while low < high:
+            middle = (low + high) // 2
+            if self.name(order[middle]).lower() < prefix:
+                low = middle + 1
+            else:
+                high = middle
+        rows = []
+        for row in order[low:low + limit]:
+            if not self.name(row).lower().startswith(prefix):
+                break
+            rows.append(int(row))
+        return rows
+
+    def names(self):
+        """Yield ``(symbol, name)`` for every row."""
+        for row in range(len(self)):
+            yield self.symbol(row), self.name(row)
+
+    def __len__(self):
+        return len(self.symbols)
+
+
+EMPTY_SNAPSHOT = TickerSnapshot.from_tickers((), created_at=0)